@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+bench_gpx_load.py - Benchmark GPX timestamp parsing and loading
+
+Generates a synthetic GoPro style GPX file (18Hz telemetry) and times the dateutil timestamp path against the fast
+ISO-8601 path, the batch path and a full Gpx load.
+
+Usage:
+  bench_gpx_load.py [--points=<n>]
+
+Options:
+  -h --help         Show this screen.
+  --points=<n>      Number of track points to generate [default: 100000].
+'''
+import sys
+import os
+import time
+import tempfile
+import datetime
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import gpx  # pylint: disable=E0401
+
+try:
+    from docopt import docopt
+    import dateutil.parser as dup
+except ImportError as e:
+    installs = ['docopt', 'python-dateutil']
+    sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
+    sys.exit(1)
+
+
+def generate_time_strings(points, start=1656464400):
+    time_strings = []
+    for index in range(points):
+        dt = datetime.datetime.fromtimestamp(start + index / 18, datetime.timezone.utc)
+        time_strings.append(dt.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (dt.microsecond // 1000))
+    return time_strings
+
+
+def write_gpx(filename, time_strings):
+    with open(filename, 'w') as fd:
+        fd.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        fd.write('<gpx xmlns="http://www.topografix.com/GPX/1/1" xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1" version="1.1">\n')
+        fd.write('<metadata><time>%s</time></metadata>\n<trk><trkseg>\n' % time_strings[0])
+        for index, time_string in enumerate(time_strings):
+            fd.write('<trkpt lat="%f" lon="%f"><ele>%f</ele><time>%s</time><extensions><gpxtpx:TrackPointExtension>'
+                     '<gpxtpx:speed>%f</gpxtpx:speed></gpxtpx:TrackPointExtension></extensions></trkpt>\n'
+                     % (-33.859 - index * 1e-6, 151.205 + index * 1e-6, 10.0, time_string, 1.5))
+        fd.write('</trkseg></trk></gpx>\n')
+
+
+def timed(label, func):
+    time_start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - time_start
+    print('%-28s %8.3f s' % (label, elapsed))
+    return elapsed, result
+
+
+def main():
+    args = docopt(__doc__)
+    points = int(args['--points'])
+
+    time_strings = generate_time_strings(points)
+    print('points: %d' % points)
+
+    elapsed_dateutil, expected = timed('dateutil.parser.parse', lambda: [dup.parse(s).timestamp() for s in time_strings])
+    elapsed_fast, fast = timed('gpx.to_timestamp', lambda: [gpx.to_timestamp(s) for s in time_strings])
+    elapsed_batch, batch = timed('gpx.to_timestamps (batch)', lambda: gpx.to_timestamps(time_strings))
+
+    assert fast == expected
+    assert batch.tolist() == expected
+
+    print('speedup to_timestamp:  %6.1fx' % (elapsed_dateutil / elapsed_fast))
+    print('speedup to_timestamps: %6.1fx' % (elapsed_dateutil / elapsed_batch))
+
+    with tempfile.TemporaryDirectory() as directory:
+        gpx_filename = os.path.join(directory, 'bench.gpx')
+        write_gpx(gpx_filename, time_strings)
+        _, gpx_data = timed('gpx.Gpx load', lambda: gpx.Gpx(gpx_filename))
+        assert len(gpx_data.track) == points
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# Pre-stitched tile canvas for rendering chase frames.
+#
+# Rather than compositing every frame from individual tiles, tiles are stitched once into large canvas pages and
+# each frame is a slice of a page. Pages are laid out on a grid with a stride of 'page_tiles' tiles, and each page
+# extends past its stride by enough tiles to hold a whole viewport:
+#
+#   |<------ stride ------>|<- viewport ->|
+#   +----------------------+--------------+
+#   | viewport origins     |              |
+#   | within the stride    |   overlap    |
+#   +----------------------+--------------+
+#
+# so any viewport falls entirely within the page whose stride contains its top left corner, and can be returned as a
+# zero-copy view. Pages are built lazily from the decoded tile cache and kept in a small LRU. Pages are stored in BGR
+# channel order, ready for OpenCV. Views may be taken from several composition threads at once.
+#
+# An optional overlay of points per tile (e.g. the track) is drawn onto the page as each tile is stitched, so the
+# tiles themselves (and the tile cache) are never modified.
+#
+# 2026-10-17
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+import sys
+import math
+import logging
+import threading
+from collections import OrderedDict
+
+from . import openstreetmaps as osm
+
+try:
+    import numpy as np
+except ImportError as e:
+    installs = ['numpy']
+    sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
+    sys.exit(1)
+
+log = logging.getLogger(__name__)
+
+
+TILE_PIXELS = 256
+OVERLAY_COLOR = (255, 0, 0) # BGR blue
+
+
+def overlay_tile_pixels(tile_pixel_coords):
+    '''
+    (n, 2) integer array of the (x, y) pixels within a tile for overlay drawing. Coordinates are truncated to whole
+    pixels (as PIL's point drawing does) and those falling outside the tile are dropped.
+    '''
+    pixels = np.array(tile_pixel_coords, dtype=np.float64).reshape(-1, 2).astype(np.int64)
+    inside = np.all((pixels >= 0) & (pixels < TILE_PIXELS), axis=1)
+    return pixels[inside]
+
+
+class TileCanvas:
+
+    def __init__(self, decoded_tiles, zoom, pixels_x, pixels_y, tiles=None, page_tiles=8, max_pages=4, margin=0, overlay=None, overlay_color=OVERLAY_COLOR):
+        '''
+        If tiles is given, only those tiles are stitched (e.g. the planned tile set) and the rest are left black.
+        margin is the number of extra pixels views may extend past the viewport (e.g. 1 for sub-pixel shifts).
+        overlay maps tiles to (n, 2) arrays of (x, y) pixels within the tile, drawn in overlay_color (BGR).
+        '''
+        self.decoded_tiles = decoded_tiles
+        self.tiles = None if tiles is None else set(osm.tile_reference(tile) for tile in tiles)
+        self.zoom = zoom
+        self.pixels_x = pixels_x
+        self.pixels_y = pixels_y
+        self.page_tiles = page_tiles
+        self.max_pages = max_pages
+        self.stride_pixels = page_tiles * TILE_PIXELS
+        self.margin = margin
+        self.overlay = {} if overlay is None else {osm.tile_reference(tile): pixels for tile, pixels in overlay.items()}
+        self.overlay_color = overlay_color
+        self.page_tiles_x = page_tiles + int(math.ceil((pixels_x + margin) / TILE_PIXELS))
+        self.page_tiles_y = page_tiles + int(math.ceil((pixels_y + margin) / TILE_PIXELS))
+        self.pages_built = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def __repr__(self):
+        return '<%s zoom:%d page_tiles:(%d, %d) pages:%d pages_built:%d>' % (
+            self.__class__.__name__, self.zoom, self.page_tiles_x, self.page_tiles_y, len(self._pages), self.pages_built)
+
+
+    def _build_page(self, page_x, page_y):
+        tile_x_lo = page_x * self.page_tiles
+        tile_y_lo = page_y * self.page_tiles
+        log.debug('building canvas page (%d, %d) from tile (%d, %d)' % (page_x, page_y, tile_x_lo, tile_y_lo))
+
+        page = np.zeros((self.page_tiles_y * TILE_PIXELS, self.page_tiles_x * TILE_PIXELS, 3), dtype=np.uint8)
+        tiles = self.decoded_tiles.tile_cache if self.tiles is None else self.tiles
+        for tile_y_offset in range(self.page_tiles_y):
+            for tile_x_offset in range(self.page_tiles_x):
+                tile = osm.TilePoint(tile_x_lo + tile_x_offset, tile_y_lo + tile_y_offset, self.zoom)
+                if tile.x < 0 or tile.y < 0 or tile not in tiles:
+                    # Tiles outside the planned corridor (or not cached) are left black
+                    continue
+                y = tile_y_offset * TILE_PIXELS
+                x = tile_x_offset * TILE_PIXELS
+                page[y:y + TILE_PIXELS, x:x + TILE_PIXELS] = self.decoded_tiles.get(tile)[:, :, ::-1]
+
+                overlay_pixels = self.overlay.get(tile)
+                if overlay_pixels is not None:
+                    page[y + overlay_pixels[:, 1], x + overlay_pixels[:, 0]] = self.overlay_color
+
+        page.flags.writeable = False
+        self.pages_built += 1
+        return page
+
+
+    def _page(self, page_x, page_y):
+        key = (page_x, page_y)
+        page = self._pages.get(key)
+        if page is None:
+            page = self._build_page(page_x, page_y)
+            self._pages[key] = page
+            if len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(key)
+        return page
+
+
+    def view(self, x, y, margin=0):
+        '''
+        Read-only BGR view of the viewport with its top left corner at global integer pixel (x, y), extended by margin
+        pixels (up to the canvas margin) to the right and bottom
+        '''
+        page_x = x // self.stride_pixels
+        page_y = y // self.stride_pixels
+        with self._lock:
+            page = self._page(page_x, page_y)
+        page_offset_x = x - page_x * self.stride_pixels
+        page_offset_y = y - page_y * self.stride_pixels
+        return page[page_offset_y:page_offset_y + self.pixels_y + margin, page_offset_x:page_offset_x + self.pixels_x + margin]
@@ -8,59 +8,412 @@
 # Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
 #
 
+import io
+import os
+import re
 import sys
+import json
+import hashlib
 import logging
+import datetime
+from array import array
+from functools import lru_cache
+from xml.etree import ElementTree
 import dateutil.parser as dup
 
 from . import openstreetmaps as osm
+from . import utils
 
 try:
     from docopt import docopt
-    import xmltodict
+    import numpy as np
 except ImportError as e:
-    installs = ['docopt', 'xmltodict']
+    installs = ['docopt', 'numpy']
     sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
     sys.exit(1)
 
 log = logging.getLogger(__name__)
 
 
+# Fixed UTC form emitted by GoPro: YYYY-MM-DDTHH:MM:SS(.fff)Z - anything else is handed to dateutil
+_ISO8601_UTC = re.compile(r'(\d{4})-(\d\d)-(\d\d)T([01]\d|2[0-3]):([0-5]\d):([0-5]\d)(?:\.(\d{1,6}))?Z\Z')
+
+# Time offset: seconds or [[h:]m:]s with optional sign and fraction, e.g. 90, +1:30, 01:02:03.5
+_TIME_OFFSET = re.compile(r'([+-]?)(?:(\d+):)?(?:(\d+):)?(\d+(?:\.\d*)?)\Z')
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=32)
+def _utc_date_seconds(year, month, day):
+    ''' Epoch seconds at the start of the given UTC date (raises ValueError for invalid dates) '''
+    return (datetime.date(year, month, day).toordinal() - _EPOCH_ORDINAL) * 86400
+
+
 def to_timestamp(time_string):
+    match = _ISO8601_UTC.match(time_string)
+    if match is not None:
+        year, month, day, hour, minute, second, fraction = match.groups()
+        try:
+            seconds = _utc_date_seconds(int(year), int(month), int(day))
+        except ValueError:
+            pass
+        else:
+            seconds += int(hour) * 3600 + int(minute) * 60 + int(second)
+            microseconds = int(fraction.ljust(6, '0')) if fraction else 0
+            # Same integer microsecond arithmetic as datetime.timestamp() so results match the dateutil path exactly
+            return (seconds * 1000000 + microseconds) / 1000000
+
     dt = dup.parse(time_string)
     return dt.timestamp()
 
 
-def gpx_points_to_coordinates(gpx_points):
-    return map(lambda p: osm.Coordinate(p['lon'], p['lat']), gpx_points)
+def to_time_bound(value, reference_time):
+    '''
+    Epoch seconds for a time range bound given either as an offset from reference_time (seconds or [[h:]m:]s) or as
+    an absolute date/time
+    '''
+    match = _TIME_OFFSET.match(value.strip())
+    if match is None:
+        return to_timestamp(value)
+
+    sign, first, second, seconds = match.groups()
+    hours, minutes = (first, second) if second is not None else (None, first)
+    offset = int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds)
+    return reference_time - offset if sign == '-' else reference_time + offset
+
+
+def clip_track(track, start_time, tstart=None, tstop=None):
+    '''
+    Clip a track to the time range given by tstart/tstop bounds (see to_time_bound(), offsets are from start_time).
+    Returns the clipped track view and its start time: tstart if given, otherwise start_time.
+    '''
+    tstart_time = None if tstart is None else to_time_bound(tstart, start_time)
+    tstop_time = None if tstop is None else to_time_bound(tstop, start_time)
+    clipped_track = track.time_range(tstart_time, tstop_time)
+    log.info('time range: %r - %r, points: %d of %d' % (tstart_time, tstop_time, len(clipped_track), len(track)))
+
+    return clipped_track, start_time if tstart_time is None else tstart_time
+
+
+def to_timestamps(time_strings, out=None):
+    '''
+    Batch version of to_timestamp() filling a float64 array of epoch seconds. Conforming strings are converted
+    together by numpy's datetime64 parser, the rest fall back to to_timestamp() one at a time.
+    '''
+    time_strings = list(time_strings)
+    timestamps = np.empty(len(time_strings), dtype=np.float64) if out is None else out
+
+    fast_indexes = []
+    fast_strings = []
+    for index, time_string in enumerate(time_strings):
+        if _ISO8601_UTC.match(time_string):
+            fast_indexes.append(index)
+            fast_strings.append(time_string[:-1])
+        else:
+            timestamps[index] = to_timestamp(time_string)
+
+    if fast_strings:
+        try:
+            microseconds = np.array(fast_strings, dtype='datetime64[us]').astype(np.int64)
+        except ValueError:
+            # Out of range date fields somewhere in the batch - let the scalar path sort them out
+            microseconds = None
+        if microseconds is None:
+            for index, time_string in zip(fast_indexes, fast_strings):
+                timestamps[index] = to_timestamp(time_string + 'Z')
+        else:
+            timestamps[fast_indexes] = microseconds / 1000000
+
+    return timestamps
+
+
+class Track:
+    '''
+    Columnar store of track points. Each field is a contiguous float64 array, held as the rows of a single
+    (fields, points) block. Slicing and time range selection return views sharing the same block.
+    '''
+
+    FIELDS = ('time', 'lat', 'lon', 'ele', 'speed')
+
+    def __init__(self, columns):
+        columns = np.asarray(columns, dtype=np.float64)
+        if columns.ndim != 2 or columns.shape[0] != len(self.FIELDS):
+            raise ValueError('Track columns must have shape (%d, points), got %r' % (len(self.FIELDS), columns.shape))
+        self.columns = columns
+
+
+    @classmethod
+    def from_arrays(cls, time, lat, lon, ele, speed):
+        return cls(np.vstack([time, lat, lon, ele, speed]))
+
 
+    @property
+    def time(self):
+        return self.columns[0]
 
-def gpx_points_to_coordinate_timestamp_tuples(gpx_points):
-    return map(lambda p: (osm.Coordinate(p['lon'], p['lat']), p['time']), gpx_points)
+
+    @property
+    def lat(self):
+        return self.columns[1]
+
+
+    @property
+    def lon(self):
+        return self.columns[2]
+
+
+    @property
+    def ele(self):
+        return self.columns[3]
+
+
+    @property
+    def speed(self):
+        return self.columns[4]
+
+
+    def __len__(self):
+        return self.columns.shape[1]
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Track(self.columns[:, index])
+        return self.point(index)
+
+
+    def __repr__(self):
+        return '<%s points:%d>' % (self.__class__.__name__, len(self))
+
+
+    def point(self, index):
+        ''' Single track point as a dict (as per the original Gpx.points elements) '''
+        return dict(zip(self.FIELDS, self.columns[:, index].tolist()))
+
+
+    def time_range(self, tstart=None, tstop=None):
+        ''' View of the points with tstart <= time <= tstop (timestamps must be non-decreasing) '''
+        index_lo = 0 if tstart is None else int(np.searchsorted(self.time, tstart, side='left'))
+        index_hi = len(self) if tstop is None else int(np.searchsorted(self.time, tstop, side='right'))
+        return self[index_lo:index_hi]
+
+
+    def coordinates(self):
+        ''' Coordinate tuple of lon/lat arrays for use with the osm array transforms '''
+        return osm.Coordinate(self.lon, self.lat)
+
+
+    def all_points(self):
+        for values in self.columns.T.tolist():
+            yield dict(zip(self.FIELDS, values))
+
+
+class TrackBuilder:
+    ''' Accumulate track points one at a time into compact arrays, then build a Track '''
+
+    def __init__(self):
+        self._columns = [array('d') for _ in Track.FIELDS]
+
+
+    def __len__(self):
+        return len(self._columns[0])
+
+
+    def append(self, time, lat, lon, ele, speed):
+        for column, value in zip(self._columns, (time, lat, lon, ele, speed)):
+            column.append(value)
+
+
+    def extend(self, time, lat, lon, ele, speed):
+        ''' Append a block of points given as equal length sequences for each field '''
+        for column, values in zip(self._columns, (time, lat, lon, ele, speed)):
+            column.frombytes(np.asarray(values, dtype=np.float64).tobytes())
+
+
+    def build(self):
+        points = len(self)
+        columns = np.empty((len(Track.FIELDS), points), dtype=np.float64)
+        for row, column in enumerate(self._columns):
+            columns[row] = np.frombuffer(column, dtype=np.float64, count=points)
+        return Track(columns)
+
+
+def _local_name(tag):
+    ''' Strip any '{namespace}' prefix from an ElementTree tag '''
+    return tag.rpartition('}')[2]
+
+
+class TrackCache:
+    '''
+    Sidecar binary cache for a parsed GPX file. The track columns are saved as <gpx>.track.npy and memory mapped on
+    load; <gpx>.track.json holds the start time and the size, mtime and content hash of the GPX file they came from.
+    '''
+
+    VERSION = 1
+
+    def __init__(self, gpx_filename):
+        self.gpx_filename = os.fspath(gpx_filename)
+        self.columns_filename = self.gpx_filename + '.track.npy'
+        self.key_filename = self.gpx_filename + '.track.json'
+
+
+    def _content_hash(self):
+        sha1 = hashlib.sha1()
+        with open(self.gpx_filename, 'rb') as fd:
+            for block in iter(lambda: fd.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+
+    def load(self):
+        ''' Return (start_time, track) from the cache, or None if it is missing or stale '''
+        try:
+            with open(self.key_filename) as fd:
+                key = json.load(fd)
+            stat = os.stat(self.gpx_filename)
+        except (OSError, ValueError):
+            return None
+
+        if key.get('version') != self.VERSION or key.get('size') != stat.st_size:
+            return None
+        if key.get('mtime_ns') != stat.st_mtime_ns:
+            # Touched or copied file - only trust the cache if the content is unchanged
+            if key.get('sha1') != self._content_hash():
+                return None
+            key['mtime_ns'] = stat.st_mtime_ns
+            self._write_key(key)
+
+        try:
+            columns = np.load(self.columns_filename, mmap_mode='r')
+            track = Track(columns)
+        except (OSError, ValueError) as e:
+            log.warning('Ignoring unreadable track cache %s: %s' % (self.columns_filename, e))
+            return None
+        if len(track) != key.get('points'):
+            return None
+
+        log.debug('Loaded track cache: %s' % self.columns_filename)
+        return key['start_time'], track
+
+
+    def save(self, start_time, track):
+        stat = os.stat(self.gpx_filename)
+        key = {
+            'version': self.VERSION,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha1': self._content_hash(),
+            'start_time': start_time,
+            'points': len(track),
+        }
+        try:
+            utils.write_atomic(self.columns_filename, lambda fd: np.save(fd, np.ascontiguousarray(track.columns)))
+            self._write_key(key)
+        except OSError as e:
+            log.warning('Unable to write track cache for %s: %s' % (self.gpx_filename, e))
+
+
+    def _write_key(self, key):
+        utils.write_atomic(self.key_filename, lambda fd: fd.write(json.dumps(key).encode('utf-8')))
 
 
 class Gpx:
+    '''
+    Streaming GPX loader. Track points are parsed incrementally with iterparse and appended straight into the
+    track store - each trkpt element is discarded once read, so the full document is never held in memory.
 
-    def __init__(self, gpx_data):
-        log.debug('Parsing gpx_data')
-        self.doc = xmltodict.parse(gpx_data)
-        self.points = []
-        self.stream_start_time = to_timestamp(self.doc['gpx']['metadata']['time'])
+    gpx_source may be a file path, a file object or (for backwards compatibility) the GPX document itself. When it
+    is a path and use_cache is set, the parsed track is kept in a TrackCache sidecar and reused on later loads.
+    '''
+
+    def __init__(self, gpx_source, use_cache=True):
+        if isinstance(gpx_source, str) and gpx_source.lstrip().startswith('<'):
+            gpx_source = io.StringIO(gpx_source)
+        elif isinstance(gpx_source, bytes):
+            gpx_source = io.BytesIO(gpx_source)
+
+        track_cache = None
+        if use_cache and isinstance(gpx_source, (str, os.PathLike)):
+            track_cache = TrackCache(gpx_source)
+            cached = track_cache.load()
+            if cached is not None:
+                self.stream_start_time, self.track = cached
+                return
+
+        log.debug('Parsing gpx data')
+        self.stream_start_time = None
+        self.track = self._parse(gpx_source)
+        if self.stream_start_time is None:
+            if len(self.track) == 0:
+                raise ValueError('GPX data has no metadata time and no track points')
+            self.stream_start_time = float(self.track.time[0])
         log.debug('Start time: %r' % self.stream_start_time)
-        track_points = self.doc['gpx']['trk']['trkseg']['trkpt']
-        for point in track_points:
-            lat = float(point['@lat'])
-            lon = float(point['@lon'])
-            timestamp = to_timestamp(point['time'])
-            ele = float(point['ele'])
-            speed = float(point['extensions']['gpxtpx:TrackPointExtension']['gpxtpx:speed'])
-            log.debug('%.3f - lat: %f, lon: %f, ele: %f, speed: %f' % (timestamp, lat, lon, ele, speed))
-            element = {}
-            element['time'] = timestamp
-            element['lat'] = lat
-            element['lon'] = lon
-            element['ele'] = ele
-            element['speed'] = speed
-            self.points.append(element)
+
+        if track_cache is not None:
+            track_cache.save(self.stream_start_time, self.track)
+
+
+    # Number of track points parsed before their timestamps are converted as a batch
+    PARSE_CHUNK_POINTS = 4096
+
+    def _parse(self, gpx_source):
+        track_builder = TrackBuilder()
+        debug = log.isEnabledFor(logging.DEBUG)
+        elements = []
+        chunk = ([], [], [], [], [])
+
+        for event, element in ElementTree.iterparse(gpx_source, events=('start', 'end')):
+            if event == 'start':
+                elements.append(element)
+                continue
+
+            elements.pop()
+            name = _local_name(element.tag)
+            if name == 'trkpt':
+                lat = float(element.get('lat'))
+                lon = float(element.get('lon'))
+                time_string, ele, speed = self._track_point_values(element)
+                if debug:
+                    log.debug('%s - lat: %f, lon: %f, ele: %f, speed: %f' % (time_string, lat, lon, ele, speed))
+                for values, value in zip(chunk, (time_string, lat, lon, ele, speed)):
+                    values.append(value)
+                if len(chunk[0]) >= self.PARSE_CHUNK_POINTS:
+                    self._flush_chunk(chunk, track_builder)
+                # Drop the parsed point from the tree so memory use does not grow with the track length
+                elements[-1].remove(element)
+            elif name == 'time' and elements and _local_name(elements[-1].tag) == 'metadata':
+                self.stream_start_time = to_timestamp(element.text.strip())
+
+        self._flush_chunk(chunk, track_builder)
+        return track_builder.build()
+
+
+    @staticmethod
+    def _flush_chunk(chunk, track_builder):
+        time_strings, lats, lons, eles, speeds = chunk
+        if time_strings:
+            track_builder.extend(to_timestamps(time_strings), lats, lons, eles, speeds)
+        for values in chunk:
+            values.clear()
+
+
+    @staticmethod
+    def _track_point_values(trkpt):
+        time_string = None
+        ele = float('nan')
+        speed = float('nan')
+        for child in trkpt.iter():
+            name = _local_name(child.tag)
+            if name == 'time':
+                time_string = child.text.strip()
+            elif name == 'ele':
+                ele = float(child.text)
+            elif name == 'speed':
+                speed = float(child.text)
+        if time_string is None:
+            raise ValueError('Track point has no time: lat=%s, lon=%s' % (trkpt.get('lat'), trkpt.get('lon')))
+        return time_string, ele, speed
 
 
     def start_time(self):
@@ -68,19 +421,13 @@ class Gpx:
 
 
     def all_points(self):
-        for point in self.points:
-            yield point
+        return self.track.all_points()
 
 
 
 if __name__ == '__main__':
-    with open('temp.gpx') as fd:
-        s = fd.read()
-    g = Gpx(s)
+    g = Gpx('temp.gpx')
     log.info(g.start_time())
     points_iter = g.all_points()
     log.info(next(points_iter))
     log.info(next(points_iter))
-
-
-# TODO: consider returning points as osm.Coordinate type
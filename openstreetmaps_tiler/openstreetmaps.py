@@ -17,8 +17,9 @@ import logging
 
 try:
     import sh
+    import numpy as np
 except ImportError as e:
-    installs = ['sh']
+    installs = ['sh', 'numpy']
     sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
     sys.exit(1)
 
@@ -108,6 +109,79 @@ def pixel_point_round(pixel_point):
     return pixel_round
 
 
+# Array transforms - these operate on the same tuple types, but with each field holding a numpy array so that a
+# whole track can be converted in one call. The zoom field may be a scalar or an array.
+
+def coordinates_to_tile_points(coordinates, zoom):
+    ''' Convert 'Coordinate' of lon/lat arrays to 'TilePoint' of x/y arrays '''
+    tile_points = TilePoint(
+                    _coordinates_lon_to_tile_x(coordinates.lon, zoom),
+                    _coordinates_lat_to_tile_y(coordinates.lat, zoom),
+                    zoom)
+    return tile_points
+
+
+def tile_points_to_coordinates(tile_points):
+    ''' Convert 'TilePoint' of x/y arrays to 'Coordinate' of lon/lat arrays '''
+    coordinates = Coordinate(
+                    _tiles_x_to_coordinate_lon(tile_points.x, tile_points.zoom),
+                    _tiles_y_to_coordinate_lat(tile_points.y, tile_points.zoom))
+    return coordinates
+
+
+def coordinates_to_pixel_points(coordinates, zoom):
+    ''' Convert 'Coordinate' of lon/lat arrays to 'PixelPoint' of x/y arrays '''
+    pixels = PixelPoint(
+        _coordinates_lon_to_tile_x(coordinates.lon, zoom) * 256,
+        _coordinates_lat_to_tile_y(coordinates.lat, zoom) * 256,
+        zoom,
+    )
+    return pixels
+
+
+def pixel_points_to_coordinates(pixel_points):
+    ''' Convert 'PixelPoint' of x/y arrays to 'Coordinate' of lon/lat arrays '''
+    coordinates = Coordinate(
+        _tiles_x_to_coordinate_lon(np.asarray(pixel_points.x, dtype=np.float64) / 256, pixel_points.zoom),
+        _tiles_y_to_coordinate_lat(np.asarray(pixel_points.y, dtype=np.float64) / 256, pixel_points.zoom),
+    )
+    return coordinates
+
+
+def tile_points_to_pixel_points(tile_points):
+    ''' Convert 'TilePoint' of x/y arrays to 'PixelPoint' of x/y arrays '''
+    coordinates = tile_points_to_coordinates(tile_points)
+    pixels = coordinates_to_pixel_points(coordinates, tile_points.zoom)
+    return pixels
+
+
+def pixel_points_to_tile_points(pixel_points):
+    ''' Convert 'PixelPoint' of x/y arrays to 'TilePoint' of x/y arrays '''
+    coordinates = pixel_points_to_coordinates(pixel_points)
+    tile_points = coordinates_to_tile_points(coordinates, pixel_points.zoom)
+    return tile_points
+
+
+def tile_references(tile_points):
+    ''' Truncate TilePoint arrays to tile reference values (integer arrays) '''
+    tile_refs = TilePoint(
+        np.asarray(tile_points.x).astype(np.int64),
+        np.asarray(tile_points.y).astype(np.int64),
+        np.asarray(tile_points.zoom).astype(np.int64),
+    )
+    return tile_refs
+
+
+def pixel_points_round(pixel_points):
+    ''' Round PixelPoint arrays to integer values '''
+    pixels_round = PixelPoint(
+        np.round(pixel_points.x).astype(np.int64),
+        np.round(pixel_points.y).astype(np.int64),
+        pixel_points.zoom
+    )
+    return pixels_round
+
+
 def download_tile(tile_point, output_filename):
     # Truncate to integer tile coordinates
     tile_ref = tile_reference(tile_point)
@@ -151,6 +225,43 @@ def _tile_y_to_coordinate_lat(ytile, zoom):
     return lat_deg
 
 
+# Coordinate to tile scale array conversions
+
+def _coordinates_lon_to_tile_x(lon_deg, zoom):
+    lon_deg = np.asarray(lon_deg, dtype=np.float64)
+    out_of_range = (lon_deg > 180) | (lon_deg < -180)
+    if np.any(out_of_range):
+        raise ConversionException('Degrees beyond conversion range: %f' % lon_deg[out_of_range].flat[0])
+    n = 2.0 ** np.asarray(zoom)
+    xfloat = (lon_deg + 180.0) / 360.0 * n
+
+    return xfloat
+
+
+def _coordinates_lat_to_tile_y(lat_deg, zoom):
+    lat_deg = np.asarray(lat_deg, dtype=np.float64)
+    out_of_range = (lat_deg > 85.05113) | (lat_deg < -85.05113)
+    if np.any(out_of_range):
+        raise ConversionException('Degrees beyond conversion range: %f' % lat_deg[out_of_range].flat[0])
+    n = 2.0 ** np.asarray(zoom)
+    lat_rad = np.radians(lat_deg)
+    yfloat = (1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n
+
+    return yfloat
+
+
+def _tiles_x_to_coordinate_lon(xtile, zoom):
+    n = 2.0 ** np.asarray(zoom)
+    lon_deg = (np.asarray(xtile, dtype=np.float64) / n * 360) - 180.0
+    return lon_deg
+
+
+def _tiles_y_to_coordinate_lat(ytile, zoom):
+    n = 2.0 ** np.asarray(zoom)
+    lat_deg = np.degrees(np.arctan(np.sinh((- (np.asarray(ytile, dtype=np.float64) / n * 2.0) + 1.0) * np.pi)))
+    return lat_deg
+
+
 # Coordinate to pixel scale conversions
 
 def _coordinate_lon_to_pixel_x(lon_deg, zoom):
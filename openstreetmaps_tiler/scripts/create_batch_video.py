@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+'''
+create_batch_video.py - Create overview and chase videos for many GPX files from a job manifest
+
+Usage:
+  create_batch_video.py <manifest> [--tile-cache=<directory>] [--no-gpx-cache] [--download-workers=<n>] [--download-rate=<tiles>] [--tile-memory=<MB>] [--workers=<n>]
+
+Options:
+  -h --help                 Show this screen.
+  --tile-cache=<directory>  Tile cache directory, or a file ending in .mbtiles for MBTiles storage [default: tiles].
+  --no-gpx-cache            Don't read or write the parsed GPX track cache (<gpx-data>.track.*).
+  --download-workers=<n>    Concurrent tile download connections [default: 2].
+  --download-rate=<tiles>   Maximum tile downloads per second (0 for unlimited) [default: 10].
+  --tile-memory=<MB>        Memory for decoded tiles shared by all chase video jobs in megabytes [default: 1024].
+  --workers=<n>             Videos rendered at the same time in worker processes (0 for the number of CPUs) [default: 0].
+
+The manifest is a JSON file listing the videos to render. Settings in "defaults" apply to every job, and relative
+paths are relative to the manifest:
+
+  {
+    "defaults": {"viewport_x": 1022, "viewport_y": 1022, "fps": 25, "interpolate": "none"},
+    "jobs": [
+      {"gpx": "ride.gpx", "view": "overview", "output": "clip1_overview.mp4", "tstart": "0", "tstop": "10:00"},
+      {"gpx": "ride.gpx", "view": "chase", "zoom": 17, "output": "clip1_chase.mp4", "tstart": "0", "tstop": "10:00"}
+    ]
+  }
+
+Job settings: gpx, view (overview or chase), output, zoom (chase only), tstart, tstop, viewport_x, viewport_y, fps,
+interpolate, grid_lines, quality and max_tiles (overview only).
+'''
+import os
+import sys
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from dateutil.tz import tzlocal
+
+logging.basicConfig(level=logging.INFO, format='(%(threadName)-10s) %(message)-s')
+
+from openstreetmaps_tiler import gpx
+from openstreetmaps_tiler import tile_downloader
+from openstreetmaps_tiler import tile_cache as tc
+from openstreetmaps_tiler import timeline
+from openstreetmaps_tiler.scripts import create_chase_video
+from openstreetmaps_tiler.scripts import create_overview_video
+
+try:
+    from docopt import docopt
+except ImportError as e:
+    installs = ['docopt']
+    sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
+    sys.exit(1)
+
+
+log = logging.getLogger(__name__)
+
+
+VIEW_OVERVIEW = 'overview'
+VIEW_CHASE = 'chase'
+
+JOB_DEFAULTS = {
+    'tstart': None,
+    'tstop': None,
+    'viewport_x': 1022,
+    'viewport_y': 1022,
+    'fps': 25,
+    'interpolate': timeline.INTERPOLATE_NONE,
+    'grid_lines': False,
+    'quality': create_overview_video.DEFAULT_QUALITY,
+    'max_tiles': 0,
+}
+
+
+# Decoded tiles for the chase jobs, loaded by the parent before the render processes start. Forked workers inherit
+# them and share the memory copy-on-write; workers started any other way build their own
+_decoded_tiles = None
+_inherited_tile_cache = None
+
+
+class ManifestException(Exception):
+    pass
+
+
+def load_manifest(manifest_filename):
+    ''' List of job settings dicts from a manifest file, with defaults applied and paths resolved '''
+    with open(manifest_filename) as fd:
+        manifest = json.load(fd)
+
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_filename))
+    defaults = dict(JOB_DEFAULTS, **manifest.get('defaults', {}))
+
+    jobs = []
+    for index, job_settings in enumerate(manifest.get('jobs', [])):
+        job = dict(defaults, **job_settings)
+        for name in ('gpx', 'view', 'output'):
+            if name not in job:
+                raise ManifestException('job %d: missing "%s"' % (index, name))
+        if job['view'] not in (VIEW_OVERVIEW, VIEW_CHASE):
+            raise ManifestException('job %d: unknown view "%s" (expected %s or %s)' % (index, job['view'], VIEW_OVERVIEW, VIEW_CHASE))
+        if job['view'] == VIEW_CHASE and 'zoom' not in job:
+            raise ManifestException('job %d: chase video needs a "zoom"' % index)
+        if job['interpolate'] not in timeline.INTERPOLATE_MODES:
+            raise ManifestException('job %d: interpolate must be one of: %s' % (index, ', '.join(timeline.INTERPOLATE_MODES)))
+
+        job['gpx'] = os.path.join(manifest_directory, job['gpx'])
+        job['output'] = os.path.join(manifest_directory, job['output'])
+        for name in ('tstart', 'tstop'):
+            if job[name] is not None:
+                job[name] = str(job[name])
+        jobs.append(job)
+
+    return jobs
+
+
+def prepare_job(job, gpx_files, tile_cache, downloader, use_gpx_cache=True):
+    ''' Load (once per file) and clip the job's track, then prepare tiles and positions for the view '''
+    gpx_data = gpx_files.get(job['gpx'])
+    if gpx_data is None:
+        gpx_data = gpx.Gpx(job['gpx'], use_cache=use_gpx_cache)
+        gpx_files[job['gpx']] = gpx_data
+
+    track, track_start_time = gpx.clip_track(gpx_data.track, gpx_data.start_time(), job['tstart'], job['tstop'])
+    if len(track) == 0:
+        raise ManifestException('%s: no track points in the time range' % job['output'])
+
+    if job['view'] == VIEW_CHASE:
+        return create_chase_video.prepare_chase_video(track, track_start_time, int(job['zoom']), tile_cache, downloader,
+                                                      int(job['viewport_x']), int(job['viewport_y']), int(job['fps']), job['interpolate'])
+
+    background_file = job['output'] + '.background.png'
+    return create_overview_video.prepare_overview_video(track, track_start_time, background_file, tile_cache, downloader,
+                                                        int(job['viewport_x']), int(job['viewport_y']), bool(job['grid_lines']),
+                                                        quality=float(job['quality']), max_tiles=int(job['max_tiles']))
+
+
+def render_job(job, plan, decoded_tiles):
+    start_time = datetime.now(tzlocal())
+    log.info('rendering: %s' % job['output'])
+
+    if job['view'] == VIEW_CHASE:
+        create_chase_video.render_chase_video(plan, job['output'], decoded_tiles)
+    else:
+        create_overview_video.render_overview_video(plan, job['output'], fps=int(job['fps']), interpolate=job['interpolate'])
+
+    total_time = datetime.now(tzlocal()) - start_time
+    log.info('rendered: %s (%0.3fs)' % (job['output'], total_time.total_seconds()))
+
+
+def init_render_worker(tile_cache_location, tile_memory_bytes):
+    ''' Render process initializer: open a tile cache of the worker's own behind the (inherited or new) decoded tiles '''
+    global _decoded_tiles, _inherited_tile_cache # pylint: disable=W0603
+    tile_cache = tc.open_tile_cache(tile_cache_location)
+    if _decoded_tiles is None:
+        _decoded_tiles = tc.DecodedTileCache(tile_cache, max_bytes=tile_memory_bytes)
+    else:
+        # Keep the parent's tile cache object alive (unused) rather than closing its connection in the child
+        _inherited_tile_cache = _decoded_tiles.tile_cache
+        _decoded_tiles.tile_cache = tile_cache
+
+
+def render_job_in_worker(job_plan):
+    job, plan = job_plan
+    render_job(job, plan, _decoded_tiles)
+
+
+def render_context():
+    ''' Fork the render processes where possible, so they inherit the decoded tiles '''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def main():
+    global _decoded_tiles # pylint: disable=W0603
+
+    start_time = datetime.now(tzlocal())
+    args = docopt(__doc__)
+
+    manifest_filename = args['<manifest>']
+    tile_directory = args['--tile-cache']
+    use_gpx_cache = not bool(args['--no-gpx-cache'])
+    download_workers = int(args['--download-workers'])
+    download_rate = float(args['--download-rate'])
+    tile_memory_bytes = int(float(args['--tile-memory']) * 1024 * 1024)
+    workers = int(args['--workers']) or os.cpu_count() or 1
+
+    log.info('start_time: %s' % start_time.isoformat())
+    log.info('manifest: %s' % manifest_filename)
+
+    try:
+        jobs = load_manifest(manifest_filename)
+    except (OSError, ValueError, ManifestException) as e:
+        log.error('manifest: %s' % e)
+        sys.exit(1)
+
+    log.info('jobs: %d, workers: %d' % (len(jobs), workers))
+
+    with tc.open_tile_cache(tile_directory) as tile_cache:
+        # Prepare every job up front against the one tile cache and download pool: each GPX file is parsed once, and
+        # all tiles are downloaded (and each chase track overlay built) before anything reads the tiles for rendering
+        gpx_files = {}
+        with tile_downloader.TileDownloader(workers=download_workers, rate_limit=download_rate) as downloader:
+            try:
+                plans = [prepare_job(job, gpx_files, tile_cache, downloader, use_gpx_cache) for job in jobs]
+            except ManifestException as e:
+                log.error(e)
+                sys.exit(1)
+        tile_cache.flush()
+
+        # Chase videos share one decoded tile cache, loaded once with every tile any of them needs
+        context = render_context()
+        chase_tiles = {}
+        for job, plan in zip(jobs, plans):
+            if job['view'] == VIEW_CHASE:
+                chase_tiles.update((tc.tile_key(tile), tile) for tile in plan.tiles)
+        if context.get_start_method() == 'fork':
+            _decoded_tiles = tc.DecodedTileCache(tile_cache, max_bytes=tile_memory_bytes)
+            _decoded_tiles.preload(list(chase_tiles.values()))
+            log.info('decoded tile cache: %r' % _decoded_tiles)
+            worker_tile_memory_bytes = tile_memory_bytes
+        else:
+            # Each worker decodes the tiles for its own jobs
+            worker_tile_memory_bytes = tile_memory_bytes // workers
+
+        # Render the jobs across worker processes, one job per process at a time
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_render_worker,
+                                 initargs=(tile_directory, worker_tile_memory_bytes)) as executor:
+            for _ in executor.map(render_job_in_worker, zip(jobs, plans)):
+                pass
+
+    end_time = datetime.now(tzlocal())
+    total_time = end_time - start_time
+    log.info('end_time: %s' % end_time.isoformat())
+    log.info('total_time(s): %0.3f' % total_time.total_seconds())
+
+
+if __name__ == '__main__':
+    main()
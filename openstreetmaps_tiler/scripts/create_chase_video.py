@@ -3,29 +3,37 @@
 create_chase_video.py - Create track chase video from GPX data
 
 Usage:
-  create_chase_video.py <gpx-data> <zoom-factor> [--output=<filename>] [--tile-cache=<directory>] [--viewport-x=<pixels>] [--viewport-y=<pixels>] [--fps=<fps>]
+  create_chase_video.py <gpx-data> <zoom-factor> [--output=<filename>] [--tile-cache=<directory>] [--viewport-x=<pixels>] [--viewport-y=<pixels>] [--fps=<fps>] [--no-gpx-cache] [--download-workers=<n>] [--download-rate=<tiles>] [--tile-memory=<MB>] [--workers=<n>] [--interpolate=<mode>] [--tstart=<time>] [--tstop=<time>] [--synthesize-tiles] [--prefer-synthesis]
 
 Options:
   -h --help                 Show this screen.
   --output=<filename>       Output filename [default: output.mp4].
-  --tile-cache=<directory>  Tile cache directory [default: tiles].
+  --tile-cache=<directory>  Tile cache directory, or a file ending in .mbtiles for MBTiles storage [default: tiles].
   --viewport-x=<pixels>     Output video viewport x dimension pixels [default: 1022].
   --viewport-y=<pixels>     Output video viewport x dimension pixels [default: 1022].
   --fps=<fps>               Frames per second of output video [default: 25].
+  --no-gpx-cache            Don't read or write the parsed GPX track cache (<gpx-data>.track.*).
+  --download-workers=<n>    Concurrent tile download connections [default: 2].
+  --download-rate=<tiles>   Maximum tile downloads per second (0 for unlimited) [default: 10].
+  --tile-memory=<MB>        Memory for decoded tiles shared by the frame renderer in megabytes [default: 1024].
+  --workers=<n>             Render video segments in parallel worker processes (needs ffmpeg for more than 1) [default: 1].
+  --interpolate=<mode>      Track position between samples: none (step to each sample), linear or spline [default: none].
+  --tstart=<time>           Start of the time range to render: offset from the GPX start time in seconds or [[h:]m:]s, or an absolute time.
+  --tstop=<time>            End of the time range to render, in the same forms as --tstart.
+  --synthesize-tiles        Build tiles that fail to download from cached tiles at neighbouring zooms (upscaled ancestors or downsampled children).
+  --prefer-synthesis        Build tiles from cached tiles at neighbouring zooms instead of downloading them where possible (implies --synthesize-tiles).
 '''
 # TODO: other options:
 #   pixels_x = output x size in pixels
 #   pixels_y = output y size in pixels
 #   fps
-#   tstart
-#   tstop
 #   --grid-lines
 import sys
+import math
 import logging
-import os
 import shutil
 from collections import namedtuple
-from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from dateutil.tz import tzlocal
 
@@ -33,212 +41,299 @@ logging.basicConfig(level=logging.INFO, format='(%(threadName)-10s) %(message)-s
 
 from openstreetmaps_tiler import openstreetmaps as osm
 from openstreetmaps_tiler import gpx
-from openstreetmaps_tiler import utils
+from openstreetmaps_tiler import tile_downloader
+from openstreetmaps_tiler import tile_cache as tc
+from openstreetmaps_tiler import canvas
+from openstreetmaps_tiler import video as vid
+from openstreetmaps_tiler import timeline
 
 try:
     from docopt import docopt
-    from PIL import Image
-    from PIL import ImageDraw, ImageColor, ImageFont
     import cv2
     import numpy as np
 except ImportError as e:
-    installs = ['docopt', 'Pillow', 'opencv-python', 'numpy']
+    installs = ['docopt', 'opencv-python', 'numpy']
     sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
     sys.exit(1)
 
 
-ViewportOffsets = namedtuple('Coordinate', 'x_lo y_lo x_hi y_hi')
+ViewportOffsets = namedtuple('ViewportOffsets', 'x_lo y_lo x_hi y_hi')
+ChasePlan = namedtuple('ChasePlan', 'frame_positions tiles offsets zoom pixels_x pixels_y fps overlay')
 
 log = logging.getLogger(__name__)
 
 
-def load_gpx_data(gpx_filename):
-    with open(gpx_filename) as fd:
-        gpx_raw = fd.read()
-    gpx_data = gpx.Gpx(gpx_raw)
+def load_gpx_data(gpx_filename, use_cache=True):
+    gpx_data = gpx.Gpx(gpx_filename, use_cache=use_cache)
     return gpx_data
 
 
-def download_tiles(gpx_data, zoom_factor, viewport_offsets, tile_directory):
-    file_map = {}
-
-    for coordinate in gpx.gpx_points_to_coordinates(gpx_data.all_points()):
-        pixel_point = osm.coordinate_to_pixel_point(coordinate, zoom_factor)
+def plan_track_tiles(track, zoom_factor, viewport_offsets, frame_positions=None):
+    '''
+    Calculate the set of tiles needed to render the viewport at every point of the track. Viewport tile spans are
+    calculated for all points at once and deduplicated before being expanded, so the cost scales with the number of
+    unique tiles rather than the number of points. Interpolated (fractional) frame positions can be given to plan for
+    frames that fall between the track points.
+    '''
+    if len(track) == 0:
+        return []
+
+    # Frames are rendered at rounded pixel positions, so plan for the same positions
+    track_pixels = osm.pixel_points_round(osm.coordinates_to_pixel_points(track.coordinates(), zoom_factor))
+    plan_x_lo = plan_x_hi = track_pixels.x
+    plan_y_lo = plan_y_hi = track_pixels.y
+    if frame_positions:
+        # Sub-pixel frames are shifted from a view spanning the pixels either side of the frame position
+        frame_x, frame_y = np.array(frame_positions, dtype=np.float64).T
+        plan_x_lo = np.concatenate((plan_x_lo, np.floor(frame_x).astype(np.int64)))
+        plan_y_lo = np.concatenate((plan_y_lo, np.floor(frame_y).astype(np.int64)))
+        plan_x_hi = np.concatenate((plan_x_hi, np.ceil(frame_x).astype(np.int64)))
+        plan_y_hi = np.concatenate((plan_y_hi, np.ceil(frame_y).astype(np.int64)))
+
+    pixels_lo = osm.PixelPoint(plan_x_lo + viewport_offsets.x_lo, plan_y_lo + viewport_offsets.y_lo, zoom_factor)
+    pixels_hi = osm.PixelPoint(plan_x_hi + viewport_offsets.x_hi, plan_y_hi + viewport_offsets.y_hi, zoom_factor)
+    tiles_lo = osm.tile_references(osm.pixel_points_to_tile_points(pixels_lo))
+    tiles_hi = osm.tile_references(osm.pixel_points_to_tile_points(pixels_hi))
+
+    tile_spans = np.unique(np.column_stack((tiles_lo.x, tiles_lo.y, tiles_hi.x, tiles_hi.y)), axis=0)
+    log.debug('planned positions: %d, unique viewport tile spans: %d' % (len(plan_x_lo), len(tile_spans)))
+
+    tile_keys = set()
+    for x_lo, y_lo, x_hi, y_hi in tile_spans.tolist():
+        for x in range(x_lo, x_hi + 1):
+            for y in range(y_lo, y_hi + 1):
+                tile_keys.add((x, y))
+
+    return [osm.TilePoint(x, y, zoom_factor) for x, y in sorted(tile_keys)]
+
+
+def download_tiles(tiles, tile_cache, downloader):
+    ''' Download any of the tiles not already in the tile cache '''
+    missing_tiles = tile_cache.missing(tiles)
+
+    log.info('tiles: %d, downloading: %d' % (len(tiles), len(missing_tiles)))
+    try:
+        downloader.download(missing_tiles, tile_cache.put)
+    except tile_downloader.TileDownloadException as e:
+        # Tiles that failed to download can still be synthesized from cached tiles at other zooms
+        if not isinstance(tile_cache, tc.SynthesizingTileCache) or tile_cache.unavailable(missing_tiles):
+            raise
+        log.warning('%s - synthesizing them instead' % e)
+    tile_cache.flush()
+
+
+def build_track_overlay(track, zoom_factor):
+    '''
+    Track points to draw over the map, by tile: {TilePoint: (n, 2) array of (x, y) pixels within the tile}. The
+    overlay is drawn onto the canvas as it is stitched, so the cached tiles are never modified.
 
-        tiles_in_view = get_tiles_in_viewport(pixel_point, viewport_offsets)
-        for tile in tiles_in_view:
-                key = (tile.x, tile.y)
-                output_filename = get_tile_path(tile, tile_directory)
-                file_map[key] = output_filename
-                if not os.path.exists(output_filename):
-                    osm.download_tile(tile, output_filename)
+    All points are converted in one pass, then sorted and deduplicated by (tile, pixel) so each tile's points are a
+    contiguous run, making the cost linear in the number of points (plus the sort).
+    '''
+    if len(track) == 0:
+        return {}
+
+    # Convert the whole track to tile references and rounded pixel locations up front
+    track_coordinates = track.coordinates()
+    track_tiles = osm.tile_references(osm.coordinates_to_tile_points(track_coordinates, zoom_factor))
+    track_pixels = osm.pixel_points_round(osm.coordinates_to_pixel_points(track_coordinates, zoom_factor))
+
+    # Unique (tile x, tile y, pixel x, pixel y) rows, grouped by tile
+    locations = np.unique(np.column_stack((track_tiles.x, track_tiles.y, track_pixels.x, track_pixels.y)), axis=0)
+    tile_keys, tile_starts = np.unique(locations[:, :2], axis=0, return_index=True)
+    tile_stops = np.append(tile_starts[1:], len(locations))
+    log.debug('track points: %d, unique pixels: %d, tiles: %d' % (len(track), len(locations), len(tile_keys)))
+
+    # Convert each tile's points to pixels within the tile
+    overlay = {}
+    for (tile_x, tile_y), index_lo, index_hi in zip(tile_keys.tolist(), tile_starts.tolist(), tile_stops.tolist()):
+        tile = osm.TilePoint(tile_x, tile_y, zoom_factor)
+        tile_pixel_ref = osm.tile_point_to_pixel_point(tile)
+        image_track_pixel_coords = np.column_stack((
+            locations[index_lo:index_hi, 2] - tile_pixel_ref.x,
+            locations[index_lo:index_hi, 3] - tile_pixel_ref.y,
+        ))
+        overlay[tile] = canvas.overlay_tile_pixels(image_track_pixel_coords)
 
-    log.debug('file_map: %r' % file_map)
+    return overlay
 
 
-def get_tiles_in_viewport(pixel_point, viewport_offsets):
-    tile_set = []
-    # Calculate pixel offset bounding points
-    pixel_lo = osm.PixelPoint(
-                    pixel_point.x + viewport_offsets.x_lo,
-                    pixel_point.y + viewport_offsets.y_lo,
-                    pixel_point.zoom
-    )
-    pixel_hi = osm.PixelPoint(
-                    pixel_point.x + viewport_offsets.x_hi,
-                    pixel_point.y + viewport_offsets.y_hi,
-                    pixel_point.zoom
-    )
-    # Convert to tile references
-    tile_lo = osm.tile_reference(osm.pixel_point_to_tile_point(pixel_lo))
-    tile_hi = osm.tile_reference(osm.pixel_point_to_tile_point(pixel_hi))
-    for x in range(tile_lo.x, tile_hi.x + 1):
-        for y in range(tile_lo.y, tile_hi.y + 1):
-            tile = osm.TilePoint(x, y, pixel_point.zoom)
-            tile_set.append(tile)
+def frame_pixel_positions(track_pixels, track_times, fps=25, start_time=None, interpolate=timeline.INTERPOLATE_NONE):
+    '''
+    Takes the track pixel positions (a PixelPoint of arrays) and the matching sample timestamps
+    Returns the track pixel position (x, y) shown in each video frame: rounded to whole pixels, or fractional when
+    interpolating.
+    '''
+    if start_time is None:
+        start_time = track_times[0]
+    finish_time = track_times[-1]
 
-    return sorted(tile_set)
+    log.info(start_time)
+    log.info(finish_time)
+    total_seconds = finish_time - start_time
+    log.info(total_seconds)
 
+    frame_start = 0
+    frame_finish = timeline.frame_count(track_times, fps, start_time)
 
-def get_tile_path(tile_reference, tile_directory):
-    return tile_directory +'/' +'tile_%06d_%06d_%02d.png' % (tile_reference.x, tile_reference.y, tile_reference.zoom)
+    log.info('frame_start: %d %f' % (frame_start, frame_start / fps))
+    log.info('frame_finish: %d %f' % (frame_finish, frame_finish / fps))
 
+    frame_x, frame_y = timeline.frame_positions(track_times, track_pixels.x, track_pixels.y, fps, start_time, interpolate)
+    if interpolate != timeline.INTERPOLATE_NONE:
+        return list(zip(frame_x.tolist(), frame_y.tolist()))
+    frame_pixels = osm.pixel_points_round(osm.PixelPoint(frame_x, frame_y, track_pixels.zoom))
 
-def annotate_tiles(gpx_data, zoom_factor, tile_directory):
+    return list(zip(frame_pixels.x.tolist(), frame_pixels.y.tolist()))
 
-    tile_set = {}
 
-    # Determine tiles have tracks on them
-    for coordinate in map(lambda p: osm.Coordinate(p['lon'], p['lat']), gpx_data.all_points()):
-        tile_ref = osm.tile_reference(osm.coordinate_to_tile_point(coordinate, zoom_factor))
-        if tile_ref not in tile_set:
-            tile_set[tile_ref] = []
+def render_frames(video, frame_positions, tile_canvas, viewport_offsets, pixels_x, pixels_y, frame_offset=0, frames=None):
+    '''
+    Renders and writes a frame for each (x, y) track pixel position, slicing each frame out of the pre-stitched tile
+    canvas. Fractional positions are rendered by shifting a slice one pixel larger than the viewport by the sub-pixel
+    offset (bilinear), so the tile canvas needs a margin of 1. Frames are composed on worker threads and encoded on a
+    writer thread. Returns the pipeline stats.
+    '''
+    x_portal_offset = int(pixels_x / 2)
+    y_portal_offset = int(pixels_y / 2)
+    if frames is None:
+        frames = len(frame_positions)
 
-    log.debug('tile_set: %r' % tile_set)
+    color = (40, 40, 255)
+    thickness = 3
 
-    # Collect all points from the track contained in that tile
-    for tile in tile_set:
-        for coordinate in map(lambda p: osm.Coordinate(p['lon'], p['lat']), gpx_data.all_points()):
-            location_tile = osm.tile_reference(osm.coordinate_to_tile_point(coordinate, zoom_factor))
-            location_pixel = osm.pixel_point_round(osm.coordinate_to_pixel_point(coordinate, zoom_factor))
-            if location_tile == tile:
-                if location_pixel not in tile_set[tile]:
-                    tile_set[tile].append(location_pixel)
+    def compose(frame_key):
+        x, y = frame_key
+        x_pixel = math.floor(x)
+        y_pixel = math.floor(y)
+        if x_pixel == x and y_pixel == y:
+            view = tile_canvas.view(x_pixel + viewport_offsets.x_lo, y_pixel + viewport_offsets.y_lo)
 
-    # Process each tile drawing contained points onto tile
-    for tile in tile_set:
-        log.debug('processing tile: %s' % repr(tile))
-        tile_pixel_ref = osm.tile_point_to_pixel_point(tile)
-        image_track_pixel_coords = list(map(lambda q: ((q.x - tile_pixel_ref.x), (q.y - tile_pixel_ref.y)), tile_set[tile]))
-        tile_filename = get_tile_path(tile, tile_directory)
+            cv_image = view.copy() # Canvas is already BGR
+        else:
+            view = tile_canvas.view(x_pixel + viewport_offsets.x_lo, y_pixel + viewport_offsets.y_lo, margin=1)
+            shift = np.float32([[1, 0, x_pixel - x], [0, 1, y_pixel - y]])
+            cv_image = cv2.warpAffine(view, shift, (pixels_x, pixels_y), flags=cv2.INTER_LINEAR)
 
-        log.debug('image_track_pixel_coords: %r' % image_track_pixel_coords)
+        cv2.circle(cv_image, (x_portal_offset, y_portal_offset), 15, color, thickness)
+        return cv_image
 
-        im_tile = Image.open(tile_filename).convert('RGB')
-        draw_track_points(im_tile, image_track_pixel_coords)
-        im_tile.save(tile_filename)
+    # Frames only change when the rounded position does (the marker overlay is fixed), so the pipeline reuses the
+    # last composed frame until then
+    return vid.write_frames(video, frame_positions, compose, frame_offset=frame_offset, frames=frames)
 
 
-def draw_track_points(im_background, image_pixel_coords):
-    color = ImageColor.getrgb('blue')
-    dr = ImageDraw.Draw(im_background)
-    dr.point(image_pixel_coords, fill=color)
+def generate_map_video(frame_positions, output_file, tile_canvas, viewport_offsets, pixels_x, pixels_y, fps=25):
+    ''' Renders the whole video in this process '''
+    video = vid.open_video_writer(output_file, fps, pixels_x, pixels_y)
+    pipeline_stats = render_frames(video, frame_positions, tile_canvas, viewport_offsets, pixels_x, pixels_y)
+    video.release()
 
-    return im_background
+    log.info('frames: %d, reused: %d' % (len(frame_positions), pipeline_stats.frames_reused))
+    log.info('frame pipeline: %r' % pipeline_stats)
+    log.info('tile canvas: %r' % tile_canvas)
+    log.info('decoded tile cache: %r' % tile_canvas.decoded_tiles)
 
+    return pipeline_stats.frames_reused
 
-def generate_map_video(track_pixel_ts_pairs, output_file, tile_directory, viewport_offsets, pixels_x, pixels_y, zoom, fps=25, start_time=None):
-    '''
-    Takes a list of tuples indicating track position and time: (PixelPoint(), timestamp)
-    Renders video frames based on position composing frame based on tiles within the viewport.
-    '''
-    x_portal_offset = int(pixels_x / 2)
-    y_portal_offset = int(pixels_y / 2)
 
-    if start_time is None:
-        start_time = track_pixel_ts_pairs[0][1]
-    finish_time = track_pixel_ts_pairs[-1][1]
+def open_tile_cache(location, synthesize_tiles=False, prefer_synthesis=False):
+    ''' Open the tile cache, standing in for missing tiles with synthesized ones if asked to '''
+    tile_cache = tc.open_tile_cache(location)
+    if synthesize_tiles or prefer_synthesis:
+        tile_cache = tc.SynthesizingTileCache(tile_cache, prefer_synthesis=prefer_synthesis)
+    return tile_cache
 
-    log.info(start_time)
-    log.info(finish_time)
-    total_seconds = finish_time - start_time
-    log.info(total_seconds)
 
-    frame_start = 0
-    frame_finish = int(total_seconds * fps)
-    frames = int(total_seconds * fps)
+def render_segment(segment):
+    '''
+    Process pool worker: renders one segment of the video to its own file. Each worker opens the tile cache itself
+    and builds its own decoded tile cache and canvas for the part of the track it renders.
+    '''
+    (segment_file, frame_positions, frame_offset, frames, tile_cache_location, tiles, overlay, zoom, viewport_offsets,
+     pixels_x, pixels_y, fps, tile_memory_bytes, synthesize_tiles) = segment
+    viewport_offsets = ViewportOffsets(*viewport_offsets)
 
-    log.info('frame_start: %d %f' % (frame_start, frame_start / fps))
-    log.info('frame_finish: %d %f' % (frame_finish, frame_finish / fps))
+    with open_tile_cache(tile_cache_location, synthesize_tiles) as tile_cache:
+        decoded_tiles = tc.DecodedTileCache(tile_cache, max_bytes=tile_memory_bytes)
+        tile_canvas = canvas.TileCanvas(decoded_tiles, zoom, pixels_x, pixels_y, tiles, margin=1, overlay=overlay)
 
-    color = (40, 40, 255)
-    thickness = 3
-
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    video = cv2.VideoWriter(output_file, fourcc, float(fps), (pixels_x, pixels_y))
+        video = vid.open_video_writer(segment_file, fps, pixels_x, pixels_y)
+        pipeline_stats = render_frames(video, frame_positions, tile_canvas, viewport_offsets, pixels_x, pixels_y, frame_offset, frames)
+        video.release()
 
-    pixel_pos = track_pixel_ts_pairs[0][0]
-    tpos = track_pixel_ts_pairs[0][1] - start_time
-    tpos_last = tpos
-    tpos_adj = tpos
+    log.info('segment %s, frame pipeline: %r' % (segment_file, pipeline_stats))
+    log.debug('segment %s, tile canvas: %r' % (segment_file, tile_canvas))
+    return pipeline_stats.frames_reused
 
-    pixel_pos_last = pixel_pos
 
-    # For each frame in the sequence
-    for frame in range(frame_start, frame_finish):
-        update_period = 1000
-        if frame % update_period == 0:
-            log.info('%3.2f %d %d' % (frame / fps, frame, frames))
+def generate_map_video_parallel(frame_positions, output_file, tile_cache_location, tiles, overlay, viewport_offsets, pixels_x, pixels_y, zoom, fps=25, workers=2, tile_memory_bytes=tc.DecodedTileCache.DEFAULT_MAX_BYTES,
+                                synthesize_tiles=False):
+    '''
+    Renders the video as one segment per worker process, then joins the segments losslessly. The tile memory budget
+    is shared between the workers.
+    '''
+    frames = len(frame_positions)
+    if frames == 0:
+        raise ValueError('no frames to render into %s' % output_file)
+    segments = vid.frame_segments(0, frames, workers, align=vid.GOP_FRAMES)
+    segment_files = vid.segment_filenames(output_file, len(segments))
+    log.info('rendering %d frames in %d segments with %d workers' % (frames, len(segments), workers))
 
-        # Determine the time corresponding to the frame
-        current_time = frame / fps
+    jobs = [
+        (segment_file, frame_positions[frame_lo:frame_hi], frame_lo, frames, tile_cache_location, tiles, overlay, zoom,
+         tuple(viewport_offsets), pixels_x, pixels_y, fps, tile_memory_bytes // workers, synthesize_tiles)
+        for segment_file, (frame_lo, frame_hi) in zip(segment_files, segments)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        frames_reused = sum(executor.map(render_segment, jobs))
 
-        # If the head of the track points list is less that current time, pop items off the list
-        while tpos_adj < current_time and len(track_pixel_ts_pairs) > 0:
-            pixel_pos, timestamp = track_pixel_ts_pairs.pop(0)
+    vid.concat_segments(segment_files, output_file)
+    log.info('frames: %d, reused: %d' % (frames, frames_reused))
 
-            tpos = timestamp - start_time
-            if tpos == tpos_last:
-                # Telemetry is recorded at 18Hz, so if we already have a point at this time, skip ahead
-                tpos_adj += 1 / 18
-            else:
-                tpos_last = tpos
-                tpos_adj = tpos
+    return frames_reused
 
-            pixel_pos_last = pixel_pos
 
-        image = build_image(osm.pixel_point_round(pixel_pos_last), viewport_offsets, pixels_x, pixels_y, tile_directory)
+def prepare_chase_video(track, track_start_time, zoom_factor, tile_cache, downloader, pixels_x=1022, pixels_y=1022, fps=25, interpolate=timeline.INTERPOLATE_NONE):
+    ''' Calculate the frame positions, plan and download the tiles, and build the track overlay for a chase video '''
+    offsets = ViewportOffsets(
+                int(-(pixels_x / 2)),
+                int(-(pixels_y / 2)),
+                int((pixels_x / 2)),
+                int((pixels_y / 2))
+    )
 
-        cv_image = np.array(image)
-        cv_image = cv_image[:, :, ::-1].copy() # Convert RGB to BGR
+    # Track position for each frame
+    track_pixels = osm.coordinates_to_pixel_points(track.coordinates(), zoom_factor)
+    frame_positions = frame_pixel_positions(track_pixels, track.time, fps=fps, start_time=track_start_time, interpolate=interpolate)
 
-        cv2.circle(cv_image, (x_portal_offset, y_portal_offset), 15, color, thickness)
-        video.write(cv_image)
+    # Plan and download tiles
+    if interpolate != timeline.INTERPOLATE_NONE:
+        tiles = plan_track_tiles(track, zoom_factor, offsets, frame_positions)
+    else:
+        tiles = plan_track_tiles(track, zoom_factor, offsets)
+    download_tiles(tiles, tile_cache, downloader)
 
-    video.release()
+    # Track overlay, drawn over the tiles as the canvas is stitched
+    overlay = build_track_overlay(track, zoom_factor)
 
+    return ChasePlan(frame_positions, tiles, offsets, zoom_factor, pixels_x, pixels_y, fps, overlay)
 
-@lru_cache(100)
-def build_image(pixel_position, viewport_offsets, pixels_x, pixels_y, tile_directory):
-    viewport_tiles = get_tiles_in_viewport(pixel_position, viewport_offsets)
-    log.debug('viewport_tiles: ' + repr(viewport_tiles))
-    log.debug('pixel_position: ' + repr(pixel_position))
-    log.debug('coord: ' + repr(osm.pixel_point_to_coordinate(pixel_position)))
 
-    im_view = Image.new(mode="RGB", size=(pixels_x, pixels_y))
+def render_chase_video(chase_plan, output_file, decoded_tiles):
+    ''' Render a prepared chase video in this process from the (possibly shared) decoded tile cache '''
+    output_temp_file = output_file + 'temp.mp4'
 
-    # load and stitch all tiles for current frame
-    for tile in viewport_tiles:
-        tile_pixel_ref = osm.tile_point_to_pixel_point(tile)
-        tile_path = get_tile_path(tile, tile_directory)
-        tile_offset_x = - viewport_offsets.x_lo - int(pixel_position.x - tile_pixel_ref.x)
-        tile_offset_y = - viewport_offsets.y_lo - int(pixel_position.y - tile_pixel_ref.y)
-        im_tile = Image.open(tile_path)
+    # Compose video from a canvas stitched from the decoded tiles
+    tile_canvas = canvas.TileCanvas(decoded_tiles, chase_plan.zoom, chase_plan.pixels_x, chase_plan.pixels_y, chase_plan.tiles, margin=1,
+                                    overlay=chase_plan.overlay)
+    frames_reused = generate_map_video(chase_plan.frame_positions, output_temp_file, tile_canvas, chase_plan.offsets,
+                                       chase_plan.pixels_x, chase_plan.pixels_y, fps=chase_plan.fps)
 
-        im_view.paste(im_tile, (tile_offset_x, tile_offset_y), mask=None)
+    # Copy over temp file to final filename
+    shutil.move(output_temp_file, output_file)
 
-    # im_view.show()
-    return im_view
+    return frames_reused
 
 
 def main():
@@ -252,8 +347,16 @@ def main():
     pixels_x = int(args['--viewport-x'])
     pixels_y = int(args['--viewport-y'])
     fps = int(args['--fps'])
-
-    output_temp_file = output_file + 'temp.mp4'
+    use_gpx_cache = not bool(args['--no-gpx-cache'])
+    download_workers = int(args['--download-workers'])
+    download_rate = float(args['--download-rate'])
+    tile_memory_bytes = int(float(args['--tile-memory']) * 1024 * 1024)
+    workers = int(args['--workers'])
+    interpolate = args['--interpolate']
+    tstart = args['--tstart']
+    tstop = args['--tstop']
+    prefer_synthesis = bool(args['--prefer-synthesis'])
+    synthesize_tiles = bool(args['--synthesize-tiles']) or prefer_synthesis
 
     log.info('start_time: %s' % start_time.isoformat())
 
@@ -261,30 +364,45 @@ def main():
     log.info('output_file:  %s' % output_file)
     log.info('viewport dimensions:: (%d, %d)' % (pixels_x, pixels_y))
 
-    # Setup: Pre calculations
-    offsets = ViewportOffsets(
-                int(-(pixels_x / 2)),
-                int(-(pixels_y / 2)),
-                int((pixels_x / 2)),
-                int((pixels_y / 2))
-    )
-
-    # Setup: Load GPX data
-    gpx_data = load_gpx_data(gpx_filename)
-
-    # Download tiles
-    download_tiles(gpx_data, zoom_factor, offsets, tile_directory)
+    if interpolate not in timeline.INTERPOLATE_MODES:
+        log.error('--interpolate must be one of: %s' % ', '.join(timeline.INTERPOLATE_MODES))
+        sys.exit(1)
 
-    # Annotate tiles
-    annotate_tiles(gpx_data, zoom_factor, tile_directory)
+    if workers > 1 and not vid.ffmpeg_available():
+        log.error('--workers=%d needs ffmpeg to join the rendered segments' % workers)
+        sys.exit(1)
 
-    # Compose video
-    track_coordinate_ts_pairs = gpx.gpx_points_to_coordinate_timestamp_tuples(gpx_data.all_points())
-    track_pixel_ts_pairs = list(map(lambda t: (osm.coordinate_to_pixel_point(t[0], zoom_factor), t[1]), track_coordinate_ts_pairs))
-    generate_map_video(track_pixel_ts_pairs, output_temp_file, tile_directory, offsets, pixels_x, pixels_y, zoom_factor, fps=fps, start_time=gpx_data.start_time())
-
-    # Copy over temp file to final filename
-    shutil.move(output_temp_file, output_file)
+    # Setup: Load GPX data
+    gpx_data = load_gpx_data(gpx_filename, use_gpx_cache)
+
+    # Clip the track to the time range before anything is planned, downloaded or rendered from it
+    track, track_start_time = gpx.clip_track(gpx_data.track, gpx_data.start_time(), tstart, tstop)
+    if len(track) == 0:
+        log.error('no track points in the time range')
+        sys.exit(1)
+
+    tile_cache = open_tile_cache(tile_directory, synthesize_tiles, prefer_synthesis)
+
+    with tile_downloader.TileDownloader(workers=download_workers, rate_limit=download_rate) as downloader:
+        chase_plan = prepare_chase_video(track, track_start_time, zoom_factor, tile_cache, downloader, pixels_x, pixels_y, fps, interpolate)
+
+    if workers > 1 and len(chase_plan.frame_positions) > 0:
+        # Each worker decodes just the tiles for its own segment
+        tile_cache.flush()
+        output_temp_file = output_file + 'temp.mp4'
+        generate_map_video_parallel(chase_plan.frame_positions, output_temp_file, tile_directory, chase_plan.tiles, chase_plan.overlay, chase_plan.offsets,
+                                    pixels_x, pixels_y, zoom_factor, fps=fps, workers=workers, tile_memory_bytes=tile_memory_bytes,
+                                    synthesize_tiles=synthesize_tiles)
+        shutil.move(output_temp_file, output_file)
+    else:
+        # Decode the planned tiles up front so frame composition does no PNG decoding
+        decoded_tiles = tc.DecodedTileCache(tile_cache, max_bytes=tile_memory_bytes)
+        decoded_tiles.preload(chase_plan.tiles)
+        render_chase_video(chase_plan, output_file, decoded_tiles)
+
+    if synthesize_tiles:
+        log.info('tile cache: %r' % tile_cache)
+    tile_cache.close()
 
     end_time = datetime.now(tzlocal())
     total_time = end_time - start_time
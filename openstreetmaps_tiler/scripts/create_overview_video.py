@@ -3,25 +3,36 @@
 create_overview_video.py - Create track overview video from GPX data
 
 Usage:
-  create_overview_video.py <gpx-data> [--output=<filename>] [--tile-cache=<directory>] [--grid-lines] [--viewport-x=<pixels>] [--viewport-y=<pixels>] [--fps=<fps>] [--no-video]
+  create_overview_video.py <gpx-data> [--output=<filename>] [--tile-cache=<directory>] [--grid-lines] [--viewport-x=<pixels>] [--viewport-y=<pixels>] [--fps=<fps>] [--no-video] [--no-gpx-cache] [--download-workers=<n>] [--download-rate=<tiles>] [--workers=<n>] [--interpolate=<mode>] [--tstart=<time>] [--tstop=<time>] [--quality=<ratio>] [--max-tiles=<n>] [--plan-only]
 
 Options:
   -h --help                 Show this screen.
   --output=<filename>       Output filename [default: output.mp4].
-  --tile-cache=<directory>  Tile cache directory [default: tiles].
+  --tile-cache=<directory>  Tile cache directory, or a file ending in .mbtiles for MBTiles storage [default: tiles].
   --grid-lines              Add tile lon/lat gridlines to output.
   --viewport-x=<pixels>     Output video viewport x dimension pixels [default: 1022].
   --viewport-y=<pixels>     Output video viewport x dimension pixels [default: 1022].
   --fps=<fps>               Frames per second of output video [default: 25].
   --no-video                Don't generate video - only output background image.
+  --no-gpx-cache            Don't read or write the parsed GPX track cache (<gpx-data>.track.*).
+  --download-workers=<n>    Concurrent tile download connections [default: 2].
+  --download-rate=<tiles>   Maximum tile downloads per second (0 for unlimited) [default: 10].
+  --workers=<n>             Render video segments in parallel worker processes (needs ffmpeg for more than 1) [default: 1].
+  --interpolate=<mode>      Marker position between samples: none (step to each sample), linear or spline [default: none].
+  --tstart=<time>           Start of the time range to render: offset from the GPX start time in seconds or [[h:]m:]s, or an absolute time.
+  --tstop=<time>            End of the time range to render, in the same forms as --tstart.
+  --quality=<ratio>         Map pixels per output pixel to render the background from: 0.5 scales up the highest zoom that fits, 1 or more downscales a higher zoom for high-DPI output [default: 0.5].
+  --max-tiles=<n>           Lower the zoom until the background needs at most this many tiles (0 for no limit) [default: 0].
+  --plan-only               Report the background zoom, tile count and pixel budget, then exit without downloading or rendering.
 '''
-# TODO: For timing offsets between the GPX data and video, need to support: tstart, tstop
 import sys
 import logging
 import os
 import math
 import copy
 import shutil
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from dateutil.tz import tzlocal
 
@@ -30,14 +41,19 @@ logging.basicConfig(level=logging.INFO, format='(%(threadName)-10s) %(message)-s
 from openstreetmaps_tiler import openstreetmaps as osm
 from openstreetmaps_tiler import gpx
 from openstreetmaps_tiler import utils
+from openstreetmaps_tiler import tile_downloader
+from openstreetmaps_tiler import tile_cache as tc
+from openstreetmaps_tiler import video as vid
+from openstreetmaps_tiler import timeline
 
 try:
     from docopt import docopt
     from PIL import Image
     from PIL import ImageDraw, ImageColor, ImageFont
     import cv2
+    import numpy as np
 except ImportError as e:
-    installs = ['docopt', 'Pillow', 'opencv-python']
+    installs = ['docopt', 'Pillow', 'opencv-python', 'numpy']
     sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
     sys.exit(1)
 
@@ -45,14 +61,13 @@ except ImportError as e:
 log = logging.getLogger(__name__)
 
 
-def to_coordinate(gpx_point):
-    return osm.Coordinate(gpx_point['lon'], gpx_point['lat'])
+MARKER_SHIFT = 4 # Sub-pixel marker positions in 1/16 pixels
+ZOOM_MAX = 19
+DEFAULT_QUALITY = 0.5
+REDUCING_GAP = 3.0 # Downscales by this factor or more shrink by whole factors first, then resample
 
-
-def calculate_best_zoom_factor(points_iter, margin_px, output_x_px, output_y_px):
-    track_extents = utils.get_track_geo_extents(points_iter)
-    zoom, boundary_extents = utils.maximize_zoom(track_extents, output_x_px, output_y_px, margin_px)
-    return zoom, boundary_extents
+OverviewPlan = namedtuple('OverviewPlan', 'background_file track_points start_time')
+ResolutionPlan = namedtuple('ResolutionPlan', 'zoom boundary_extents scale_factor tiles source_pixels output_pixels reducing_gap')
 
 
 def calculate_adjusted_boundary_extents(boundary_extents, zoom_factor, margin_px, output_x_px, output_y_px):
@@ -88,8 +103,57 @@ def calculate_adjusted_boundary_extents(boundary_extents, zoom_factor, margin_px
     return adjusted_pixel_extents.to_coordinate_extents(zoom_factor), scale_factor
 
 
-def generate_base_background_image(boundary_coord_extents, track_extents, zoom, tile_directory, draw_grid=False):
-    ''' Generate base background image and reference pixel point for image corner '''
+def resolution_plan(boundary_extents, zoom, margin_px, output_x_px, output_y_px):
+    ''' Tiles, source pixels and resampling needed to render boundary_extents from tiles at zoom '''
+    adjusted_boundary_extents, scale_factor = calculate_adjusted_boundary_extents(boundary_extents, zoom, margin_px, output_x_px, output_y_px)
+    columns, rows = utils.tile_grid_size(adjusted_boundary_extents, zoom)
+
+    pixel_extents = adjusted_boundary_extents.to_pixel_extents(zoom)
+    source_pixels = round(pixel_extents.hi().x - pixel_extents.lo().x) * round(pixel_extents.hi().y - pixel_extents.lo().y)
+
+    reducing_gap = REDUCING_GAP if 1 / scale_factor >= REDUCING_GAP else None
+    return ResolutionPlan(zoom, adjusted_boundary_extents, scale_factor, columns * rows, source_pixels, output_x_px * output_y_px, reducing_gap)
+
+
+def track_pixel_ratio(track_extents, zoom, margin_px, output_x_px, output_y_px):
+    ''' Track size in map pixels at zoom per output pixel available for it, in the limiting dimension '''
+    pixel_extents = track_extents.to_pixel_extents(zoom)
+    ratio_x = (pixel_extents.hi().x - pixel_extents.lo().x) / (output_x_px - 2 * margin_px)
+    ratio_y = (pixel_extents.hi().y - pixel_extents.lo().y) / (output_y_px - 2 * margin_px)
+    return max(ratio_x, ratio_y)
+
+
+def plan_resolution(track_extents, output_x_px, output_y_px, margin_px=10, quality=DEFAULT_QUALITY, max_tiles=0):
+    '''
+    Pick the source tile zoom for the output size: the lowest zoom with at least 'quality' map pixels per output pixel
+    across the track, needing at most max_tiles tiles (0 for no limit). Quality 0.5 (or less) never goes above the
+    highest zoom that fits the output, as chosen by maximize_zoom (scaled up by less than 2x); 1 or more renders
+    high-DPI output by scaling down a higher zoom.
+    '''
+    zoom, boundary_extents = utils.maximize_zoom(track_extents, output_x_px, output_y_px, margin_px)
+
+    # Map pixels per output pixel double with each zoom level. Only a higher quality goes beyond maximize_zoom's
+    # choice, which stops below ZOOM_MAX
+    zoom_max = ZOOM_MAX if quality > DEFAULT_QUALITY else zoom
+    while 0 < track_pixel_ratio(track_extents, zoom, margin_px, output_x_px, output_y_px) < quality and zoom < zoom_max:
+        zoom += 1
+    while zoom > 0 and track_pixel_ratio(track_extents, zoom - 1, margin_px, output_x_px, output_y_px) >= quality:
+        zoom -= 1
+
+    plan = resolution_plan(boundary_extents, zoom, margin_px, output_x_px, output_y_px)
+    while max_tiles and plan.tiles > max_tiles and plan.zoom > 0:
+        plan = resolution_plan(boundary_extents, plan.zoom - 1, margin_px, output_x_px, output_y_px)
+
+    log.info('resolution plan: zoom: %d, tiles: %d, source pixels: %d, output pixels: %d, scale: %f, reducing_gap: %s' % (
+        plan.zoom, plan.tiles, plan.source_pixels, plan.output_pixels, plan.scale_factor, plan.reducing_gap))
+    return plan
+
+
+def generate_base_background_image(boundary_coord_extents, track_extents, zoom, tile_cache, downloader, draw_grid=False, crop_pixel_extents=None):
+    '''
+    Generate base background image and reference pixel point for image corner. With crop_pixel_extents the image
+    covers only that area (rounded to whole pixels) and only the tiles intersecting it are decoded.
+    '''
     # Download all tiles coverying boundary area
 
     tile_extents = boundary_coord_extents.to_tile_extents(zoom)
@@ -101,6 +165,7 @@ def generate_base_background_image(boundary_coord_extents, track_extents, zoom,
     tile_ref_hi = osm.tile_reference(tile_hi)
 
     file_map = {}
+    tiles = []
 
     log.debug('tile_extents: %r' % tile_extents)
 
@@ -108,50 +173,55 @@ def generate_base_background_image(boundary_coord_extents, track_extents, zoom,
         for lat_tile in range(tile_ref_lo.y, tile_ref_hi.y + 1):
             key = (lon_tile, lat_tile)
             tile = osm.TilePoint(lon_tile, lat_tile, zoom)
-            output_filename = tile_directory +'/' +'tile_%06d_%06d_%02d.png' % (tile.x, tile.y, tile.zoom)
-            file_map[key] = output_filename
-            if not os.path.exists(output_filename):
-                osm.download_tile(tile, output_filename)
+            file_map[key] = tile
+            tiles.append(tile)
 
     log.debug('file_map: ' + repr(file_map))
 
-    # Combine into single image
-    im_full = None
-    for lon_tile in range(tile_ref_lo.x, tile_ref_hi.x + 1):
-        im_row = None
-        for lat_tile in range(tile_ref_lo.y, tile_ref_hi.y + 1):
-            key = (lon_tile, lat_tile)
-            log.debug('lon_tile: {}, lat_tile: {}'.format(lon_tile, lat_tile))
-
-            im = Image.open(file_map[key]).convert('RGB')
-
-            if draw_grid:
-                # Add lon/lat grid lines to tiles for debugging
-                tile_current = osm.TilePoint(lon_tile, lat_tile, zoom)
-                geo_current = osm.tile_point_to_coordinate(tile_current)
-
-                dr = ImageDraw.Draw(im)
-                color = ImageColor.getrgb('brown')
-                dr.line([(0, 0), (0, 255)], fill=color, width=1)
-                dr.line([(0, 0), (255, 0)], fill=color, width=1)
-
-                lon_deg_min = geo_current.lon
-                lat_deg_min = geo_current.lat
-
-                font = ImageFont.load_default()
-                dr.text([(127, 10)], '%f' % lat_deg_min, font=font, fill=color)
-                dr.text([(10, 127)], '%f' % lon_deg_min, font=font, fill=color)
-
-            if im_row is None:
-                im_row = im
-            else:
-                im_join = im
-                im_row = utils.join_images_vertical(im_row, im_join)
-
-        if im_full is None:
-            im_full = im_row
-        else:
-            im_full = utils.join_images_horizontal(im_full, im_row)
+    missing_tiles = tile_cache.missing(tiles)
+    log.info('tiles: %d, downloading: %d' % (len(tiles), len(missing_tiles)))
+    downloader.download(missing_tiles, tile_cache.put)
+    tile_cache.flush()
+
+    # Combine into single image: decode tiles in parallel straight into their slot of one canvas
+    def load_tile(column, row):
+        lon_tile = tile_ref_lo.x + column
+        lat_tile = tile_ref_lo.y + row
+        log.debug('lon_tile: {}, lat_tile: {}'.format(lon_tile, lat_tile))
+
+        with Image.open(tile_cache.open(file_map[(lon_tile, lat_tile)])) as im_tile:
+            im = im_tile.convert('RGB')
+
+        if draw_grid:
+            # Add lon/lat grid lines to tiles for debugging
+            tile_current = osm.TilePoint(lon_tile, lat_tile, zoom)
+            geo_current = osm.tile_point_to_coordinate(tile_current)
+
+            dr = ImageDraw.Draw(im)
+            color = ImageColor.getrgb('brown')
+            dr.line([(0, 0), (0, 255)], fill=color, width=1)
+            dr.line([(0, 0), (255, 0)], fill=color, width=1)
+
+            lon_deg_min = geo_current.lon
+            lat_deg_min = geo_current.lat
+
+            font = ImageFont.load_default()
+            dr.text([(127, 10)], '%f' % lat_deg_min, font=font, fill=color)
+            dr.text([(10, 127)], '%f' % lon_deg_min, font=font, fill=color)
+
+        return im
+
+    image_pixel_ref = osm.tile_point_to_pixel_point(tile_ref_lo)
+    window = None
+    if crop_pixel_extents is not None:
+        window = utils.crop_window((
+            crop_pixel_extents.lo().x - image_pixel_ref.x,
+            crop_pixel_extents.lo().y - image_pixel_ref.y,
+            crop_pixel_extents.hi().x - image_pixel_ref.x,
+            crop_pixel_extents.hi().y - image_pixel_ref.y,
+        ))
+    im_full = utils.build_tile_mosaic(tile_ref_hi.x - tile_ref_lo.x + 1, tile_ref_hi.y - tile_ref_lo.y + 1, load_tile, window=window)
+    window_x, window_y = (window[0], window[1]) if window is not None else (0, 0)
 
     if draw_grid:
         # Draw boundary lines
@@ -159,16 +229,16 @@ def generate_base_background_image(boundary_coord_extents, track_extents, zoom,
         im_width, im_height = im_full.size
         color = ImageColor.getrgb('black')
 
-        x_offset = (tile_lo.x - math.floor(tile_ref_lo.x)) * 256
+        x_offset = (tile_lo.x - math.floor(tile_ref_lo.x)) * 256 - window_x
         dr.line([(x_offset, 0), (x_offset, im_height)], fill=color, width=1)
 
-        y_offset = (tile_lo.y - math.floor(tile_ref_lo.y)) * 256
+        y_offset = (tile_lo.y - math.floor(tile_ref_lo.y)) * 256 - window_y
         dr.line([(0, y_offset), (im_width, y_offset)], fill=color, width=1)
 
-        x_offset = (tile_hi.x - math.floor(tile_ref_lo.x)) * 256
+        x_offset = (tile_hi.x - math.floor(tile_ref_lo.x)) * 256 - window_x
         dr.line([(x_offset, 0), (x_offset, im_height)], fill=color, width=1)
 
-        y_offset = (tile_hi.y - math.floor(tile_ref_lo.y)) * 256
+        y_offset = (tile_hi.y - math.floor(tile_ref_lo.y)) * 256 - window_y
         dr.line([(0, y_offset), (im_width, y_offset)], fill=color, width=1)
 
         # Draw track extent lines
@@ -178,38 +248,39 @@ def generate_base_background_image(boundary_coord_extents, track_extents, zoom,
         track_lo = track_tile_extents.lo()
         track_hi = track_tile_extents.hi()
 
-        x_offset = (track_lo.x - math.floor(tile_ref_lo.x)) * 256
+        x_offset = (track_lo.x - math.floor(tile_ref_lo.x)) * 256 - window_x
         dr.line([(x_offset, 0), (x_offset, im_height)], fill=color, width=1)
 
-        y_offset = (track_lo.y - math.floor(tile_ref_lo.y)) * 256
+        y_offset = (track_lo.y - math.floor(tile_ref_lo.y)) * 256 - window_y
         dr.line([(0, y_offset), (im_width, y_offset)], fill=color, width=1)
 
-        x_offset = (track_hi.x - math.floor(tile_ref_lo.x)) * 256
+        x_offset = (track_hi.x - math.floor(tile_ref_lo.x)) * 256 - window_x
         dr.line([(x_offset, 0), (x_offset, im_height)], fill=color, width=1)
 
-        y_offset = (track_hi.y - math.floor(tile_ref_lo.y)) * 256
+        y_offset = (track_hi.y - math.floor(tile_ref_lo.y)) * 256 - window_y
         dr.line([(0, y_offset), (im_width, y_offset)], fill=color, width=1)
 
 
     # output_file = 'bozo'
     # im_full.save(output_file + '.raw.png')
 
-    return im_full, osm.tile_point_to_pixel_point(tile_ref_lo)
+    return im_full, osm.PixelPoint(image_pixel_ref.x + window_x, image_pixel_ref.y + window_y, zoom)
 
 
-def generate_image_track_pixel_coordinates(image_pixel_ref, zoom, gpx_track_points, scale_factor=1.0):
-    track_pixel_points = map(lambda p: osm.coordinate_to_pixel_point(osm.Coordinate(p['lon'], p['lat']), zoom), gpx_track_points)
-    image_track_pixel_coords = list(map(lambda q: ((q.x - image_pixel_ref.x) * scale_factor, (q.y - image_pixel_ref.y) * scale_factor), track_pixel_points))
+def generate_image_track_pixel_coordinates(image_pixel_ref, zoom, track, scale_factor=1.0):
+    ''' Flat [x0, y0, x1, y1, ...] list of track pixel coordinates relative to the image reference point '''
+    track_pixel_points = osm.coordinates_to_pixel_points(track.coordinates(), zoom)
+    image_x = (track_pixel_points.x - image_pixel_ref.x) * scale_factor
+    image_y = (track_pixel_points.y - image_pixel_ref.y) * scale_factor
+    image_track_pixel_coords = np.column_stack((image_x, image_y)).ravel().tolist()
     return image_track_pixel_coords
 
 
-def generate_scaled_track_pixel_points_with_timestamp(image_pixel_ref, zoom, gpx_track_points, scale_factor=1.0):
-    track_points = []
-    for gpx_point in gpx_track_points:
-        p = osm.coordinate_to_pixel_point(osm.Coordinate(gpx_point['lon'], gpx_point['lat']), zoom)
-        timestamp  = gpx_point['time']
-        image_offset_pixel_point = (p.x - image_pixel_ref.x) * scale_factor, (p.y - image_pixel_ref.y) * scale_factor, timestamp
-        track_points.append(image_offset_pixel_point)
+def generate_scaled_track_pixel_points_with_timestamp(image_pixel_ref, zoom, track, scale_factor=1.0):
+    track_pixel_points = osm.coordinates_to_pixel_points(track.coordinates(), zoom)
+    image_x = (track_pixel_points.x - image_pixel_ref.x) * scale_factor
+    image_y = (track_pixel_points.y - image_pixel_ref.y) * scale_factor
+    track_points = list(zip(image_x.tolist(), image_y.tolist(), track.time.tolist()))
 
     return track_points
 
@@ -222,14 +293,17 @@ def draw_track_points(im_background, image_pixel_coords):
     return im_background
 
 
-def generate_map_video(background_image, track_points, output_file, fps=25, start_time=None):
-    image = cv2.imread(background_image)
-    height, width, _ = image.shape
-    log.debug(height, width)
+def frame_marker_positions(track_points, fps=25, start_time=None, interpolate=timeline.INTERPOLATE_NONE):
+    '''
+    Takes a list of (x, y, timestamp) track points in image pixels
+    Returns the marker position (x, y) shown in each video frame, rounded to whole pixels or, when interpolating, to
+    fixed point sub-pixels with MARKER_SHIFT fractional bits (as taken by cv2.circle).
+    '''
+    track_x, track_y, track_times = np.array(track_points, dtype=np.float64).T
 
     if start_time is None:
-        start_time = track_points[0][2]
-    finish_time =  track_points[-1][2]
+        start_time = track_times[0]
+    finish_time =  track_times[-1]
 
     log.info(start_time)
     log.info(finish_time)
@@ -237,56 +311,129 @@ def generate_map_video(background_image, track_points, output_file, fps=25, star
     log.info(total_seconds)
 
     frame_start = 0
-    frame_finish = int(total_seconds * fps)
-    frames = int(total_seconds * fps)
+    frame_finish = timeline.frame_count(track_times, fps, start_time)
 
     log.info('frame_start: %d %f' % (frame_start, frame_start / fps))
     log.info('frame_finish: %d %f' % (frame_finish, frame_finish / fps))
 
+    frame_x, frame_y = timeline.frame_positions(track_times, track_x, track_y, fps, start_time, interpolate)
+    if interpolate != timeline.INTERPOLATE_NONE:
+        frame_x = frame_x * (1 << MARKER_SHIFT)
+        frame_y = frame_y * (1 << MARKER_SHIFT)
+
+    return list(zip(np.round(frame_x).astype(int).tolist(), np.round(frame_y).astype(int).tolist()))
+
+
+def render_frames(video, image, frame_positions, frame_offset=0, frames=None, shift=0):
+    '''
+    Draws the marker on the background image at each (x, y) frame position and writes the frames. Positions are fixed
+    point with 'shift' fractional bits, and sub-pixel markers are drawn anti-aliased. Frames are composed on worker
+    threads and encoded on a writer thread. Returns the pipeline stats.
+    '''
+    if frames is None:
+        frames = len(frame_positions)
+
     color = (40, 40, 255)
     thickness = 3
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    video = cv2.VideoWriter(output_file, fourcc, float(fps), (width, height))
+    def compose(frame_key):
+        frame_image = copy.copy(image)
+        if shift:
+            cv2.circle(frame_image, frame_key, 15 << shift, color, thickness, cv2.LINE_AA, shift)
+        else:
+            cv2.circle(frame_image, frame_key, 15, color, thickness)
+        return frame_image
 
-    xpos = int(round(track_points[0][0], 0))
-    ypos = int(round(track_points[0][1], 0))
-    tpos = track_points[0][2] - start_time
-    tpos_last = tpos
-    tpos_adj = tpos
+    # Only the marker position changes between frames, so the pipeline reuses the last frame until it moves
+    return vid.write_frames(video, frame_positions, compose, frame_offset=frame_offset, frames=frames)
 
-    xlast = xpos
-    ylast = ypos
 
-    for frame in range(frame_start, frame_finish):
-        update_period = 1000
-        if frame % update_period == 0:
-            log.info('%3.2f %d %d' % (frame / fps, frame, frames))
+def render_segment(segment):
+    ''' Process pool worker: renders one segment of the video to its own file '''
+    segment_file, background_image, frame_positions, frame_offset, frames, fps, shift = segment
 
-        current_time = frame / fps
+    image = cv2.imread(background_image)
+    height, width, _ = image.shape
 
-        while tpos_adj < current_time and len(track_points) > 0:
-            point = track_points.pop(0)
-            xpos = point[0]
-            ypos = point[1]
-            xpos = int(round(point[0], 0))
-            ypos = int(round(point[1], 0))
-            tpos = point[2] - start_time
-            if tpos == tpos_last:
-                tpos_adj += 1/18
-            else:
-                tpos_last = tpos
-                tpos_adj = tpos
+    video = vid.open_video_writer(segment_file, fps, width, height)
+    pipeline_stats = render_frames(video, image, frame_positions, frame_offset, frames, shift)
+    video.release()
 
-            xlast = xpos
-            ylast = ypos
+    log.info('segment %s, frame pipeline: %r' % (segment_file, pipeline_stats))
+    return pipeline_stats.frames_reused
 
-        frame = copy.copy(image)
 
-        cv2.circle(frame, (xlast, ylast), 15, color, thickness)
-        video.write(frame)
+def generate_map_video(background_image, track_points, output_file, fps=25, start_time=None, workers=1, interpolate=timeline.INTERPOLATE_NONE):
+    '''
+    Renders the marker moving over the background image. With more than one worker the frames are rendered as one
+    segment per worker process and the segments are joined losslessly.
+    '''
+    frame_positions = frame_marker_positions(track_points, fps=fps, start_time=start_time, interpolate=interpolate)
+    shift = 0 if interpolate == timeline.INTERPOLATE_NONE else MARKER_SHIFT
+    frames = len(frame_positions)
 
-    video.release()
+    if workers > 1 and frames > 0:
+        segments = vid.frame_segments(0, frames, workers, align=vid.GOP_FRAMES)
+        segment_files = vid.segment_filenames(output_file, len(segments))
+        log.info('rendering %d frames in %d segments with %d workers' % (frames, len(segments), workers))
+
+        jobs = [
+            (segment_file, background_image, frame_positions[frame_lo:frame_hi], frame_lo, frames, fps, shift)
+            for segment_file, (frame_lo, frame_hi) in zip(segment_files, segments)
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            frames_reused = sum(executor.map(render_segment, jobs))
+
+        vid.concat_segments(segment_files, output_file)
+    else:
+        frames_reused = render_segment((output_file, background_image, frame_positions, 0, frames, fps, shift))
+
+    log.info('frames: %d, reused: %d' % (frames, frames_reused))
+
+    return frames_reused
+
+
+def prepare_overview_video(track, track_start_time, background_file, tile_cache, downloader, pixels_x=1022, pixels_y=1022, grid_lines=False, margin_pixels=10,
+                           quality=DEFAULT_QUALITY, max_tiles=0):
+    ''' Build and save the background image for an overview video of the track and calculate the marker track points '''
+    # Pick the source zoom factor and the expanded boundary extents
+    track_extents = utils.get_coordinates_geo_extents(track.coordinates())
+    resolution = plan_resolution(track_extents, pixels_x, pixels_y, margin_pixels, quality, max_tiles)
+    zoom = resolution.zoom
+    adjusted_boundary_coord_extents = resolution.boundary_extents
+    final_scale_factor = resolution.scale_factor
+
+    log.info('final_scale_factor: %r' % final_scale_factor)
+
+    # Generate base background image, built only over the area kept in the final image
+    boundary_pixel_extents = adjusted_boundary_coord_extents.to_pixel_extents(zoom)
+    im_full_crop, image_pixel_ref = generate_base_background_image(adjusted_boundary_coord_extents, track_extents, zoom, tile_cache, downloader, grid_lines,
+                                                                   crop_pixel_extents=boundary_pixel_extents)
+
+    # Draw track points (image, points)
+    image_track_pixel_coords = generate_image_track_pixel_coordinates(image_pixel_ref, zoom, track)
+    im_full_crop = draw_track_points(im_full_crop, image_track_pixel_coords)
+
+    # Scale to final dimensions
+    im_full_resize = im_full_crop.resize((pixels_x, pixels_y), Image.Resampling.LANCZOS, reducing_gap=resolution.reducing_gap)
+    im_full_resize.save(background_file)
+
+    track_timestamp_pixel_points = generate_scaled_track_pixel_points_with_timestamp(boundary_pixel_extents.lo(), zoom, track, final_scale_factor)
+
+    return OverviewPlan(background_file, track_timestamp_pixel_points, track_start_time)
+
+
+def render_overview_video(overview_plan, output_file, fps=25, workers=1, interpolate=timeline.INTERPOLATE_NONE):
+    ''' Render a prepared overview video '''
+    output_temp_file = output_file + '.temp.mp4'
+
+    frames_reused = generate_map_video(overview_plan.background_file, overview_plan.track_points, output_temp_file, fps=fps,
+                                       start_time=overview_plan.start_time, workers=workers, interpolate=interpolate)
+
+    # Copy over temp file to final filename
+    shutil.move(output_temp_file, output_file)
+
+    return frames_reused
 
 
 def main():
@@ -301,58 +448,55 @@ def main():
     pixels_y = int(args['--viewport-y'])
     fps = int(args['--fps'])
     generate_video = not bool(args['--no-video'])
+    use_gpx_cache = not bool(args['--no-gpx-cache'])
+    download_workers = int(args['--download-workers'])
+    download_rate = float(args['--download-rate'])
+    workers = int(args['--workers'])
+    interpolate = args['--interpolate']
+    tstart = args['--tstart']
+    tstop = args['--tstop']
+    quality = float(args['--quality'])
+    max_tiles = int(args['--max-tiles'])
+    plan_only = bool(args['--plan-only'])
 
     margin_pixels = 10
 
     background_file = output_file + '.background.png'
-    output_temp_file = output_file + '.temp.mp4'
 
     log.info('start_time: %s' % start_time.isoformat())
 
     log.info('gpx_filename: %s' % gpx_filename)
     log.info('output_file:  %s' % output_file)
 
-    # Get GPX data
-    with open(gpx_filename) as fd:
-        gpx_raw = fd.read()
-    gpx_data = gpx.Gpx(gpx_raw)
-
-    # Calculate best zoom factor
-    track_extents = utils.get_track_geo_extents(gpx_data.all_points())
-    zoom, boundary_coord_extents = utils.maximize_zoom(track_extents, pixels_x, pixels_y, margin_pixels)
+    if interpolate not in timeline.INTERPOLATE_MODES:
+        log.error('--interpolate must be one of: %s' % ', '.join(timeline.INTERPOLATE_MODES))
+        sys.exit(1)
 
-    # Calculate expanded boundary extents
-    adjusted_boundary_coord_extents, final_scale_factor = calculate_adjusted_boundary_extents(boundary_coord_extents, zoom, margin_pixels, pixels_x, pixels_y)
+    if generate_video and workers > 1 and not vid.ffmpeg_available():
+        log.error('--workers=%d needs ffmpeg to join the rendered segments' % workers)
+        sys.exit(1)
 
-    log.info('final_scale_factor: %r' % final_scale_factor)
+    # Get GPX data
+    gpx_data = gpx.Gpx(gpx_filename, use_cache=use_gpx_cache)
 
-    # Generate base background image
-    im_full, image_pixel_ref = generate_base_background_image(adjusted_boundary_coord_extents, track_extents, zoom, tile_directory, grid_lines)
+    # Clip the track to the time range before anything is planned, downloaded or rendered from it
+    track, track_start_time = gpx.clip_track(gpx_data.track, gpx_data.start_time(), tstart, tstop)
+    if len(track) == 0:
+        log.error('no track points in the time range')
+        sys.exit(1)
 
-    # Draw track points (image, points)
-    image_track_pixel_coords = generate_image_track_pixel_coordinates(image_pixel_ref, zoom, gpx_data.all_points())
-    im_full = draw_track_points(im_full, image_track_pixel_coords)
+    if plan_only:
+        # Report the tiles and pixels the background needs without downloading or rendering anything
+        plan_resolution(utils.get_coordinates_geo_extents(track.coordinates()), pixels_x, pixels_y, margin_pixels, quality, max_tiles)
+        return
 
-    # Scale and crop image to final dimensions
-    boundary_pixel_extents = adjusted_boundary_coord_extents.to_pixel_extents(zoom)
-    crop_box = [
-        boundary_pixel_extents.lo().x - image_pixel_ref.x,
-        boundary_pixel_extents.lo().y - image_pixel_ref.y,
-        boundary_pixel_extents.hi().x - image_pixel_ref.x,
-        boundary_pixel_extents.hi().y - image_pixel_ref.y,
-    ]
-    im_full_crop = im_full.crop(crop_box)
-
-    im_full_resize = im_full_crop.resize((pixels_x, pixels_y), Image.Resampling.LANCZOS)
-    im_full_resize.save(background_file)
+    with tc.open_tile_cache(tile_directory) as tile_cache, tile_downloader.TileDownloader(workers=download_workers, rate_limit=download_rate) as downloader:
+        overview_plan = prepare_overview_video(track, track_start_time, background_file, tile_cache, downloader, pixels_x, pixels_y, grid_lines, margin_pixels,
+                                               quality, max_tiles)
 
     # Generate video
     if generate_video:
-        track_timestamp_pixel_points = generate_scaled_track_pixel_points_with_timestamp(boundary_pixel_extents.lo(), zoom, gpx_data.all_points(), final_scale_factor)
-        generate_map_video(background_file, track_timestamp_pixel_points, output_temp_file, fps=fps, start_time=gpx_data.start_time())
-
-        # Copy over temp file to final filename
-        shutil.move(output_temp_file, output_file)
+        render_overview_video(overview_plan, output_file, fps=fps, workers=workers, interpolate=interpolate)
 
     end_time = datetime.now(tzlocal())
     total_time = end_time - start_time
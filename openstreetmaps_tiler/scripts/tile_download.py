@@ -5,14 +5,15 @@ tile_download.py - Tile downloader
 Given a lat, long, zoom-factor, will download tile from openstreetmaps.org at the given zoom factor that contains the given location.
 
 Usage:
-  tile_download.py --lat=<latitude> --long=<longitude> --zoom=<zoom> [--mark-loc]
+  tile_download.py --lat=<latitude> --long=<longitude> --zoom=<zoom> [--mark-loc] [--tile-cache=<directory>]
 
 Options:
-  -h --help             Show this screen.
-  --lat=<latitude>      Latitude of point in tile.
-  --long=<longitude>    Longitude of point in tile.
-  --zoom=<zoom>         Zoom factor.
-  --mark-loc            Mark specified location with lat/lon lines.
+  -h --help                 Show this screen.
+  --lat=<latitude>          Latitude of point in tile.
+  --long=<longitude>        Longitude of point in tile.
+  --zoom=<zoom>             Zoom factor.
+  --mark-loc                Mark specified location with lat/lon lines.
+  --tile-cache=<directory>  Fetch the tile through a tile cache directory, or a file ending in .mbtiles.
 '''
 
 import math
@@ -25,6 +26,8 @@ from collections import namedtuple
 logging.basicConfig(level=logging.INFO, format='(%(threadName)-10s) %(message)-s')
 
 from openstreetmaps_tiler import openstreetmaps as osm
+from openstreetmaps_tiler import tile_cache as tc
+from openstreetmaps_tiler import tile_downloader
 
 try:
     import sh
@@ -70,6 +73,7 @@ def main():
     lon_deg = float(args['--long'])
     zoom = float(args['--zoom'])
     mark_loc = args['--mark-loc']
+    tile_cache_location = args['--tile-cache']
 
     coord = osm.Coordinate(lon_deg, lat_deg)
     tile = osm.coordinate_to_tile_point(coord, zoom)
@@ -81,7 +85,15 @@ def main():
     tile_filename = '%d_%d_%d.%d.png' % (zoom, x_tile, y_tile, timestamp)
     markup_filename = '%d_%d_%d.%d.marked.png' % (zoom, x_tile, y_tile, timestamp)
 
-    osm.download_tile(tile, tile_filename)
+    if tile_cache_location is None:
+        osm.download_tile(tile, tile_filename)
+    else:
+        with tc.open_tile_cache(tile_cache_location) as tile_cache:
+            if tile not in tile_cache:
+                with tile_downloader.TileDownloader() as downloader:
+                    downloader.download([tile], tile_cache.put)
+            with open(tile_filename, 'wb') as fd:
+                fd.write(tile_cache.get(tile))
 
     if mark_loc:
         markup_tile(tile, tile_filename, markup_filename, 'red')
@@ -0,0 +1,590 @@
+# Tile cache storage backends. Both backends keep an in-memory index of the tiles they hold so membership queries
+# are answered without touching storage, and share the same interface (contains/missing/get/open/put/flush/close).
+#
+#   1. TileCache - the original flat 'tile_XXXXXX_YYYYYY_ZZ.png' directory layout. The index (z/x/y, size and fetch
+#      time) is persisted as a SQLite manifest in the same directory and is rebuilt from a directory scan when it is
+#      missing or when the directory has been modified behind its back.
+#
+#   2. MBTilesCache - all tiles in a single MBTiles (SQLite) file, with batched inserts and per-thread reader
+#      connections so renderers can read while the downloader writes.
+#
+# SynthesizingTileCache wraps either backend and stands in for missing tiles with tiles built from cached tiles at
+# neighbouring zooms. DecodedTileCache sits in front of any of them and holds decoded RGB tile arrays for the frame
+# renderers.
+#
+# open_tile_cache() picks the backend from the --tile-cache location.
+#
+# 2026-10-17
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+import io
+import os
+import re
+import sys
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import openstreetmaps as osm
+from . import tile_downloader
+
+try:
+    from PIL import Image
+    import numpy as np
+except ImportError as e:
+    installs = ['Pillow', 'numpy']
+    sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
+    sys.exit(1)
+
+log = logging.getLogger(__name__)
+
+
+TILE_FILENAME_FORMAT = 'tile_%06d_%06d_%02d.png'
+TILE_FILENAME_PATTERN = re.compile(r'tile_(\d+)_(\d+)_(\d+)\.png\Z')
+
+
+def tile_key(tile):
+    ''' (zoom, x, y) integer key for a tile point '''
+    tile_ref = osm.tile_reference(tile)
+    return tile_ref.zoom, tile_ref.x, tile_ref.y
+
+
+def open_tile_cache(location):
+    ''' Open the tile cache backend for a --tile-cache location: an '.mbtiles' file or a tile directory '''
+    if location.endswith(MBTilesCache.FILE_EXTENSION):
+        return MBTilesCache(location)
+    return TileCache(location)
+
+
+class TileCache:
+
+    MANIFEST_FILENAME = '.tile_manifest.sqlite'
+    INSERT_BATCH_SIZE = 256
+    BUSY_TIMEOUT = 10.0 # Seconds to wait for another process writing the manifest
+
+    def __init__(self, tile_directory):
+        self.tile_directory = tile_directory
+        self.location = tile_directory
+        os.makedirs(tile_directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(tile_directory, self.MANIFEST_FILENAME), timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+        # Keep the rollback journal in memory - the manifest can always be rebuilt, and journal files coming and
+        # going would otherwise change the directory mtime used to detect outside modifications
+        self._db.execute('PRAGMA journal_mode=MEMORY')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tiles (zoom INTEGER, x INTEGER, y INTEGER, size INTEGER, fetched REAL, PRIMARY KEY (zoom, x, y))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self._db.commit()
+
+        self._tiles = {}
+        self._pending = []
+        self._load_manifest()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+    def __contains__(self, tile):
+        return tile_key(tile) in self._tiles
+
+
+    def __repr__(self):
+        return '<%s %s tiles:%d>' % (self.__class__.__name__, self.tile_directory, len(self._tiles))
+
+
+    def _directory_mtime(self):
+        return str(os.stat(self.tile_directory).st_mtime_ns)
+
+
+    def _load_manifest(self):
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'directory_mtime'").fetchone()
+        if row is not None and row[0] == self._directory_mtime():
+            for zoom, x, y, size, fetched in self._db.execute('SELECT zoom, x, y, size, fetched FROM tiles'):
+                self._tiles[(zoom, x, y)] = (size, fetched)
+            log.debug('tile manifest loaded: %d tiles' % len(self._tiles))
+        else:
+            self.rescan()
+
+
+    def rescan(self):
+        ''' Rebuild the manifest from a scan of the tile directory '''
+        tiles = {}
+        with os.scandir(self.tile_directory) as entries:
+            for entry in entries:
+                match = TILE_FILENAME_PATTERN.match(entry.name)
+                if match is None:
+                    continue
+                x, y, zoom = map(int, match.groups())
+                stat = entry.stat()
+                tiles[(zoom, x, y)] = (stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            self._tiles = tiles
+            try:
+                self._db.execute('DELETE FROM tiles')
+                self._db.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?, ?)', [key + value for key, value in tiles.items()])
+                self._save_directory_mtime()
+            except sqlite3.OperationalError as e:
+                # Another process is writing the manifest: use the scan, and leave the manifest to be rebuilt later
+                self._db.rollback()
+                log.info('tile manifest not rebuilt (%s): %d tiles scanned in %s' % (e, len(tiles), self.tile_directory))
+                return
+        log.info('tile manifest rebuilt: %d tiles in %s' % (len(tiles), self.tile_directory))
+
+
+    def _save_directory_mtime(self):
+        self._db.commit()
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('directory_mtime', ?)", (self._directory_mtime(),))
+        self._db.commit()
+
+
+    def tile_path(self, tile):
+        zoom, x, y = tile_key(tile)
+        return os.path.join(self.tile_directory, TILE_FILENAME_FORMAT % (x, y, zoom))
+
+
+    def missing(self, tiles):
+        ''' List of the given tiles not held in the cache '''
+        return [tile for tile in tiles if tile_key(tile) not in self._tiles]
+
+
+    def get(self, tile):
+        ''' Tile image data '''
+        with open(self.tile_path(tile), 'rb') as fd:
+            return fd.read()
+
+
+    def open(self, tile):
+        ''' Tile image file object '''
+        return io.BytesIO(self.get(tile))
+
+
+    def put(self, tile, data):
+        ''' Save a tile - its manifest entry is written in a batch, so no write lock is held between puts '''
+        key = tile_key(tile)
+        tile_downloader.save_tile(self.tile_path(tile), data)
+        fetched = time.time()
+        with self._lock:
+            self._tiles[key] = (len(data), fetched)
+            self._pending.append(key + (len(data), fetched))
+            if len(self._pending) >= self.INSERT_BATCH_SIZE:
+                self._write_pending()
+
+
+    def _write_pending(self):
+        try:
+            self._db.executemany('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)', self._pending)
+            self._db.commit()
+        except sqlite3.OperationalError as e:
+            # Still locked by another process after the busy timeout: keep the entries for the next batch
+            self._db.rollback()
+            log.warning('tile manifest busy (%s): %d entries pending' % (e, len(self._pending)))
+            return False
+        self._pending = []
+        return True
+
+
+    def flush(self):
+        ''' Commit manifest updates and record the directory state they correspond to '''
+        with self._lock:
+            if self._write_pending():
+                try:
+                    self._save_directory_mtime()
+                except sqlite3.OperationalError as e:
+                    # Left unrecorded, the directory is rescanned on the next open
+                    self._db.rollback()
+                    log.warning('tile manifest busy (%s): directory state not recorded' % e)
+
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+
+class MBTilesCache:
+    '''
+    Tile cache stored in a single MBTiles file (https://github.com/mapbox/mbtiles-spec). MBTiles uses TMS row
+    numbering, so rows are flipped relative to the OpenStreetMap tile y values used everywhere else.
+    '''
+
+    FILE_EXTENSION = '.mbtiles'
+    INSERT_BATCH_SIZE = 256
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.location = filename
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        # WAL lets reader connections (other threads and processes) proceed while tiles are being inserted
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        if self._db.execute("SELECT value FROM metadata WHERE name = 'format'").fetchone() is None:
+            self._db.executemany('INSERT INTO metadata VALUES (?, ?)', [
+                ('name', os.path.splitext(os.path.basename(filename))[0]),
+                ('format', 'png'),
+                ('type', 'baselayer'),
+                ('version', '1'),
+            ])
+        self._db.commit()
+
+        self._tiles = set()
+        for zoom, x, row in self._db.execute('SELECT zoom_level, tile_column, tile_row FROM tiles'):
+            self._tiles.add((zoom, x, self._flip_y(row, zoom)))
+        log.debug('mbtiles index loaded: %d tiles' % len(self._tiles))
+
+        self._pending = {}
+        self._local = threading.local()
+        self._readers = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+    def __contains__(self, tile):
+        return tile_key(tile) in self._tiles
+
+
+    def __repr__(self):
+        return '<%s %s tiles:%d>' % (self.__class__.__name__, self.filename, len(self._tiles))
+
+
+    @staticmethod
+    def _flip_y(y, zoom):
+        ''' Convert between OpenStreetMap tile y and TMS tile row (the conversion is its own inverse) '''
+        return (1 << zoom) - 1 - y
+
+
+    def _reader(self):
+        ''' Read only connection for the calling thread '''
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            reader = sqlite3.connect('file:%s?mode=ro' % os.path.abspath(self.filename), uri=True, check_same_thread=False)
+            self._local.reader = reader
+            with self._lock:
+                self._readers.append(reader)
+        return reader
+
+
+    def missing(self, tiles):
+        ''' List of the given tiles not held in the cache '''
+        return [tile for tile in tiles if tile_key(tile) not in self._tiles]
+
+
+    def get(self, tile):
+        ''' Tile image data '''
+        key = tile_key(tile)
+        with self._lock:
+            data = self._pending.get(key)
+        if data is not None:
+            return data
+
+        zoom, x, y = key
+        row = self._reader().execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+            (zoom, x, self._flip_y(y, zoom))).fetchone()
+        if row is None:
+            raise KeyError('Tile not in cache: %r' % (tile,))
+        return row[0]
+
+
+    def open(self, tile):
+        ''' Tile image file object '''
+        return io.BytesIO(self.get(tile))
+
+
+    def put(self, tile, data):
+        ''' Queue a tile for insertion - inserts are written in batches '''
+        key = tile_key(tile)
+        with self._lock:
+            self._pending[key] = bytes(data)
+            self._tiles.add(key)
+            if len(self._pending) >= self.INSERT_BATCH_SIZE:
+                self._write_pending()
+
+
+    def _write_pending(self):
+        if not self._pending:
+            return
+        rows = [(zoom, x, self._flip_y(y, zoom), sqlite3.Binary(data)) for (zoom, x, y), data in self._pending.items()]
+        self._db.executemany('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)', rows)
+        self._db.commit()
+        self._pending = {}
+
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            with self._lock:
+                for reader in self._readers:
+                    reader.close()
+                self._readers = []
+            self._db.close()
+            self._db = None
+
+
+class SynthesizingTileCache:
+    '''
+    Tile cache wrapper that synthesizes tiles the backing cache does not hold from cached tiles at other zooms: the
+    four children at zoom + 1 downsampled, or else the matching part of the nearest ancestor (up to MAX_OVERZOOM
+    levels up) cropped and upscaled. Synthesized tiles are kept in memory as decoded arrays (LRU, max_tiles) and never
+    written to the backing cache. With prefer_synthesis, missing() leaves out tiles that can be synthesized so none
+    are downloaded.
+    '''
+
+    MAX_OVERZOOM = 4
+    DEFAULT_MAX_TILES = 256
+
+    def __init__(self, tile_cache, prefer_synthesis=False, max_tiles=DEFAULT_MAX_TILES):
+        self.tile_cache = tile_cache
+        self.location = tile_cache.location
+        self.prefer_synthesis = prefer_synthesis
+        self.max_tiles = max_tiles
+        self.synthesized = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __len__(self):
+        return len(self.tile_cache)
+
+
+    def __contains__(self, tile):
+        return tile in self.tile_cache or self.sources(tile) is not None
+
+
+    def __repr__(self):
+        return '<%s %r synthesized:%d held:%d>' % (self.__class__.__name__, self.tile_cache, self.synthesized, len(self._tiles))
+
+
+    def sources(self, tile):
+        ''' Cached tiles a tile can be synthesized from: its four children or one ancestor, or None '''
+        zoom, x, y = tile_key(tile)
+        children = [osm.TilePoint(2 * x + dx, 2 * y + dy, zoom + 1) for dy in (0, 1) for dx in (0, 1)]
+        if all(child in self.tile_cache for child in children):
+            return children
+        for levels in range(1, min(self.MAX_OVERZOOM, zoom) + 1):
+            ancestor = osm.TilePoint(x >> levels, y >> levels, zoom - levels)
+            if ancestor in self.tile_cache:
+                return [ancestor]
+        return None
+
+
+    def missing(self, tiles):
+        ''' List of the given tiles to download: not in the backing cache (and, preferring synthesis, not synthesizable) '''
+        missing_tiles = self.tile_cache.missing(tiles)
+        if self.prefer_synthesis:
+            missing_tiles = [tile for tile in missing_tiles if self.sources(tile) is None]
+        return missing_tiles
+
+
+    def unavailable(self, tiles):
+        ''' List of the given tiles neither cached nor synthesizable '''
+        return [tile for tile in self.tile_cache.missing(tiles) if self.sources(tile) is None]
+
+
+    def synthesize(self, tile):
+        ''' Build a tile image from cached tiles at other zooms '''
+        sources = self.sources(tile)
+        if sources is None:
+            raise KeyError('Tile not in cache and cannot be synthesized: %r' % (tile,))
+
+        if len(sources) == 4:
+            im = Image.new('RGB', (512, 512))
+            for source in sources:
+                with Image.open(self.tile_cache.open(source)) as im_source:
+                    im.paste(im_source.convert('RGB'), ((source.x % 2) * 256, (source.y % 2) * 256))
+            return im.reduce(2)
+
+        zoom, x, y = tile_key(tile)
+        ancestor = sources[0]
+        levels = zoom - ancestor.zoom
+        size = 256 >> levels
+        left = (x - (ancestor.x << levels)) * size
+        top = (y - (ancestor.y << levels)) * size
+        with Image.open(self.tile_cache.open(ancestor)) as im_ancestor:
+            im = im_ancestor.convert('RGB').crop((left, top, left + size, top + size))
+        return im.resize((256, 256), Image.Resampling.BICUBIC)
+
+
+    def decode(self, tile):
+        '''
+        Tile as a read-only RGB array: decoded from the backing cache, or synthesized. Synthesized arrays are kept in
+        memory, so DecodedTileCache takes them from here without a PNG encode and decode.
+        '''
+        if tile in self.tile_cache:
+            with Image.open(self.tile_cache.open(tile)) as im:
+                tile_array = np.asarray(im.convert('RGB'))
+            tile_array.flags.writeable = False
+            return tile_array
+
+        key = tile_key(tile)
+        with self._lock:
+            tile_array = self._tiles.get(key)
+            if tile_array is not None:
+                self._tiles.move_to_end(key)
+                return tile_array
+
+        tile_array = np.asarray(self.synthesize(tile))
+        tile_array.flags.writeable = False
+        log.debug('synthesized tile: %r' % (tile,))
+
+        with self._lock:
+            self._tiles[key] = tile_array
+            self.synthesized += 1
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile_array
+
+
+    def get(self, tile):
+        ''' Tile image data, encoded as PNG when synthesized '''
+        if tile in self.tile_cache:
+            return self.tile_cache.get(tile)
+
+        output = io.BytesIO()
+        Image.fromarray(self.decode(tile)).save(output, format='PNG', compress_level=1)
+        return output.getvalue()
+
+
+    def open(self, tile):
+        ''' Tile image file object '''
+        return io.BytesIO(self.get(tile))
+
+
+    def put(self, tile, data):
+        self.tile_cache.put(tile, data)
+        with self._lock:
+            self._tiles.pop(tile_key(tile), None)
+
+
+    def flush(self):
+        self.tile_cache.flush()
+
+
+    def close(self):
+        self.tile_cache.close()
+
+
+class DecodedTileCache:
+    '''
+    LRU cache of decoded tiles as read-only RGB numpy arrays (256 x 256 x 3), bounded by the total size of the
+    decoded arrays. Tiles are decoded from the backing tile cache on a miss.
+    '''
+
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+    def __init__(self, tile_cache, max_bytes=DEFAULT_MAX_BYTES):
+        self.tile_cache = tile_cache
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+    def __contains__(self, tile):
+        return tile_key(tile) in self._tiles
+
+
+    def __repr__(self):
+        return '<%s tiles:%d bytes:%d hits:%d misses:%d evictions:%d>' % (
+            self.__class__.__name__, len(self._tiles), self._bytes, self.hits, self.misses, self.evictions)
+
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+    def decode(self, tile):
+        ''' Decode a tile from the backing tile cache without caching it '''
+        if isinstance(self.tile_cache, SynthesizingTileCache):
+            return self.tile_cache.decode(tile)
+        with Image.open(self.tile_cache.open(tile)) as im:
+            tile_array = np.asarray(im.convert('RGB'))
+        tile_array.flags.writeable = False
+        return tile_array
+
+
+    def get(self, tile):
+        key = tile_key(tile)
+        with self._lock:
+            tile_array = self._tiles.get(key)
+            if tile_array is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile_array
+            self.misses += 1
+
+        tile_array = self.decode(tile)
+        self._insert(key, tile_array)
+        return tile_array
+
+
+    def _insert(self, key, tile_array):
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = tile_array
+            self._bytes += tile_array.nbytes
+            while self._bytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+
+    def preload(self, tiles, workers=4):
+        ''' Decode tiles ahead of rendering (across a thread pool) so frame composition does not decode '''
+        tiles = [tile for tile in tiles if tile_key(tile) not in self._tiles]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tile-decode') as executor:
+            for tile, tile_array in zip(tiles, executor.map(self.decode, tiles)):
+                self._insert(tile_key(tile), tile_array)
+        log.debug('preloaded %d tiles: %r' % (len(tiles), self))
@@ -0,0 +1,198 @@
+# Tile downloader - fetches tiles in-process over keep-alive HTTP connections from a bounded pool of worker threads.
+#
+# Each worker thread holds its own persistent connection to the tile server, so the pool of connections is bounded
+# by the number of workers. A rate limit shared by all workers spaces out requests to respect the tile server usage
+# policy (https://operations.osmfoundation.org/policies/tiles/).
+#
+# 2026-10-17
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+import os
+import time
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from . import openstreetmaps as osm
+from . import utils
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_URL_TEMPLATE = 'https://tile.openstreetmap.org/{zoom}/{x}/{y}.png'
+DEFAULT_USER_AGENT = 'openstreetmaps_tiler/0.1 (+https://github.com/stakita/openstreetmaps_tiler)'
+DEFAULT_WORKERS = 2
+DEFAULT_RATE_LIMIT = 10.0
+
+
+class TileDownloadException(Exception):
+    pass
+
+
+class RateLimiter:
+    ''' Space out calls to wait() so that at most 'rate' calls per second proceed across all threads '''
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot_time = max(now, self._next_time)
+            self._next_time = slot_time + self.interval
+        if slot_time > now:
+            time.sleep(slot_time - now)
+
+
+class TileDownloader:
+    '''
+    Concurrent tile fetcher. Use fetch() for a single tile or download() to fetch a batch across the worker pool.
+    url_template is formatted with zoom, x and y, so it can point at a local stand-in server for testing.
+    '''
+
+    def __init__(self, url_template=DEFAULT_URL_TEMPLATE, workers=DEFAULT_WORKERS, rate_limit=DEFAULT_RATE_LIMIT,
+                 user_agent=DEFAULT_USER_AGENT, timeout=30, retries=3):
+        url = urlsplit(url_template)
+        if url.scheme not in ('http', 'https'):
+            raise ValueError('Unsupported tile url scheme: %r' % url_template)
+        self.url_template = url_template
+        self.workers = max(1, int(workers))
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.retries = retries
+        self._scheme = url.scheme
+        self._netloc = url.netloc
+        self._rate_limiter = RateLimiter(rate_limit)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._executor = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+    def tile_url(self, tile):
+        tile_ref = osm.tile_reference(tile)
+        return self.url_template.format(zoom=tile_ref.zoom, x=tile_ref.x, y=tile_ref.y)
+
+
+    def _connection(self):
+        ''' Persistent connection for the calling thread '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._scheme == 'https':
+                connection = http.client.HTTPSConnection(self._netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self._netloc, timeout=self.timeout)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+
+    def _reset_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+
+
+    def fetch(self, tile):
+        ''' Fetch a single tile, returning the image data '''
+        url = urlsplit(self.tile_url(tile))
+        path = url.path + ('?' + url.query if url.query else '')
+        headers = {'User-Agent': self.user_agent, 'Connection': 'keep-alive'}
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt * 0.25, 5.0))
+            self._rate_limiter.wait()
+            connection = self._connection()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                # Dropped keep-alive connections surface here - reconnect and retry
+                self._reset_connection()
+                error = e
+                continue
+
+            if response.status == 200:
+                return data
+            error = '%d %s' % (response.status, response.reason)
+            if response.status != 429 and response.status < 500:
+                break
+
+        raise TileDownloadException('Failed to download %s: %s' % (self.tile_url(tile), error))
+
+
+    def download(self, tiles, store):
+        '''
+        Fetch all tiles across the worker pool. store(tile, data) is called in the calling thread as each tile
+        arrives. Failures are collected and raised together once all other tiles are done.
+        '''
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='tile-download')
+
+        tiles_iter = iter(tiles)
+        max_pending = self.workers * 4
+        pending = {}
+        failures = []
+        downloaded = 0
+
+        while True:
+            # Keep a bounded number of requests in flight rather than queueing every tile up front
+            for tile in tiles_iter:
+                log.debug('download tile: %s' % self.tile_url(tile))
+                pending[self._executor.submit(self.fetch, tile)] = tile
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = pending.pop(future)
+                try:
+                    data = future.result()
+                except TileDownloadException as e:
+                    log.warning(str(e))
+                    failures.append(tile)
+                    continue
+                store(tile, data)
+                downloaded += 1
+
+        if failures:
+            raise TileDownloadException('Failed to download %d tiles: %r' % (len(failures), failures))
+
+        return downloaded
+
+
+def save_tile(output_filename, data):
+    ''' Write tile data via a temporary file so that readers never see a partial tile '''
+    utils.write_atomic(output_filename, data)
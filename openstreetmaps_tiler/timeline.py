@@ -0,0 +1,141 @@
+# Frame timeline: maps video frames to track positions.
+#
+# The track is sampled by time, the video by frame. For frame f (at f / fps seconds from the start time) the track
+# position shown is the first sample at or after that time. Samples that share a timestamp (telemetry recorded at
+# 18Hz but timestamped to the second) are spread out in 1/18s steps within each run of equal timestamps, so that
+# they are shown in turn rather than all at once.
+#
+# Everything is computed for all frames at once: the adjusted sample times are built with array operations and each
+# frame's sample is found with searchsorted. Positions can optionally be interpolated between samples instead
+# (linear, or a Catmull-Rom spline through the samples), for smooth sub-pixel motion at frame rates above the sample
+# rate.
+#
+# 2026-10-17
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+import sys
+import logging
+
+try:
+    import numpy as np
+except ImportError as e:
+    installs = ['numpy']
+    sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
+    sys.exit(1)
+
+log = logging.getLogger(__name__)
+
+
+DUPLICATE_TIME_STEP = 1 / 18 # Telemetry is recorded at 18Hz
+
+INTERPOLATE_NONE = 'none'
+INTERPOLATE_LINEAR = 'linear'
+INTERPOLATE_SPLINE = 'spline'
+INTERPOLATE_MODES = (INTERPOLATE_NONE, INTERPOLATE_LINEAR, INTERPOLATE_SPLINE)
+
+
+def frame_count(times, fps, start_time=None):
+    ''' Number of frames from start_time (default: the first sample time) to the last sample time '''
+    if start_time is None:
+        start_time = times[0]
+    return max(0, int((times[-1] - start_time) * fps))
+
+
+def adjusted_times(times, start_time=None):
+    '''
+    Sample times relative to start_time, with samples that repeat the previous sample's timestamp spread out by
+    DUPLICATE_TIME_STEP each. The first sample always counts as a repeat (it is offset by one step).
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    if start_time is None:
+        start_time = times[0]
+    relative_times = times - start_time
+    if len(relative_times) == 0:
+        return relative_times
+
+    # Index of the first sample of the run of equal timestamps each sample belongs to
+    run_start = np.ones(len(relative_times), dtype=bool)
+    run_start[1:] = relative_times[1:] != relative_times[:-1]
+    run_first_index = np.maximum.accumulate(np.where(run_start, np.arange(len(relative_times)), 0))
+
+    # Position within the run, counting the first run from one
+    rank = np.arange(len(relative_times)) - run_first_index
+    rank[run_first_index == 0] += 1
+
+    # Add the steps one at a time, the way the offsets were accumulated sample by sample, so that frame boundaries
+    # fall exactly where they always have (rank * step rounds differently)
+    adjusted_times = relative_times.copy()
+    repeats = np.flatnonzero(rank)
+    for step in range(1, int(rank.max()) + 1):
+        repeats = repeats[rank[repeats] >= step]
+        adjusted_times[repeats] += DUPLICATE_TIME_STEP
+
+    return adjusted_times
+
+
+def frame_sample_indices(times, fps, start_time=None, frames=None):
+    ''' Index of the track sample shown in each frame: the first sample whose adjusted time is at or after the frame time '''
+    if frames is None:
+        frames = frame_count(times, fps, start_time)
+    sample_times = np.maximum.accumulate(adjusted_times(times, start_time))
+    frame_times = np.arange(frames) / fps
+    indices = np.searchsorted(sample_times, frame_times, side='left')
+    return np.minimum(indices, len(sample_times) - 1)
+
+
+def spline_interp(t, sample_times, values):
+    '''
+    Catmull-Rom (cubic Hermite) interpolation of values at times t. Tangents are finite differences over the
+    neighbouring samples, scaled for the uneven sample spacing; t is clamped to the sample time range.
+    '''
+    n = len(sample_times)
+    if n < 3:
+        return np.interp(t, sample_times, values)
+
+    t = np.clip(t, sample_times[0], sample_times[-1])
+
+    # Tangent (per second) at each sample, one sided at the ends
+    index_prev = np.maximum(np.arange(n) - 1, 0)
+    index_next = np.minimum(np.arange(n) + 1, n - 1)
+    time_span = sample_times[index_next] - sample_times[index_prev]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tangents = np.where(time_span > 0, (values[index_next] - values[index_prev]) / time_span, 0.0)
+
+    # Segment [i, i + 1] containing each t, and the position u within it
+    i = np.clip(np.searchsorted(sample_times, t, side='right') - 1, 0, n - 2)
+    dt = sample_times[i + 1] - sample_times[i]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = np.where(dt > 0, (t - sample_times[i]) / dt, 0.0)
+
+    u2 = u * u
+    u3 = u2 * u
+    h00 = 2 * u3 - 3 * u2 + 1
+    h10 = u3 - 2 * u2 + u
+    h01 = -2 * u3 + 3 * u2
+    h11 = u3 - u2
+    return h00 * values[i] + h10 * dt * tangents[i] + h01 * values[i + 1] + h11 * dt * tangents[i + 1]
+
+
+def frame_positions(times, x, y, fps, start_time=None, interpolate=INTERPOLATE_NONE):
+    '''
+    Track position (x, y) arrays with one entry per frame. By default each frame steps to a sample position. With
+    interpolate 'linear' or 'spline', positions are interpolated between samples at their adjusted times, giving
+    fractional positions that move smoothly at any frame rate.
+    '''
+    if interpolate not in INTERPOLATE_MODES:
+        raise ValueError('unknown interpolation: %r (expected one of: %s)' % (interpolate, ', '.join(INTERPOLATE_MODES)))
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    frames = frame_count(times, fps, start_time)
+
+    if interpolate == INTERPOLATE_NONE:
+        indices = frame_sample_indices(times, fps, start_time, frames)
+        return x[indices], y[indices]
+
+    sample_times = np.maximum.accumulate(adjusted_times(times, start_time))
+    frame_times = np.arange(frames) / fps
+    if interpolate == INTERPOLATE_SPLINE:
+        return spline_interp(frame_times, sample_times, x), spline_interp(frame_times, sample_times, y)
+    return np.interp(frame_times, sample_times, x), np.interp(frame_times, sample_times, y)
@@ -5,16 +5,21 @@
 #
 # Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
 #
+import os
 import sys
+import tempfile
+import threading
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 from . import openstreetmaps as osm
 
 try:
     from PIL import Image
+    import numpy as np
 except ImportError as e:
-    installs = ['Pillow']
+    installs = ['Pillow', 'numpy']
     sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
     sys.exit(1)
 
@@ -22,6 +27,10 @@ except ImportError as e:
 log = logging.getLogger(__name__)
 
 
+_new_file_mode = None
+_new_file_mode_lock = threading.Lock()
+
+
 class ConversionException(Exception):
     pass
 
@@ -167,6 +176,16 @@ def get_track_geo_extents(points_iter):
     return CoordinateExtents(coord_lo, coord_hi)
 
 
+def get_coordinates_geo_extents(coordinates):
+    ''' Calculate the maximum and minimum values of lon and lat for a Coordinate of lon/lat arrays '''
+    if len(coordinates.lon) == 0:
+        raise ValueError('No coordinates to calculate extents for')
+
+    coord_lo = osm.Coordinate(float(np.min(coordinates.lon)), float(np.min(coordinates.lat)))
+    coord_hi = osm.Coordinate(float(np.max(coordinates.lon)), float(np.max(coordinates.lat)))
+    return CoordinateExtents(coord_lo, coord_hi)
+
+
 def maximize_zoom(track_extents, output_x_px, output_y_px, boundary_pixels=20, zoom_max=19):
     log.debug('maximize_zoom - track_extents: %s, output: (%d, %d)' % (repr(track_extents), output_x_px, output_y_px))
 
@@ -205,17 +224,98 @@ def maximize_zoom(track_extents, output_x_px, output_y_px, boundary_pixels=20, z
     return zoom_target, boundary_extents
 
 
-def join_images_horizontal(im1, im2):
-    dst = Image.new('RGB', (im1.width + im2.width, im1.height))
-    dst.paste(im1, (0, 0))
-    dst.paste(im2, (im1.width, 0))
-    return dst
-
-
-def join_images_vertical(im1, im2):
-    dst = Image.new('RGB', (im1.width, im1.height + im2.height))
-    dst.paste(im1, (0, 0))
-    dst.paste(im2, (0, im1.height))
-    return dst
-
-
+def tile_grid_size(coordinate_extents, zoom):
+    ''' (columns, rows) of the grid of tiles covering coordinate_extents at zoom '''
+    tile_extents = coordinate_extents.to_tile_extents(zoom)
+    tile_ref_lo = osm.tile_reference(tile_extents.lo())
+    tile_ref_hi = osm.tile_reference(tile_extents.hi())
+    return tile_ref_hi.x - tile_ref_lo.x + 1, tile_ref_hi.y - tile_ref_lo.y + 1
+
+
+def paste_array(im_dst, im_src, x, y):
+    ''' Paste image array im_src into im_dst with its top left corner at (x, y), clipped to the bounds of im_dst '''
+    dst_height, dst_width = im_dst.shape[:2]
+    src_height, src_width = im_src.shape[:2]
+
+    dst_x_lo = max(x, 0)
+    dst_y_lo = max(y, 0)
+    dst_x_hi = min(x + src_width, dst_width)
+    dst_y_hi = min(y + src_height, dst_height)
+    if dst_x_lo >= dst_x_hi or dst_y_lo >= dst_y_hi:
+        return im_dst
+
+    im_dst[dst_y_lo:dst_y_hi, dst_x_lo:dst_x_hi] = im_src[dst_y_lo - y:dst_y_hi - y, dst_x_lo - x:dst_x_hi - x]
+    return im_dst
+
+
+def crop_window(box):
+    ''' Whole pixel (left, upper, right, lower) window for a crop box, rounded the way Image.crop rounds it '''
+    return tuple(int(round(value)) for value in box)
+
+
+def build_tile_mosaic(columns, rows, load_tile, workers=4, tile_pixels=256, window=None):
+    '''
+    Assemble a columns x rows grid of tiles into one RGB image. The canvas is allocated once and each tile is copied
+    into its slot; load_tile(column, row) returns the tile as an RGB array or image and is called across a pool of
+    'workers' threads, so decoding runs in parallel.
+    With a (left, upper, right, lower) pixel window of the grid, only that window is built (like cropping the full
+    mosaic with it, area outside the grid is black) and only the tiles intersecting it are loaded.
+    '''
+    if window is None:
+        window = (0, 0, columns * tile_pixels, rows * tile_pixels)
+    x_lo, y_lo, x_hi, y_hi = window
+
+    mosaic = np.zeros((max(0, y_hi - y_lo), max(0, x_hi - x_lo), 3), dtype=np.uint8)
+    slots = [(column, row)
+             for column in range(max(0, x_lo // tile_pixels), min(columns, -(-x_hi // tile_pixels)))
+             for row in range(max(0, y_lo // tile_pixels), min(rows, -(-y_hi // tile_pixels)))]
+    log.debug('tile mosaic: %d of %d tiles, window: %r' % (len(slots), columns * rows, window))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tile-mosaic') as executor:
+        for (column, row), tile_image in zip(slots, executor.map(lambda slot: load_tile(*slot), slots)):
+            paste_array(mosaic, np.asarray(tile_image), column * tile_pixels - x_lo, row * tile_pixels - y_lo)
+    return Image.fromarray(mosaic)
+
+
+def _read_umask():
+    # Linux reports the umask without changing it; elsewhere it has to be set and restored
+    try:
+        with open('/proc/self/status') as fd:
+            for line in fd:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def new_file_mode():
+    ''' Mode open() gives new files under the process umask, read once when first needed '''
+    global _new_file_mode # pylint: disable=W0603
+    with _new_file_mode_lock:
+        if _new_file_mode is None:
+            _new_file_mode = 0o666 & ~_read_umask()
+        return _new_file_mode
+
+
+def write_atomic(filename, data):
+    '''
+    Write a file via a temporary file in the same directory, so that readers never see a partial file. data is the
+    file content, or a function writing it to the open (binary) file. The file gets the mode open() would give it,
+    not the temporary file's 0600.
+    '''
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix=os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'wb') as temp_fd:
+            if callable(data):
+                data(temp_fd)
+            else:
+                temp_fd.write(data)
+        os.chmod(temp_filename, new_file_mode())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
@@ -0,0 +1,208 @@
+# Video output helpers shared by the render scripts.
+#
+# Parallel rendering splits the frame range into contiguous segments, each encoded to its own file by a worker
+# process. Every segment starts on a key frame, so the segments are joined with ffmpeg's concat demuxer by stream
+# copy (no re-encode). Segment boundaries are aligned to the encoder's key frame interval, so key frames fall where a
+# serial render puts them. The encoder's rate control restarts at each segment, so the encoded frames can differ
+# slightly from a serial render.
+#
+# Within a process, write_frames() pipelines frame composition and encoding: frames are composed on a small thread
+# pool and written by a dedicated writer thread, connected by a bounded queue:
+#
+#   frame keys -> [compose threads] -> in order -> [bounded frame queue] -> [writer thread] -> VideoWriter
+#
+# PipelineStats records the time spent in each stage and the queue depth, which shows which stage limits throughput:
+# a full queue (producer blocked) means the encoder is the bottleneck, an empty one (writer starved) composition.
+#
+# 2026-10-17
+#
+# Released under GNU GENERAL PUBLIC LICENSE v3. (Use at your own risk)
+#
+import os
+import sys
+import time
+import queue
+import shutil
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import cv2
+    import sh
+except ImportError as e:
+    installs = ['opencv-python', 'sh']
+    sys.stderr.write('Error: %s\nTry:\n    pip install --user %s\n' % (e, ' '.join(installs)))
+    sys.exit(1)
+
+log = logging.getLogger(__name__)
+
+
+FOURCC = 'mp4v'
+GOP_FRAMES = 12 # OpenCV's FFmpeg writer starts a new group of pictures (key frame) every 12 frames
+SEGMENT_FILENAME_FORMAT = '%s.segment%03d.mp4'
+DEFAULT_COMPOSE_WORKERS = 2
+DEFAULT_QUEUE_FRAMES = 16
+
+
+def open_video_writer(output_file, fps, pixels_x, pixels_y):
+    fourcc = cv2.VideoWriter_fourcc(*FOURCC)
+    return cv2.VideoWriter(output_file, fourcc, float(fps), (pixels_x, pixels_y))
+
+
+def ffmpeg_available():
+    ''' Segment concatenation needs the ffmpeg executable on the PATH '''
+    return shutil.which('ffmpeg') is not None
+
+
+def frame_segments(frame_start, frame_finish, segments, align=1):
+    '''
+    Split [frame_start, frame_finish) into at most 'segments' contiguous, near equal (start, stop) ranges, with each
+    boundary a multiple of 'align' frames from frame_start
+    '''
+    frames = frame_finish - frame_start
+    blocks = (frames + align - 1) // align
+    segments = max(1, min(segments, blocks))
+    bounds = [frame_start + min(frames, ((blocks * i) // segments) * align) for i in range(segments + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(segments) if bounds[i] < bounds[i + 1]]
+
+
+def segment_filenames(output_file, segments):
+    return [SEGMENT_FILENAME_FORMAT % (output_file, i) for i in range(segments)]
+
+
+def concat_segments(segment_files, output_file):
+    ''' Join encoded segments into output_file without re-encoding, then remove the segments '''
+    if not segment_files:
+        raise ValueError('no video segments to join into %s' % output_file)
+
+    list_filename = output_file + '.segments.txt'
+    with open(list_filename, 'w') as f:
+        for segment_file in segment_files:
+            # Paths in the concat list are relative to the list file, so make them absolute
+            f.write("file '%s'\n" % os.path.abspath(segment_file).replace("'", "'\\''"))
+
+    log.info('concatenating %d segments: %s' % (len(segment_files), output_file))
+    try:
+        sh.ffmpeg('-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_filename, '-c', 'copy', # pylint: disable=E1101
+                  '-f', 'mp4', output_file)
+    finally:
+        os.remove(list_filename)
+
+    for segment_file in segment_files:
+        os.remove(segment_file)
+
+
+class PipelineStats:
+    ''' Frame counts, per-stage timing and frame queue depth for one write_frames() run '''
+
+    def __init__(self):
+        self.frames = 0
+        self.frames_reused = 0
+        self.compose_seconds = 0.0           # Summed over the composition threads
+        self.write_seconds = 0.0             # Writer thread time in VideoWriter.write
+        self.producer_blocked_seconds = 0.0  # Waiting for space in a full frame queue
+        self.writer_starved_seconds = 0.0    # Writer waiting on an empty frame queue
+        self.queue_depth_total = 0
+        self.queue_depth_max = 0
+
+
+    def __repr__(self):
+        return ('<%s frames:%d reused:%d compose:%0.3fs write:%0.3fs producer_blocked:%0.3fs writer_starved:%0.3fs '
+                'queue_depth_mean:%0.1f queue_depth_max:%d bottleneck:%s>' % (
+                    self.__class__.__name__, self.frames, self.frames_reused, self.compose_seconds, self.write_seconds,
+                    self.producer_blocked_seconds, self.writer_starved_seconds, self.queue_depth_mean,
+                    self.queue_depth_max, self.bottleneck))
+
+
+    @property
+    def queue_depth_mean(self):
+        return self.queue_depth_total / self.frames if self.frames else 0.0
+
+
+    @property
+    def bottleneck(self):
+        ''' The stage the other spent longer waiting on: 'encode' or 'compose' '''
+        return 'encode' if self.producer_blocked_seconds > self.writer_starved_seconds else 'compose'
+
+
+def write_frames(video, frame_keys, compose, workers=DEFAULT_COMPOSE_WORKERS, max_queued=DEFAULT_QUEUE_FRAMES, frame_offset=0, frames=None):
+    '''
+    Compose and write a frame for each key in frame_keys. compose(key) returns a BGR frame and runs on a pool of
+    'workers' threads, video.write runs on a dedicated writer thread, and frames are handed over in order through a
+    queue of at most max_queued frames. A key equal to the previous frame's key reuses that frame.
+    Returns the PipelineStats for the run.
+    '''
+    stats = PipelineStats()
+    stats_lock = threading.Lock()
+    frame_queue = queue.Queue(maxsize=max_queued)
+    writer_errors = []
+
+    def timed_compose(key):
+        time_start = time.perf_counter()
+        frame_image = compose(key)
+        with stats_lock:
+            stats.compose_seconds += time.perf_counter() - time_start
+        return frame_image
+
+    def writer():
+        while True:
+            time_start = time.perf_counter()
+            frame_image = frame_queue.get()
+            time_got = time.perf_counter()
+            stats.writer_starved_seconds += time_got - time_start
+            if frame_image is None:
+                break
+            if writer_errors:
+                # Keep draining so the producer never blocks on a dead writer
+                continue
+            try:
+                video.write(frame_image)
+            except Exception as e: # pylint: disable=W0703
+                writer_errors.append(e)
+            stats.write_seconds += time.perf_counter() - time_got
+
+    def put(frame, future):
+        if frame % 1000 == 0:
+            log.info('%d %s' % (frame, frames if frames is not None else ''))
+        frame_image = future.result()
+        depth = frame_queue.qsize()
+        stats.queue_depth_total += depth
+        stats.queue_depth_max = max(stats.queue_depth_max, depth)
+        time_start = time.perf_counter()
+        frame_queue.put(frame_image)
+        stats.producer_blocked_seconds += time.perf_counter() - time_start
+        stats.frames += 1
+
+    writer_thread = threading.Thread(target=writer, name='video-writer')
+    writer_thread.start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='frame-compose') as executor:
+            pending = deque()
+            future_last = None
+            key_last = None
+            for frame, key in enumerate(frame_keys, frame_offset):
+                if writer_errors:
+                    break
+                if future_last is not None and key == key_last:
+                    stats.frames_reused += 1
+                else:
+                    future_last = executor.submit(timed_compose, key)
+                    key_last = key
+                pending.append((frame, future_last))
+
+                # Bound the frames in flight in composition as well as in the queue
+                if len(pending) >= max_queued:
+                    put(*pending.popleft())
+
+            while pending and not writer_errors:
+                put(*pending.popleft())
+    finally:
+        frame_queue.put(None)
+        writer_thread.join()
+
+    if writer_errors:
+        raise writer_errors[0]
+
+    return stats
@@ -12,12 +12,12 @@ setup(
         'opencv-python',
         'numpy',
         'sh',
-        'xmltodict',
     ],
     entry_points = {
         'console_scripts': [
             'create_overview_video = openstreetmaps_tiler.scripts.create_overview_video:main',
             'create_chase_video = openstreetmaps_tiler.scripts.create_chase_video:main',
+            'create_batch_video = openstreetmaps_tiler.scripts.create_batch_video:main',
             'tile_download = openstreetmaps_tiler.scripts.tile_download:main',
         ]
     }
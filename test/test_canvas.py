@@ -0,0 +1,111 @@
+import sys
+import os
+import io
+
+import numpy as np
+from PIL import Image
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import openstreetmaps as osm  # pylint: disable=E0401
+from openstreetmaps_tiler import tile_cache as tc  # pylint: disable=E0401
+from openstreetmaps_tiler import canvas  # pylint: disable=E0401
+
+
+ZOOM = 10
+
+
+def make_tile_cache(tile_directory, tiles):
+    tile_cache = tc.TileCache(tile_directory)
+    rng = np.random.default_rng(1)
+    for tile in tiles:
+        tile_data = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (256, 256, 3), dtype=np.uint8)).save(tile_data, 'PNG')
+        tile_cache.put(tile, tile_data.getvalue())
+    return tile_cache
+
+
+def expected_view(decoded_tiles, x, y, pixels_x, pixels_y):
+    ''' Compose the view tile by tile in RGB, then convert to BGR '''
+    im_view = np.zeros((pixels_y, pixels_x, 3), dtype=np.uint8)
+    for tile_x in range(x // 256, (x + pixels_x) // 256 + 1):
+        for tile_y in range(y // 256, (y + pixels_y) // 256 + 1):
+            tile = osm.TilePoint(tile_x, tile_y, ZOOM)
+            if tile in decoded_tiles.tile_cache:
+                tile_array = decoded_tiles.get(tile)
+                for j in range(256):
+                    row_y = tile_y * 256 + j - y
+                    if 0 <= row_y < pixels_y:
+                        x_lo = max(tile_x * 256 - x, 0)
+                        x_hi = min(tile_x * 256 + 256 - x, pixels_x)
+                        if x_lo < x_hi:
+                            im_view[row_y, x_lo:x_hi] = tile_array[j, x_lo + x - tile_x * 256:x_hi + x - tile_x * 256]
+    return im_view[:, :, ::-1]
+
+
+def test_tile_canvas_views(tmp_path):
+    tiles = [osm.TilePoint(x, y, ZOOM) for x in range(6) for y in range(5)]
+    with make_tile_cache(str(tmp_path), tiles) as tile_cache:
+        decoded_tiles = tc.DecodedTileCache(tile_cache)
+        tile_canvas = canvas.TileCanvas(decoded_tiles, ZOOM, 300, 200, page_tiles=2, max_pages=2)
+
+        # Positions either side of page strides, including partially off the cached area
+        for x, y in [(0, 0), (511, 10), (512, 300), (700, 511), (1023, 1000), (-50, -20)]:
+            view = tile_canvas.view(x, y)
+            assert view.shape == (200, 300, 3)
+            assert np.array_equal(view, expected_view(decoded_tiles, x, y, 300, 200))
+
+        assert len(tile_canvas._pages) == 2
+
+
+def test_tile_canvas_view_is_zero_copy(tmp_path):
+    tiles = [osm.TilePoint(x, y, ZOOM) for x in range(3) for y in range(3)]
+    with make_tile_cache(str(tmp_path), tiles) as tile_cache:
+        tile_canvas = canvas.TileCanvas(tc.DecodedTileCache(tile_cache), ZOOM, 256, 256)
+        view1 = tile_canvas.view(10, 20)
+        view2 = tile_canvas.view(11, 20)
+        assert np.shares_memory(view1, view2)
+        assert not view1.flags['WRITEABLE']
+        assert tile_canvas.pages_built == 1
+
+
+def test_tile_canvas_planned_tiles_only(tmp_path):
+    tiles = [osm.TilePoint(x, 0, ZOOM) for x in range(2)]
+    with make_tile_cache(str(tmp_path), tiles) as tile_cache:
+        tile_canvas = canvas.TileCanvas(tc.DecodedTileCache(tile_cache), ZOOM, 512, 256, tiles=tiles[:1])
+        view = tile_canvas.view(0, 0)
+        assert view[:, :256].any()
+        assert not view[:, 256:].any()
+
+
+def test_tile_canvas_view_margin(tmp_path):
+    tiles = [osm.TilePoint(x, y, ZOOM) for x in range(4) for y in range(4)]
+    with make_tile_cache(str(tmp_path), tiles) as tile_cache:
+        decoded_tiles = tc.DecodedTileCache(tile_cache)
+        tile_canvas = canvas.TileCanvas(decoded_tiles, ZOOM, 256, 256, page_tiles=1, margin=1)
+        # Top left corner at the last pixel of a page stride, so the margin pixel needs the page overlap
+        view = tile_canvas.view(255, 255, margin=1)
+        assert view.shape == (257, 257, 3)
+        assert np.array_equal(view, expected_view(decoded_tiles, 255, 255, 257, 257))
+
+
+def test_overlay_tile_pixels():
+    pixels = canvas.overlay_tile_pixels([(0.0, 0.0), (10.6, 255.9), (-0.6, 3.0), (256.0, 3.0), (-1.0, 3.0)])
+    assert pixels.tolist() == [[0, 0], [10, 255], [0, 3]]
+
+
+def test_tile_canvas_overlay(tmp_path):
+    tiles = [osm.TilePoint(x, 0, ZOOM) for x in range(2)]
+    with make_tile_cache(str(tmp_path), tiles) as tile_cache:
+        decoded_tiles = tc.DecodedTileCache(tile_cache)
+        overlay = {tiles[1]: canvas.overlay_tile_pixels([(5, 7), (0, 0)])}
+        tile_canvas = canvas.TileCanvas(decoded_tiles, ZOOM, 512, 256, overlay=overlay)
+        view = tile_canvas.view(0, 0)
+        assert tuple(view[7, 256 + 5]) == canvas.OVERLAY_COLOR
+        assert tuple(view[0, 256]) == canvas.OVERLAY_COLOR
+        assert np.array_equal(view[:, :256], expected_view(decoded_tiles, 0, 0, 256, 256))
+
+        # The cached tile is left untouched
+        assert not np.array_equal(decoded_tiles.get(tiles[1])[7, 5], canvas.OVERLAY_COLOR[::-1])
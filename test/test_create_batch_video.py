@@ -0,0 +1,69 @@
+import sys
+import os
+import json
+
+import pytest
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import timeline  # pylint: disable=E0401
+from openstreetmaps_tiler.scripts import create_batch_video as batch  # pylint: disable=E0401
+
+
+def write_manifest(directory, manifest):
+    manifest_filename = str(directory / 'manifest.json')
+    with open(manifest_filename, 'w') as fd:
+        json.dump(manifest, fd)
+    return manifest_filename
+
+
+def test_load_manifest(tmp_path):
+    (tmp_path / 'jobs').mkdir()
+    manifest_filename = write_manifest(tmp_path / 'jobs', {
+        'defaults': {'fps': 30, 'viewport_x': 640},
+        'jobs': [
+            {'gpx': 'ride.gpx', 'view': 'overview', 'output': 'out/overview.mp4', 'tstart': 0, 'tstop': '10:00'},
+            {'gpx': '/data/ride.gpx', 'view': 'chase', 'zoom': 17, 'output': 'chase.mp4', 'fps': 25},
+        ],
+    })
+
+    overview, chase = batch.load_manifest(manifest_filename)
+
+    # Relative paths are relative to the manifest, absolute paths are kept
+    assert overview['gpx'] == str(tmp_path / 'jobs' / 'ride.gpx')
+    assert overview['output'] == str(tmp_path / 'jobs' / 'out' / 'overview.mp4')
+    assert chase['gpx'] == '/data/ride.gpx'
+
+    # Job settings over manifest defaults over built in defaults
+    assert overview['fps'] == 30
+    assert chase['fps'] == 25
+    assert overview['viewport_x'] == chase['viewport_x'] == 640
+    assert overview['viewport_y'] == batch.JOB_DEFAULTS['viewport_y']
+    assert chase['interpolate'] == timeline.INTERPOLATE_NONE
+    assert chase['quality'] == batch.JOB_DEFAULTS['quality']
+
+    # Time bounds are passed on as strings, unset ones as None
+    assert (overview['tstart'], overview['tstop']) == ('0', '10:00')
+    assert (chase['tstart'], chase['tstop']) == (None, None)
+
+
+def test_load_manifest_no_jobs(tmp_path):
+    assert batch.load_manifest(write_manifest(tmp_path, {})) == []
+
+
+@pytest.mark.parametrize('job, message', [
+    ({'view': 'overview', 'output': 'a.mp4'}, 'missing "gpx"'),
+    ({'gpx': 'a.gpx', 'output': 'a.mp4'}, 'missing "view"'),
+    ({'gpx': 'a.gpx', 'view': 'overview'}, 'missing "output"'),
+    ({'gpx': 'a.gpx', 'view': 'sideways', 'output': 'a.mp4'}, 'unknown view "sideways"'),
+    ({'gpx': 'a.gpx', 'view': 'chase', 'output': 'a.mp4'}, 'needs a "zoom"'),
+    ({'gpx': 'a.gpx', 'view': 'overview', 'output': 'a.mp4', 'interpolate': 'cubic'}, 'interpolate must be one of'),
+])
+def test_load_manifest_errors(tmp_path, job, message):
+    manifest_filename = write_manifest(tmp_path, {'jobs': [{'gpx': 'ok.gpx', 'view': 'overview', 'output': 'ok.mp4'}, job]})
+    with pytest.raises(batch.ManifestException) as e:
+        batch.load_manifest(manifest_filename)
+    assert str(e.value).startswith('job 1: ')
+    assert message in str(e.value)
@@ -0,0 +1,172 @@
+import sys
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import canvas  # pylint: disable=E0401
+from openstreetmaps_tiler import gpx  # pylint: disable=E0401
+from openstreetmaps_tiler import openstreetmaps as osm  # pylint: disable=E0401
+from openstreetmaps_tiler import tile_cache as tc  # pylint: disable=E0401
+from openstreetmaps_tiler import tile_downloader  # pylint: disable=E0401
+from openstreetmaps_tiler import timeline  # pylint: disable=E0401
+from openstreetmaps_tiler.scripts import create_chase_video as ch  # pylint: disable=E0401
+
+
+class RecordingDownloader:
+    ''' Stands in for TileDownloader, recording the tiles asked for and failing them all if fail is set '''
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.requested = []
+
+    def download(self, tiles, store):
+        self.requested.extend(tiles)
+        if self.fail and tiles:
+            raise tile_downloader.TileDownloadException('Failed to download %d tiles' % len(tiles))
+        for tile in tiles:
+            tile_data = io.BytesIO()
+            Image.new('RGB', (256, 256)).save(tile_data, 'PNG')
+            store(tile, tile_data.getvalue())
+        return len(tiles)
+
+
+def cache_with_zoom(tile_directory, zoom):
+    ''' Tile cache holding every tile at one zoom '''
+    tile_cache = tc.TileCache(tile_directory)
+    tile_data = io.BytesIO()
+    Image.new('RGB', (256, 256), (0, 128, 0)).save(tile_data, 'PNG')
+    for x in range(2 ** zoom):
+        for y in range(2 ** zoom):
+            tile_cache.put(osm.TilePoint(x, y, zoom), tile_data.getvalue())
+    return tile_cache
+
+
+ZOOM = 15
+TILE_X = 16380
+TILE_Y = 10900
+
+
+def track_at_pixels(pixels_x, pixels_y, zoom=ZOOM):
+    ''' Track through the given global pixel positions, one point a second '''
+    coordinates = osm.pixel_points_to_coordinates(osm.PixelPoint(np.array(pixels_x, dtype=np.float64), np.array(pixels_y, dtype=np.float64), zoom))
+    points = len(pixels_x)
+    return gpx.Track.from_arrays(np.arange(points, dtype=np.float64), coordinates.lat, coordinates.lon, np.zeros(points), np.zeros(points))
+
+
+def edge_track():
+    ''' Track wandering over a few tiles, with repeated pixels and points on (and rounding onto) tile edge pixels '''
+    tile_x = TILE_X * 256
+    tile_y = TILE_Y * 256
+    offsets = [
+        (10.0, 20.0), (10.0, 20.0), (10.2, 19.8), (0.0, 0.0), (255.0, 0.0), (255.6, 12.0), (256.0, 255.0),
+        (300.3, 255.4), (511.0, 256.0), (511.5, 300.0), (600.0, 511.7), (512.0, 512.0), (512.0, 512.0),
+        (450.25, 700.75), (255.5, 767.0), (100.0, 600.0), (10.0, 20.0),
+    ]
+    return track_at_pixels([tile_x + x for x, _ in offsets], [tile_y + y for _, y in offsets])
+
+
+def tiles_in_viewport(pixel_point, viewport_offsets):
+    ''' Tiles covering the viewport around a single pixel point (the original per-point expansion) '''
+    pixel_lo = osm.PixelPoint(pixel_point.x + viewport_offsets.x_lo, pixel_point.y + viewport_offsets.y_lo, pixel_point.zoom)
+    pixel_hi = osm.PixelPoint(pixel_point.x + viewport_offsets.x_hi, pixel_point.y + viewport_offsets.y_hi, pixel_point.zoom)
+    tile_lo = osm.tile_reference(osm.pixel_point_to_tile_point(pixel_lo))
+    tile_hi = osm.tile_reference(osm.pixel_point_to_tile_point(pixel_hi))
+    return [osm.TilePoint(x, y, pixel_point.zoom) for x in range(tile_lo.x, tile_hi.x + 1) for y in range(tile_lo.y, tile_hi.y + 1)]
+
+
+@pytest.mark.parametrize('viewport_offsets', [
+    ch.ViewportOffsets(-200, -150, 200, 150),
+    ch.ViewportOffsets(-511, -511, 511, 511),
+    ch.ViewportOffsets(0, 0, 0, 0),
+])
+def test_plan_track_tiles(viewport_offsets):
+    track = edge_track()
+    track_pixels = osm.coordinates_to_pixel_points(track.coordinates(), ZOOM)
+
+    # Each rounded track point expanded on its own
+    expected = set()
+    for x, y in zip(track_pixels.x.tolist(), track_pixels.y.tolist()):
+        expected.update(tiles_in_viewport(osm.pixel_point_round(osm.PixelPoint(x, y, ZOOM)), viewport_offsets))
+    assert ch.plan_track_tiles(track, ZOOM, viewport_offsets) == sorted(expected)
+
+    # Interpolated frames also need the tiles either side of each fractional position
+    frame_positions = ch.frame_pixel_positions(track_pixels, track.time, fps=7, interpolate=timeline.INTERPOLATE_LINEAR)
+    frame_positions.append((TILE_X * 256 + 767.5, TILE_Y * 256 + 511.25))
+    for x, y in frame_positions:
+        for pixel_x in (np.floor(x), np.ceil(x)):
+            for pixel_y in (np.floor(y), np.ceil(y)):
+                expected.update(tiles_in_viewport(osm.PixelPoint(int(pixel_x), int(pixel_y), ZOOM), viewport_offsets))
+    assert ch.plan_track_tiles(track, ZOOM, viewport_offsets, frame_positions) == sorted(expected)
+
+    assert ch.plan_track_tiles(track[:0], ZOOM, viewport_offsets) == []
+
+
+def test_build_track_overlay():
+    track = edge_track()
+    track_coordinates = track.coordinates()
+
+    # Each point bucketed on its own by its tile, keeping the first of any repeated pixels
+    tile_pixels = {}
+    for lon, lat in zip(track_coordinates.lon.tolist(), track_coordinates.lat.tolist()):
+        coordinate = osm.Coordinate(lon, lat)
+        tile = osm.tile_reference(osm.coordinate_to_tile_point(coordinate, ZOOM))
+        pixel = osm.pixel_point_round(osm.coordinate_to_pixel_point(coordinate, ZOOM))
+        tile_pixel_ref = osm.tile_point_to_pixel_point(tile)
+        location = (pixel.x - tile_pixel_ref.x, pixel.y - tile_pixel_ref.y)
+        if location not in tile_pixels.setdefault(tile, []):
+            tile_pixels[tile].append(location)
+    expected = {tile: sorted(map(tuple, canvas.overlay_tile_pixels(pixels).tolist())) for tile, pixels in tile_pixels.items()}
+
+    overlay = ch.build_track_overlay(track, ZOOM)
+    assert set(overlay) == set(expected)
+    for tile, pixels in overlay.items():
+        assert sorted(map(tuple, pixels.tolist())) == expected[tile]
+        assert len(np.unique(pixels, axis=0)) == len(pixels)
+
+    # Points on the first and last pixels of a tile are kept, points rounding onto the next tile are dropped
+    assert (0, 0) in expected[osm.TilePoint(TILE_X, TILE_Y, ZOOM)]
+    assert (255, 0) in expected[osm.TilePoint(TILE_X, TILE_Y, ZOOM)]
+    assert (0, 255) in expected[osm.TilePoint(TILE_X + 1, TILE_Y, ZOOM)]
+    assert ch.build_track_overlay(track[:0], ZOOM) == {}
+
+
+def test_download_tiles_prefer_synthesis(tmp_path):
+    # Neighbouring zooms are cached: tiles one and two zooms in, and one zoom out, need no downloads
+    tiles = ([osm.TilePoint(x, y, 4) for x in range(4) for y in range(4)] +
+             [osm.TilePoint(x, y, 5) for x in range(3) for y in range(3)] +
+             [osm.TilePoint(x, y, 2) for x in range(4) for y in range(4)])
+    with cache_with_zoom(str(tmp_path), 3) as tile_cache:
+        downloader = RecordingDownloader()
+        synthesizing = tc.SynthesizingTileCache(tile_cache, prefer_synthesis=True)
+        ch.download_tiles(tiles, synthesizing, downloader)
+        assert downloader.requested == []
+
+        decoded_tiles = tc.DecodedTileCache(synthesizing)
+        decoded_tiles.preload(tiles)
+        assert len(decoded_tiles) == len(tiles)
+        assert synthesizing.synthesized == len(tiles)
+
+        # Without preferring synthesis the missing tiles are downloaded
+        downloader = RecordingDownloader()
+        ch.download_tiles(tiles, tc.SynthesizingTileCache(tile_cache), downloader)
+        assert downloader.requested == tiles
+
+
+def test_download_tiles_synthesis_fallback(tmp_path):
+    tiles = [osm.TilePoint(x, y, 4) for x in range(2) for y in range(2)]
+    with cache_with_zoom(str(tmp_path), 3) as tile_cache:
+        # Failed downloads are only an error without synthesis, or for tiles that cannot be synthesized
+        with pytest.raises(tile_downloader.TileDownloadException):
+            ch.download_tiles(tiles, tile_cache, RecordingDownloader(fail=True))
+
+        ch.download_tiles(tiles, tc.SynthesizingTileCache(tile_cache), RecordingDownloader(fail=True))
+
+        with pytest.raises(tile_downloader.TileDownloadException):
+            ch.download_tiles([osm.TilePoint(0, 0, 12)], tc.SynthesizingTileCache(tile_cache), RecordingDownloader(fail=True))
@@ -0,0 +1,59 @@
+import sys
+import os
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import utils  # pylint: disable=E0401
+from openstreetmaps_tiler import openstreetmaps as osm  # pylint: disable=E0401
+from openstreetmaps_tiler.scripts import create_overview_video as ov  # pylint: disable=E0401
+
+
+TRACK_EXTENTS = [
+    utils.CoordinateExtents(osm.Coordinate(151.20, -33.88), osm.Coordinate(151.22, -33.86)),
+    utils.CoordinateExtents(osm.Coordinate(-0.15, 51.49), osm.Coordinate(-0.05, 51.53)),
+    utils.CoordinateExtents(osm.Coordinate(2.0, 40.0), osm.Coordinate(4.0, 41.5)),
+    # Small enough that maximize_zoom stops at its zoom limit
+    utils.CoordinateExtents(osm.Coordinate(151.2000, -33.8700), osm.Coordinate(151.2001, -33.8699)),
+]
+
+
+def test_plan_resolution_default_quality():
+    # The default quality renders from the zoom maximize_zoom picks
+    for track_extents in TRACK_EXTENTS:
+        zoom, _ = utils.maximize_zoom(track_extents, 1022, 1022, 10)
+        plan = ov.plan_resolution(track_extents, 1022, 1022, 10)
+        assert plan.zoom == zoom
+        assert plan.output_pixels == 1022 * 1022
+        assert plan.tiles == utils.tile_grid_size(plan.boundary_extents, plan.zoom)[0] * utils.tile_grid_size(plan.boundary_extents, plan.zoom)[1]
+
+
+def test_plan_resolution_quality():
+    track_extents = TRACK_EXTENTS[0]
+    plan = ov.plan_resolution(track_extents, 1022, 1022, 10)
+
+    # Each doubling of the quality is one zoom level up, downscaling a larger source
+    plan_high = ov.plan_resolution(track_extents, 1022, 1022, 10, quality=2)
+    assert plan_high.zoom == plan.zoom + 2
+    assert plan_high.scale_factor < 0.5
+    assert plan_high.source_pixels > 4 * plan.output_pixels
+    assert plan_high.reducing_gap is None
+
+    # Downscales of REDUCING_GAP or more shrink by whole factors first
+    plan_higher = ov.plan_resolution(track_extents, 1022, 1022, 10, quality=4)
+    assert plan_higher.zoom == plan.zoom + 3
+    assert plan_higher.reducing_gap == ov.REDUCING_GAP
+
+    plan_low = ov.plan_resolution(track_extents, 1022, 1022, 10, quality=0.25)
+    assert plan_low.zoom == plan.zoom - 1
+    assert plan_low.reducing_gap is None
+
+
+def test_plan_resolution_max_tiles():
+    track_extents = TRACK_EXTENTS[0]
+    plan = ov.plan_resolution(track_extents, 1022, 1022, 10, quality=2)
+
+    plan_limited = ov.plan_resolution(track_extents, 1022, 1022, 10, quality=2, max_tiles=plan.tiles - 1)
+    assert plan_limited.zoom < plan.zoom
+    assert plan_limited.tiles <= plan.tiles - 1
@@ -0,0 +1,210 @@
+import sys
+import os
+import math
+
+import numpy as np
+import pytest
+import dateutil.parser as dup
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import gpx  # pylint: disable=E0401
+
+
+GPX_DATA = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1" xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1" version="1.1" creator="test">
+  <metadata>
+    <time>2022-06-29T01:00:00.000Z</time>
+  </metadata>
+  <trk>
+    <trkseg>
+      <trkpt lat="-33.859044" lon="151.205033">
+        <ele>40.5</ele>
+        <time>2022-06-29T01:00:00.000Z</time>
+        <extensions><gpxtpx:TrackPointExtension><gpxtpx:speed>1.25</gpxtpx:speed></gpxtpx:TrackPointExtension></extensions>
+      </trkpt>
+      <trkpt lat="-33.860000" lon="151.206000">
+        <ele>41.0</ele>
+        <time>2022-06-29T01:00:01.000Z</time>
+        <extensions><gpxtpx:TrackPointExtension><gpxtpx:speed>2.5</gpxtpx:speed></gpxtpx:TrackPointExtension></extensions>
+      </trkpt>
+      <trkpt lat="-33.870868" lon="151.211802">
+        <ele>42.0</ele>
+        <time>2022-06-29T01:00:02.500Z</time>
+        <extensions><gpxtpx:TrackPointExtension><gpxtpx:speed>3.0</gpxtpx:speed></gpxtpx:TrackPointExtension></extensions>
+      </trkpt>
+    </trkseg>
+  </trk>
+</gpx>
+'''
+
+START_TIME = 1656464400.0
+
+
+def test_gpx_track_columns():
+    g = gpx.Gpx(GPX_DATA)
+    assert math.isclose(g.start_time(), START_TIME)
+
+    track = g.track
+    assert len(track) == 3
+    assert np.allclose(track.time, [START_TIME, START_TIME + 1.0, START_TIME + 2.5])
+    assert np.allclose(track.lat, [-33.859044, -33.86, -33.870868])
+    assert np.allclose(track.lon, [151.205033, 151.206, 151.211802])
+    assert np.allclose(track.ele, [40.5, 41.0, 42.0])
+    assert np.allclose(track.speed, [1.25, 2.5, 3.0])
+    for column in (track.time, track.lat, track.lon, track.ele, track.speed):
+        assert column.dtype == np.float64
+        assert column.flags['C_CONTIGUOUS']
+
+
+def test_gpx_all_points():
+    g = gpx.Gpx(GPX_DATA)
+    points = list(g.all_points())
+    assert len(points) == 3
+    assert points[1] == {'time': START_TIME + 1.0, 'lat': -33.86, 'lon': 151.206, 'ele': 41.0, 'speed': 2.5}
+
+
+def test_track_slice_is_view():
+    track = gpx.Gpx(GPX_DATA).track
+    sub_track = track[1:]
+    assert len(sub_track) == 2
+    assert np.shares_memory(sub_track.lat, track.lat)
+    assert sub_track[0]['lat'] == track[1]['lat']
+
+
+def test_track_time_range():
+    track = gpx.Gpx(GPX_DATA).track
+
+    sub_track = track.time_range(START_TIME + 0.5, START_TIME + 2.5)
+    assert list(sub_track.time) == [START_TIME + 1.0, START_TIME + 2.5]
+
+    sub_track = track.time_range(tstop=START_TIME + 1.0)
+    assert list(sub_track.time) == [START_TIME, START_TIME + 1.0]
+
+    assert len(track.time_range(START_TIME + 10)) == 0
+
+
+def test_to_time_bound():
+    assert gpx.to_time_bound('90', START_TIME) == START_TIME + 90
+    assert gpx.to_time_bound('+1:30', START_TIME) == START_TIME + 90
+    assert gpx.to_time_bound('-2.5', START_TIME) == START_TIME - 2.5
+    assert gpx.to_time_bound('01:02:03.5', START_TIME) == START_TIME + 3723.5
+    assert gpx.to_time_bound('2022-06-29T01:00:10Z', 0.0) == START_TIME + 10
+
+
+def test_clip_track():
+    g = gpx.Gpx(GPX_DATA)
+
+    track, start_time = gpx.clip_track(g.track, g.start_time(), '0.5')
+    assert list(track.time) == [START_TIME + 1.0, START_TIME + 2.5]
+    assert start_time == START_TIME + 0.5
+
+    track, start_time = gpx.clip_track(g.track, g.start_time(), tstop='2022-06-29T01:00:01Z')
+    assert len(track) == 2
+    assert start_time == START_TIME
+
+
+def test_track_builder():
+    builder = gpx.TrackBuilder()
+    builder.append(1.0, 2.0, 3.0, 4.0, 5.0)
+    builder.append(6.0, 7.0, 8.0, 9.0, 10.0)
+    track = builder.build()
+    assert len(track) == 2
+    assert list(track.speed) == [5.0, 10.0]
+    coordinates = track.coordinates()
+    assert list(coordinates.lon) == [3.0, 8.0]
+    assert list(coordinates.lat) == [2.0, 7.0]
+
+
+def test_gpx_from_file_path_and_file_object(tmp_path):
+    gpx_filename = tmp_path / 'track.gpx'
+    gpx_filename.write_text(GPX_DATA)
+
+    for source in (str(gpx_filename), gpx_filename):
+        g = gpx.Gpx(source)
+        assert math.isclose(g.start_time(), START_TIME)
+        assert len(g.track) == 3
+
+    with open(gpx_filename, 'rb') as fd:
+        g = gpx.Gpx(fd)
+    assert np.allclose(g.track.speed, [1.25, 2.5, 3.0])
+
+    with open(gpx_filename) as fd:
+        g = gpx.Gpx(fd)
+    assert np.allclose(g.track.ele, [40.5, 41.0, 42.0])
+
+
+def test_gpx_without_metadata_time():
+    g = gpx.Gpx(GPX_DATA.replace('<time>2022-06-29T01:00:00.000Z</time>\n  </metadata>', '</metadata>'))
+    assert math.isclose(g.start_time(), START_TIME)
+    assert len(g.track) == 3
+
+
+def test_to_timestamp_matches_dateutil():
+    for time_string in (
+            '2022-06-29T01:00:00Z',
+            '2022-06-29T01:00:00.055Z',
+            '2022-06-29T23:59:59.999999Z',
+            '2024-02-29T12:34:56.7Z',
+            '1969-12-31T23:59:59.500Z',
+    ):
+        assert gpx.to_timestamp(time_string) == dup.parse(time_string).timestamp()
+
+
+def test_to_timestamp_fallback():
+    assert gpx.to_timestamp('2022-06-29T11:00:00+10:00') == START_TIME
+    assert gpx.to_timestamp('2022-06-29 01:00:00.000Z') == START_TIME
+    with pytest.raises(ValueError):
+        gpx.to_timestamp('2022-02-30T01:00:00.000Z')
+
+
+def test_to_timestamps():
+    time_strings = [
+        '2022-06-29T01:00:00.000Z',
+        '2022-06-29T11:00:01+10:00',
+        '2022-06-29T01:00:02.055Z',
+        '2022-06-29T01:00:03Z',
+    ]
+    expected = [dup.parse(time_string).timestamp() for time_string in time_strings]
+
+    timestamps = gpx.to_timestamps(time_strings)
+    assert timestamps.dtype == np.float64
+    assert list(timestamps) == expected
+
+    out = np.zeros(len(time_strings) + 1)
+    gpx.to_timestamps(time_strings, out=out[1:])
+    assert list(out[1:]) == expected
+
+
+def test_gpx_track_cache(tmp_path):
+    gpx_filename = tmp_path / 'track.gpx'
+    gpx_filename.write_text(GPX_DATA)
+
+    g = gpx.Gpx(gpx_filename)
+    assert os.path.exists(str(gpx_filename) + '.track.npy')
+    assert os.path.exists(str(gpx_filename) + '.track.json')
+
+    g_cached = gpx.Gpx(gpx_filename)
+    assert not g_cached.track.columns.flags['WRITEABLE']  # memory mapped from the cache
+    assert g_cached.start_time() == g.start_time()
+    assert np.array_equal(g_cached.track.columns, g.track.columns)
+
+    # Same content with a new mtime is still a cache hit
+    os.utime(gpx_filename, ns=(0, 0))
+    assert not gpx.Gpx(gpx_filename).track.columns.flags['WRITEABLE']
+
+    # Changed content invalidates the cache
+    gpx_filename.write_text(GPX_DATA.replace('<ele>41.0</ele>', '<ele>99.0</ele>'))
+    g_changed = gpx.Gpx(gpx_filename)
+    assert g_changed.track.columns.flags['WRITEABLE']
+    assert g_changed.track.ele[1] == 99.0
+
+
+def test_gpx_track_cache_disabled(tmp_path):
+    gpx_filename = tmp_path / 'track.gpx'
+    gpx_filename.write_text(GPX_DATA)
+
+    gpx.Gpx(gpx_filename, use_cache=False)
+    assert not os.path.exists(str(gpx_filename) + '.track.npy')
@@ -2,6 +2,9 @@ import sys
 import os
 import math
 
+import numpy as np
+import pytest
+
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
@@ -88,3 +91,65 @@ def test_tile_reference():
     assert r.x == 482352
     assert r.y == 314604
     assert r.zoom == 19
+
+
+def test_coordinates_to_pixel_points():
+    c = osm.Coordinate(
+        np.array([151.20503342941282, 151.211802126524]),
+        np.array([-33.85904467277486, -33.870868842232625]),
+    )
+
+    p = osm.coordinates_to_pixel_points(c, 19)
+    for i in range(2):
+        p_expected = osm.coordinate_to_pixel_point(osm.Coordinate(c.lon[i], c.lat[i]), 19)
+        assert math.isclose(p.x[i], p_expected.x)
+        assert math.isclose(p.y[i], p_expected.y)
+
+    c_round_trip = osm.pixel_points_to_coordinates(p)
+    assert np.allclose(c_round_trip.lon, c.lon)
+    assert np.allclose(c_round_trip.lat, c.lat)
+
+
+def test_coordinates_to_tile_points_per_point_zoom():
+    c = osm.Coordinate(np.array([151.20503342941282] * 2), np.array([-33.85904467277486] * 2))
+
+    t = osm.coordinates_to_tile_points(c, np.array([0, 19]))
+    assert math.isclose(t.x[0], 0.9200139817483689)
+    assert math.isclose(t.y[0], 0.600059617392878)
+    assert math.isclose(t.x[1], 482352.29046288884)
+    assert math.isclose(t.y[1], 314604.05668367725)
+
+    r = osm.tile_references(t)
+    assert list(r.x) == [0, 482352]
+    assert list(r.y) == [0, 314604]
+    assert list(r.zoom) == [0, 19]
+
+
+def test_tile_points_to_pixel_points():
+    t = osm.TilePoint(np.array([0.9200139817483689, 482352.29046288884]), np.array([0.600059617392878, 314604.05668367725]), 19)
+    p = osm.tile_points_to_pixel_points(t)
+    assert np.allclose(p.x, t.x * 256)
+    assert np.allclose(p.y, t.y * 256)
+
+    t_round_trip = osm.pixel_points_to_tile_points(p)
+    assert np.allclose(t_round_trip.x, t.x)
+    assert np.allclose(t_round_trip.y, t.y)
+
+
+def test_pixel_points_round():
+    p = osm.PixelPoint(np.array([1.4, 1.6, 2.5]), np.array([-0.6, 3.0, 7.49]), 5)
+    r = osm.pixel_points_round(p)
+    for i in range(3):
+        r_expected = osm.pixel_point_round(osm.PixelPoint(p.x[i], p.y[i], 5))
+        assert r.x[i] == r_expected.x
+        assert r.y[i] == r_expected.y
+
+
+def test_coordinates_out_of_range():
+    c = osm.Coordinate(np.array([0.0, 181.0]), np.array([0.0, 0.0]))
+    with pytest.raises(osm.ConversionException):
+        osm.coordinates_to_pixel_points(c, 10)
+
+    c = osm.Coordinate(np.array([0.0, 0.0]), np.array([0.0, -86.0]))
+    with pytest.raises(osm.ConversionException):
+        osm.coordinates_to_tile_points(c, 10)
@@ -0,0 +1,262 @@
+import sys
+import io
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from PIL import Image
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import openstreetmaps as osm  # pylint: disable=E0401
+from openstreetmaps_tiler import tile_cache as tc  # pylint: disable=E0401
+
+
+def test_tile_cache_scan_and_put(tmp_path):
+    with open(str(tmp_path / 'tile_000001_000002_03.png'), 'wb') as fd:
+        fd.write(b'existing')
+    with open(str(tmp_path / 'unrelated.txt'), 'wb') as fd:
+        fd.write(b'ignored')
+
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        assert len(tile_cache) == 1
+        assert osm.TilePoint(1, 2, 3) in tile_cache
+        assert osm.TilePoint(1.5, 2.9, 3) in tile_cache
+        assert osm.TilePoint(2, 2, 3) not in tile_cache
+        assert tile_cache.get(osm.TilePoint(1, 2, 3)) == b'existing'
+
+        tile_cache.put(osm.TilePoint(2, 2, 3), b'new')
+        assert osm.TilePoint(2, 2, 3) in tile_cache
+        assert tile_cache.tile_path(osm.TilePoint(2, 2, 3)) == str(tmp_path / 'tile_000002_000002_03.png')
+        assert tile_cache.missing([osm.TilePoint(2, 2, 3), osm.TilePoint(4, 4, 3)]) == [osm.TilePoint(4, 4, 3)]
+
+
+def test_tile_cache_manifest_reused(tmp_path, monkeypatch):
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        tile_cache.put(osm.TilePoint(7, 8, 9), b'data')
+
+    def fail_rescan(self):
+        raise AssertionError('manifest should have been loaded without a scan')
+
+    monkeypatch.setattr(tc.TileCache, 'rescan', fail_rescan)
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        assert osm.TilePoint(7, 8, 9) in tile_cache
+
+
+def test_tile_cache_outside_modification(tmp_path):
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        tile_cache.put(osm.TilePoint(7, 8, 9), b'data')
+
+    os.unlink(str(tmp_path / 'tile_000007_000008_09.png'))
+    with open(str(tmp_path / 'tile_000001_000001_09.png'), 'wb') as fd:
+        fd.write(b'data')
+    os.utime(str(tmp_path), ns=(0, 0))
+
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        assert osm.TilePoint(7, 8, 9) not in tile_cache
+        assert osm.TilePoint(1, 1, 9) in tile_cache
+
+
+def test_tile_cache_shared_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(tc.TileCache, 'BUSY_TIMEOUT', 0.5)
+
+    # One cache writing tiles without flushing doesn't lock the manifest against another opening the directory
+    with tc.TileCache(str(tmp_path)) as writer:
+        for x in range(3):
+            writer.put(osm.TilePoint(x, 0, 5), b'data')
+
+        with tc.TileCache(str(tmp_path)) as reader:
+            assert all(osm.TilePoint(x, 0, 5) in reader for x in range(3))
+            reader.put(osm.TilePoint(9, 9, 5), b'data')
+
+        writer.put(osm.TilePoint(3, 0, 5), b'data')
+
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        assert len(tile_cache) == 5
+
+
+def test_tile_cache_manifest_locked(tmp_path, monkeypatch):
+    monkeypatch.setattr(tc.TileCache, 'BUSY_TIMEOUT', 0.1)
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        tile_cache.put(osm.TilePoint(1, 1, 5), b'data')
+    with open(str(tmp_path / 'tile_000002_000002_05.png'), 'wb') as fd:
+        fd.write(b'data')
+
+    # Another process holds the manifest write lock: the directory listing is used instead of a rebuild
+    locker = sqlite3.connect(str(tmp_path / tc.TileCache.MANIFEST_FILENAME))
+    locker.execute('BEGIN IMMEDIATE')
+    try:
+        with tc.TileCache(str(tmp_path)) as tile_cache:
+            assert osm.TilePoint(1, 1, 5) in tile_cache
+            assert osm.TilePoint(2, 2, 5) in tile_cache
+            tile_cache.put(osm.TilePoint(3, 3, 5), b'data')
+    finally:
+        locker.rollback()
+        locker.close()
+
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        assert len(tile_cache) == 3
+
+
+def test_open_tile_cache(tmp_path):
+    with tc.open_tile_cache(str(tmp_path / 'tiles')) as tile_cache:
+        assert isinstance(tile_cache, tc.TileCache)
+    with tc.open_tile_cache(str(tmp_path / 'tiles.mbtiles')) as tile_cache:
+        assert isinstance(tile_cache, tc.MBTilesCache)
+
+
+def test_mbtiles_cache(tmp_path):
+    filename = str(tmp_path / 'tiles.mbtiles')
+    tiles = [osm.TilePoint(x, y, 4) for x in range(4) for y in range(3)]
+
+    with tc.MBTilesCache(filename) as tile_cache:
+        assert tile_cache.missing(tiles) == tiles
+        for tile in tiles:
+            tile_cache.put(tile, b'%d/%d/%d' % (tile.zoom, tile.x, tile.y))
+        # Readable before the batch has been written
+        assert tile_cache.get(osm.TilePoint(1, 2, 4)) == b'4/1/2'
+        tile_cache.flush()
+        assert tile_cache.get(osm.TilePoint(3, 0, 4)) == b'4/3/0'
+        assert tile_cache.open(osm.TilePoint(3, 0, 4)).read() == b'4/3/0'
+
+    with tc.MBTilesCache(filename) as tile_cache:
+        assert len(tile_cache) == len(tiles)
+        assert tile_cache.missing(tiles + [osm.TilePoint(9, 9, 4)]) == [osm.TilePoint(9, 9, 4)]
+
+    # Rows are stored in TMS order
+    db = sqlite3.connect(filename)
+    assert db.execute('SELECT tile_row FROM tiles WHERE zoom_level = 4 AND tile_column = 1 AND tile_data = ?', (b'4/1/2',)).fetchone() == (13,)
+    db.close()
+
+
+def test_mbtiles_cache_concurrent_readers(tmp_path):
+    filename = str(tmp_path / 'tiles.mbtiles')
+    tiles = [osm.TilePoint(x, y, 8) for x in range(20) for y in range(20)]
+    results = []
+
+    with tc.MBTilesCache(filename) as tile_cache:
+        for tile in tiles:
+            tile_cache.put(tile, b'%d,%d' % (tile.x, tile.y))
+        tile_cache.flush()
+
+        def read_all():
+            results.append(all(tile_cache.get(tile) == b'%d,%d' % (tile.x, tile.y) for tile in tiles))
+
+        threads = [threading.Thread(target=read_all) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == [True] * 4
+
+
+def make_png(color):
+    tile_data = io.BytesIO()
+    Image.new('RGB', (256, 256), color).save(tile_data, 'PNG')
+    return tile_data.getvalue()
+
+
+def test_decoded_tile_cache(tmp_path):
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        for x in range(4):
+            tile_cache.put(osm.TilePoint(x, 0, 2), make_png((x, 0, 0)))
+
+        tile_bytes = 256 * 256 * 3
+        decoded_tiles = tc.DecodedTileCache(tile_cache, max_bytes=2 * tile_bytes)
+
+        tile_array = decoded_tiles.get(osm.TilePoint(0, 0, 2))
+        assert tile_array.shape == (256, 256, 3)
+        assert tuple(tile_array[0, 0]) == (0, 0, 0)
+        assert not tile_array.flags['WRITEABLE']
+        assert (decoded_tiles.hits, decoded_tiles.misses) == (0, 1)
+
+        assert decoded_tiles.get(osm.TilePoint(0, 0, 2)) is tile_array
+        assert (decoded_tiles.hits, decoded_tiles.misses) == (1, 1)
+
+        # Byte bound evicts the least recently used tile
+        decoded_tiles.get(osm.TilePoint(1, 0, 2))
+        decoded_tiles.get(osm.TilePoint(0, 0, 2))
+        decoded_tiles.get(osm.TilePoint(2, 0, 2))
+        assert osm.TilePoint(1, 0, 2) not in decoded_tiles
+        assert osm.TilePoint(0, 0, 2) in decoded_tiles
+        assert decoded_tiles.size_bytes == 2 * tile_bytes
+        assert decoded_tiles.evictions == 1
+
+
+def test_decoded_tile_cache_preload(tmp_path):
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        tiles = [osm.TilePoint(x, 1, 3) for x in range(3)]
+        for tile in tiles:
+            tile_cache.put(tile, make_png((0, tile.x, 0)))
+
+        decoded_tiles = tc.DecodedTileCache(tile_cache)
+        decoded_tiles.preload(tiles)
+        assert len(decoded_tiles) == 3
+        assert tuple(decoded_tiles.get(tiles[2])[10, 10]) == (0, 2, 0)
+        assert (decoded_tiles.hits, decoded_tiles.misses) == (1, 0)
+
+
+def test_synthesizing_tile_cache(tmp_path):
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        # Four children of tile (0, 0, 1) and one ancestor (zoom 1) of the tiles at zoom 3
+        for dx in (0, 1):
+            for dy in (0, 1):
+                tile_cache.put(osm.TilePoint(dx, dy, 2), make_png((100 * dx, 100 * dy, 0)))
+        im = Image.new('RGB', (256, 256))
+        im.paste((255, 0, 0), (128, 128, 256, 256))
+        tile_data = io.BytesIO()
+        im.save(tile_data, 'PNG')
+        tile_cache.put(osm.TilePoint(1, 1, 1), tile_data.getvalue())
+
+        synthesizing = tc.SynthesizingTileCache(tile_cache)
+
+        # Downsampled from the four children
+        assert osm.TilePoint(0, 0, 1) in synthesizing
+        with Image.open(synthesizing.open(osm.TilePoint(0, 0, 1))) as im:
+            tile_array = np.asarray(im.convert('RGB'))
+        assert tuple(tile_array[10, 10]) == (0, 0, 0)
+        assert tuple(tile_array[10, 200]) == (100, 0, 0)
+        assert tuple(tile_array[200, 200]) == (100, 100, 0)
+
+        # Cropped and upscaled from the ancestor: (3, 3, 2) is the bottom right quarter of (1, 1, 1)
+        with Image.open(synthesizing.open(osm.TilePoint(3, 3, 2))) as im:
+            assert tuple(np.asarray(im.convert('RGB'))[128, 128]) == (255, 0, 0)
+        assert synthesizing.synthesized == 2
+
+        # Served from memory after the first time
+        synthesizing.get(osm.TilePoint(3, 3, 2))
+        assert synthesizing.synthesized == 2
+
+        # Cached tiles come from the backing cache, and nothing is written to it
+        assert synthesizing.get(osm.TilePoint(1, 0, 2)) == tile_cache.get(osm.TilePoint(1, 0, 2))
+        assert osm.TilePoint(0, 0, 1) not in tile_cache
+
+        # The decoded tile cache takes the synthesized array as is, with no PNG round trip
+        decoded_tiles = tc.DecodedTileCache(synthesizing)
+        assert decoded_tiles.get(osm.TilePoint(3, 3, 2)) is synthesizing.decode(osm.TilePoint(3, 3, 2))
+        assert not decoded_tiles.get(osm.TilePoint(3, 3, 2)).flags['WRITEABLE']
+        assert synthesizing.synthesized == 2
+
+        far = osm.TilePoint(0, 0, 9)
+        assert far not in synthesizing
+        assert synthesizing.unavailable([osm.TilePoint(0, 0, 1), far]) == [far]
+
+
+def test_synthesizing_tile_cache_missing(tmp_path):
+    with tc.TileCache(str(tmp_path)) as tile_cache:
+        tile_cache.put(osm.TilePoint(0, 0, 1), make_png((0, 0, 0)))
+        tiles = [osm.TilePoint(0, 0, 1), osm.TilePoint(1, 1, 2), osm.TilePoint(0, 0, 9)]
+
+        # Without preferring synthesis everything not cached is downloaded
+        assert tc.SynthesizingTileCache(tile_cache).missing(tiles) == tiles[1:]
+        assert tc.SynthesizingTileCache(tile_cache, prefer_synthesis=True).missing(tiles) == tiles[2:]
+
+        # A downloaded tile replaces the synthesized one
+        synthesizing = tc.SynthesizingTileCache(tile_cache)
+        synthesizing.get(osm.TilePoint(1, 1, 2))
+        synthesizing.put(osm.TilePoint(1, 1, 2), make_png((9, 9, 9)))
+        assert synthesizing.get(osm.TilePoint(1, 1, 2)) == make_png((9, 9, 9))
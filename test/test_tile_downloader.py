@@ -0,0 +1,96 @@
+import sys
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import openstreetmaps as osm  # pylint: disable=E0401
+from openstreetmaps_tiler import tile_downloader  # pylint: disable=E0401
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.client_address, self.path, self.headers.get('User-Agent')))
+        if self.path.startswith('/missing/'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TileHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def server_url(server, prefix=''):
+    return 'http://127.0.0.1:%d/%s{zoom}/{x}/{y}.png' % (server.server_address[1], prefix)
+
+
+def test_fetch(tile_server):
+    with tile_downloader.TileDownloader(server_url(tile_server), rate_limit=0) as downloader:
+        assert downloader.fetch(osm.TilePoint(3.7, 5.2, 10)) == b'/10/3/5.png'
+    assert tile_server.requests[0][2] == tile_downloader.DEFAULT_USER_AGENT
+
+
+def test_download_reuses_connections(tile_server):
+    tiles = [osm.TilePoint(x, y, 12) for x in range(10) for y in range(5)]
+    stored = {}
+
+    with tile_downloader.TileDownloader(server_url(tile_server), workers=3, rate_limit=0) as downloader:
+        downloaded = downloader.download(tiles, lambda tile, data: stored.__setitem__(tile, data))
+
+    assert downloaded == len(tiles)
+    assert stored == {tile: b'/12/%d/%d.png' % (tile.x, tile.y) for tile in tiles}
+    # One keep-alive connection per worker, not one per tile
+    client_addresses = set(request[0] for request in tile_server.requests)
+    assert len(client_addresses) <= 3
+
+
+def test_download_failures(tile_server):
+    tiles = [osm.TilePoint(1, 1, 5), osm.TilePoint(2, 1, 5)]
+    stored = []
+
+    with tile_downloader.TileDownloader(server_url(tile_server, 'missing/'), rate_limit=0, retries=0) as downloader:
+        with pytest.raises(tile_downloader.TileDownloadException):
+            downloader.download(tiles, lambda tile, data: stored.append(tile))
+    assert stored == []
+
+
+def test_rate_limiter():
+    rate_limiter = tile_downloader.RateLimiter(50)
+    time_start = time.monotonic()
+    for _ in range(6):
+        rate_limiter.wait()
+    assert time.monotonic() - time_start >= 5 / 50
+
+
+def test_save_tile(tmp_path):
+    output_filename = str(tmp_path / 'tile.png')
+    tile_downloader.save_tile(output_filename, b'data')
+    with open(output_filename, 'rb') as fd:
+        assert fd.read() == b'data'
+    assert os.listdir(str(tmp_path)) == ['tile.png']
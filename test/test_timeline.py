@@ -0,0 +1,81 @@
+import sys
+import os
+
+import numpy as np
+import pytest
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import timeline  # pylint: disable=E0401
+
+
+def stepped_sample_indices(times, fps, start_time):
+    ''' Frame to sample mapping stepping through the samples one at a time '''
+    frames = int((times[-1] - start_time) * fps)
+    tpos_last = tpos_adj = times[0] - start_time
+    index = -1
+    last = 0
+    indices = []
+    for frame in range(frames):
+        while tpos_adj < frame / fps and index < len(times) - 1:
+            index += 1
+            tpos = times[index] - start_time
+            if tpos == tpos_last:
+                tpos_adj += 1 / 18
+            else:
+                tpos_last = tpos_adj = tpos
+            last = index
+        indices.append(last)
+    return indices
+
+
+@pytest.mark.parametrize('times, start_offset', [
+    ([0, 1, 2, 3, 4, 5], 0),
+    ([0, 0, 0, 1, 1, 2, 2, 2, 2, 3, 5, 5], 0),
+    ([0, 0.5, 0.5, 1, 3, 3, 3, 3, 2, 4], -1.5),
+    ([0, 0, 3.5, 3.5, 3.5, 3.5, 3.5, 3.5, 3.5, 3.5, 3.5, 4, 4, 6], 0),
+])
+def test_frame_sample_indices_match_stepping(times, start_offset):
+    times = np.array(times, dtype=np.float64) + 1656464400.0
+    start_time = times[0] + start_offset
+    for fps in (10, 25, 30):
+        expected = stepped_sample_indices(times.tolist(), fps, start_time)
+        assert timeline.frame_sample_indices(times, fps, start_time).tolist() == expected
+
+
+def test_adjusted_times_spread_duplicates():
+    adjusted = timeline.adjusted_times([10.0, 10.0, 11.0, 11.0, 11.0, 12.0])
+    assert adjusted == pytest.approx([1 / 18, 2 / 18, 1.0, 1 + 1 / 18, 1 + 2 / 18, 2.0])
+
+
+def test_frame_positions_interpolate():
+    times = [0.0, 1.0, 2.0]
+    x = [0.0, 10.0, 30.0]
+    y = [5.0, 5.0, 5.0]
+    frame_x, frame_y = timeline.frame_positions(times, x, y, 4, interpolate=timeline.INTERPOLATE_LINEAR)
+    assert len(frame_x) == 8
+    assert frame_x[2] > 0.0
+    assert frame_x[6] == pytest.approx(20.0, abs=3.0)
+    assert np.all(frame_y == 5.0)
+
+    frame_x, _ = timeline.frame_positions(times, x, y, 4)
+    assert set(frame_x.tolist()) <= set(x)
+
+
+def test_spline_interp_passes_through_samples():
+    sample_times = np.array([0.0, 1.0, 2.0, 4.0, 5.0])
+    values = np.array([0.0, 10.0, 15.0, 40.0, 41.0])
+    assert timeline.spline_interp(sample_times, sample_times, values) == pytest.approx(values)
+
+    t = np.linspace(0.0, 5.0, 51)
+    smooth = timeline.spline_interp(t, sample_times, values)
+    assert np.all(np.isfinite(smooth))
+    assert 0.0 < smooth[5] < 10.0
+    assert smooth[5] != pytest.approx(5.0)
+
+
+def test_frame_positions_unknown_interpolation():
+    with pytest.raises(ValueError):
+        timeline.frame_positions([0.0, 1.0], [0.0, 1.0], [0.0, 1.0], 10, interpolate='cubic')
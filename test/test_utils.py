@@ -1,12 +1,16 @@
 import sys
 import os
 import math
+
+import numpy as np
+import pytest
   
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
 from openstreetmaps_tiler import utils  # pylint: disable=E0401
+from openstreetmaps_tiler import openstreetmaps as osm  # pylint: disable=E0401
 
 
 def test_get_track_geo_extents():
@@ -55,4 +59,104 @@ def test_maximize_zoom():
     assert math.isclose(boundary_extents.hi().lat, -33.85868829839835)
 
 
+def test_get_coordinates_geo_extents():
+    coordinates = osm.Coordinate(np.array([1.0, 1.0, 5.0, 9.0]), np.array([1.0, 9.0, 5.0, 1.0]))
+    extents = utils.get_coordinates_geo_extents(coordinates)
+    assert math.isclose(extents.lo().lon, 1.0)
+    assert math.isclose(extents.hi().lon, 9.0)
+    assert math.isclose(extents.lo().lat, 1.0)
+    assert math.isclose(extents.hi().lat, 9.0)
+
+
+def test_paste_array():
+    im_dst = np.zeros((4, 5, 3), dtype=np.uint8)
+    im_src = np.arange(3 * 3 * 3, dtype=np.uint8).reshape(3, 3, 3)
+
+    utils.paste_array(im_dst, im_src, -1, 2)
+    assert np.array_equal(im_dst[2:4, 0:2], im_src[0:2, 1:3])
+    assert not im_dst[0:2].any()
+    assert not im_dst[:, 2:].any()
+
+    # Entirely outside the destination
+    utils.paste_array(im_dst, im_src, 5, 0)
+    utils.paste_array(im_dst, im_src, 0, -3)
+    assert im_dst.sum() == im_src[0:2, 1:3].sum()
+
+
+def test_build_tile_mosaic():
+    def load_tile(column, row):
+        return np.full((4, 4, 3), column * 10 + row, dtype=np.uint8)
+
+    im = utils.build_tile_mosaic(3, 2, load_tile, workers=2, tile_pixels=4)
+    assert im.mode == 'RGB'
+    assert im.size == (12, 8)
+
+    im_array = np.asarray(im)
+    for column in range(3):
+        for row in range(2):
+            assert (im_array[row * 4:(row + 1) * 4, column * 4:(column + 1) * 4] == column * 10 + row).all()
+
+
+def test_build_tile_mosaic_window():
+    loaded = []
+
+    def load_tile(column, row):
+        loaded.append((column, row))
+        return np.full((4, 4, 3), column * 10 + row, dtype=np.uint8)
+
+    im_full = utils.build_tile_mosaic(3, 3, load_tile, tile_pixels=4)
+
+    # Same pixels as cropping the full mosaic, loading only the intersecting tiles
+    box = (5.4, 2.6, 9.5, 7.2)
+    loaded.clear()
+    im = utils.build_tile_mosaic(3, 3, load_tile, tile_pixels=4, window=utils.crop_window(box))
+    assert np.array_equal(np.asarray(im), np.asarray(im_full.crop(box)))
+    assert sorted(loaded) == [(1, 0), (1, 1), (2, 0), (2, 1)]
+
+    # Area outside the grid is black, like Image.crop
+    box = (-2, 10, 3, 14)
+    im = utils.build_tile_mosaic(3, 3, load_tile, tile_pixels=4, window=utils.crop_window(box))
+    assert np.array_equal(np.asarray(im), np.asarray(im_full.crop(box)))
+
+
+def test_tile_grid_size():
+    extents = utils.CoordinateExtents(osm.Coordinate(151.20, -33.88), osm.Coordinate(151.22, -33.86))
+    columns, rows = utils.tile_grid_size(extents, 15)
+    tile_extents = extents.to_tile_extents(15)
+    assert columns == int(tile_extents.hi().x) - int(tile_extents.lo().x) + 1
+    assert rows == int(tile_extents.hi().y) - int(tile_extents.lo().y) + 1
+
+    # Each zoom level doubles the tile grid (give or take a partial tile at the edges)
+    columns_16, rows_16 = utils.tile_grid_size(extents, 16)
+    assert 2 * columns - 2 <= columns_16 <= 2 * columns
+    assert 2 * rows - 2 <= rows_16 <= 2 * rows
+
+
+def test_write_atomic(tmp_path):
+    filename = str(tmp_path / 'output.bin')
+    utils.write_atomic(filename, b'data')
+    with open(filename, 'rb') as fd:
+        assert fd.read() == b'data'
+
+    utils.write_atomic(filename, lambda fd: fd.write(b'written'))
+    with open(filename, 'rb') as fd:
+        assert fd.read() == b'written'
+
+    # Same permissions as a file created with open() (not the temporary file's 0600)
+    with open(str(tmp_path / 'reference'), 'wb') as fd:
+        fd.write(b'data')
+    assert os.stat(filename).st_mode == os.stat(str(tmp_path / 'reference')).st_mode
+
+    # A failed write leaves the existing file and no temporary file behind
+    def fail(fd):
+        fd.write(b'partial')
+        raise ValueError('write failed')
+
+    with pytest.raises(ValueError):
+        utils.write_atomic(filename, fail)
+    with open(filename, 'rb') as fd:
+        assert fd.read() == b'written'
+    assert sorted(os.listdir(str(tmp_path))) == ['output.bin', 'reference']
+
+
 # TODO: add tests: extents classes
\ No newline at end of file
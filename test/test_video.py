@@ -0,0 +1,75 @@
+import sys
+import os
+
+import numpy as np
+import pytest
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from openstreetmaps_tiler import video  # pylint: disable=E0401
+
+
+def test_frame_segments_cover_range():
+    segments = video.frame_segments(0, 221, 4)
+    assert len(segments) == 4
+    assert segments[0][0] == 0
+    assert segments[-1][1] == 221
+    for (_, stop), (start, _) in zip(segments, segments[1:]):
+        assert stop == start
+    lengths = [stop - start for start, stop in segments]
+    assert max(lengths) - min(lengths) <= 1
+
+
+def test_frame_segments_more_segments_than_frames():
+    assert video.frame_segments(10, 13, 8) == [(10, 11), (11, 12), (12, 13)]
+    assert video.frame_segments(0, 0, 4) == []
+
+
+def test_no_frames_no_segments(tmp_path):
+    assert video.frame_segments(0, 0, 4, align=video.GOP_FRAMES) == []
+    with pytest.raises(ValueError):
+        video.concat_segments([], str(tmp_path / 'output.mp4'))
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_segment_filenames():
+    assert video.segment_filenames('out.mp4', 2) == ['out.mp4.segment000.mp4', 'out.mp4.segment001.mp4']
+
+
+def test_frame_segments_aligned_to_key_frames():
+    segments = video.frame_segments(0, 221, 3, align=12)
+    assert segments == [(0, 72), (72, 144), (144, 221)]
+    assert video.frame_segments(0, 20, 4, align=12) == [(0, 12), (12, 20)]
+
+
+class ListVideo:
+    def __init__(self, fail_after=None):
+        self.frames = []
+        self.fail_after = fail_after
+
+    def write(self, frame):
+        if self.fail_after is not None and len(self.frames) >= self.fail_after:
+            raise IOError('encoder failed')
+        self.frames.append(frame)
+
+
+def compose_key(key):
+    return np.full((4, 4, 3), key, dtype=np.uint8)
+
+
+def test_write_frames_in_order_with_reuse():
+    keys = [1, 1, 2, 3, 3, 3, 4] * 10
+    output = ListVideo()
+    stats = video.write_frames(output, keys, compose_key, workers=3, max_queued=4)
+    assert [int(frame[0, 0, 0]) for frame in output.frames] == keys
+    assert stats.frames == len(keys)
+    assert stats.frames_reused == 30
+    assert stats.queue_depth_max <= 4
+    assert stats.bottleneck in ('encode', 'compose')
+
+
+def test_write_frames_writer_error():
+    with pytest.raises(IOError):
+        video.write_frames(ListVideo(fail_after=5), range(100), compose_key, max_queued=2)